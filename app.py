@@ -1,105 +1,137 @@
-from flask import Flask, request, jsonify
-import sqlite3
+from flask import Flask, Response, request, jsonify
 import os
+import hashlib
+import html
+import json
+import queue
+import threading
+from urllib.parse import urlencode
+
+import config_version
+import db
+import migrations
+import log_retention
+import log_search
+import log_stream
+import metrics
+import rule_stats
+import safe_regex
+from config_version import SCOPE_BOTS, SCOPE_RULES
 
 app = Flask(__name__)
 
-# Railway 持久化磁盘建议挂载到 /app/data
-DATA_DIR = os.environ.get("DATA_DIR", "data")
-os.makedirs(DATA_DIR, exist_ok=True)
-
-DB_FILE = os.path.join(DATA_DIR, "bot.db")
-
 def get_db():
-    conn = sqlite3.connect(DB_FILE, timeout=10)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db_if_needed():
-    conn = get_db()
-    cur = conn.cursor()
-
-    # bots
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS bots (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      name TEXT NOT NULL,
-      token TEXT NOT NULL,
-      enabled INTEGER NOT NULL DEFAULT 1
-    )
-    """)
-
-    # rules
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS rules (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      bot_id INTEGER NOT NULL,
-      action_type TEXT DEFAULT 'edit_send',
-      source_group_id TEXT NOT NULL,
-      target_group_id TEXT NOT NULL,
-      user_id TEXT DEFAULT '',
-      user_ids TEXT DEFAULT '',
-      keyword TEXT NOT NULL,
-      enabled INTEGER NOT NULL DEFAULT 1,
-      append_text TEXT DEFAULT '',
-      merchant_regex TEXT DEFAULT '',
-      lookup_url TEXT DEFAULT '',
-      replace_template TEXT DEFAULT '',
-      reply_text TEXT DEFAULT ''
-    )
-    """)
-
-    # logs
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS logs (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      ts TEXT NOT NULL,
-      bot_id INTEGER,
-      rule_id INTEGER,
-      message_type TEXT,
-      message_text TEXT
-    )
-    """)
-
-    # status
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS status (
-      bot_id INTEGER NOT NULL,
-      key TEXT NOT NULL,
-      value TEXT DEFAULT '',
-      PRIMARY KEY (bot_id, key)
-    )
-    """)
-
-    # tg_users
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS tg_users (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      user_id TEXT UNIQUE NOT NULL,
-      name TEXT NOT NULL DEFAULT ''
-    )
-    """)
-
-    # tg_groups
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS tg_groups (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      group_id TEXT UNIQUE NOT NULL,
-      name TEXT NOT NULL DEFAULT ''
-    )
-    """)
-
+    # 连接来自 db 模块的连接池（WAL），conn.close() 归还连接
+    return db.connect()
+
+def parse_timeout(value: str):
+    # 查询接口超时（秒），留空用默认值；返回 (值, 错误信息)
+    value = (value or "").strip()
+    if not value:
+        return None, ""
+    try:
+        t = float(value)
+    except ValueError:
+        return None, "查询超时必须是数字（秒）"
+    if not (0 < t <= 120):
+        return None, "查询超时需在 0~120 秒之间"
+    return t, ""
+
+def commit_config(conn, *scopes):
+    # 提交配置改动并通知 bot_runner 热加载
+    config_version.bump(conn, *scopes)
     conn.commit()
-    conn.close()
+    config_version.notify(*scopes)
 
-def get_last_seen(bot_id: int) -> str:
+def get_bot_status(bot_id: int) -> dict:
+    # bot_runner 定期写入：bot_last_seen / messages_handled / messages_forwarded / errors / last_error /
+    # runner_state / runner_restarts / runner_error
     conn = get_db()
-    row = conn.execute(
-        "SELECT value FROM status WHERE bot_id=? AND key='bot_last_seen'",
-        (bot_id,)
-    ).fetchone()
+    rows = conn.execute("SELECT key, value FROM status WHERE bot_id=?", (bot_id,)).fetchall()
     conn.close()
-    return row["value"] if row and row["value"] else ""
+    return {r["key"]: r["value"] or "" for r in rows}
+
+RUNNER_STATE_CN = {
+    "starting": "🟡 启动中",
+    "running": "🟢 运行中",
+    "stopping": "🟠 停止中",
+    "stopped": "⚪ 已停止",
+    "crashed": "🔴 已崩溃",
+    "backoff": "⏳ 等待重启",
+}
+
+# 列表页（机器人/规则/用户/群）分页：每页条数默认值与上限
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", 50))
+ADMIN_PAGE_MAX = 500
+# 添加规则表单里群/用户下拉框最多列出的条数（最新的在前），更多的直接输入 ID
+ADMIN_SELECT_MAX = int(os.environ.get("ADMIN_SELECT_MAX", 500))
+
+class ListPage:
+    # 列表页的分页与排序参数：?page=&per_page=&sort=&dir=asc|desc；sorts 为 {排序名: SQL 表达式}，
+    # 只接受白名单里的排序名，其它参数不合法时用默认值
+    def __init__(self, sorts: dict, default_sort: str, id_column: str):
+        self.sorts = sorts
+        self.id_column = id_column
+        sort = request.args.get("sort", "")
+        self.sort = sort if sort in sorts else default_sort
+        self.desc = request.args.get("dir", "desc") != "asc"
+        self.per_page = max(1, min(self.arg("per_page", ADMIN_PAGE_SIZE), ADMIN_PAGE_MAX))
+        self.page = max(1, self.arg("page", 1))
+        self.total = 0
+
+    @staticmethod
+    def arg(name: str, default: int) -> int:
+        try:
+            return int(request.args.get(name, ""))
+        except ValueError:
+            return default
+
+    @property
+    def pages(self) -> int:
+        return max(1, (self.total + self.per_page - 1) // self.per_page)
+
+    def count(self, conn, table: str):
+        self.total = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        # 删除后停留的页码超出范围时显示最后一页
+        self.page = min(self.page, self.pages)
+
+    def order_by(self, sorts=None) -> str:
+        direction = "DESC" if self.desc else "ASC"
+        return f"ORDER BY {(sorts or self.sorts)[self.sort]} {direction}, {self.id_column} {direction}"
+
+    def order_sql(self) -> str:
+        return self.order_by() + " LIMIT ? OFFSET ?"
+
+    def limit_params(self) -> tuple:
+        return self.per_page, (self.page - 1) * self.per_page
+
+    def url(self, **changes) -> str:
+        params = {k: v for k, v in request.args.items() if v}
+        params.update({k: v for k, v in changes.items() if v is not None})
+        return request.path + "?" + urlencode(params)
+
+    def sort_url(self, sort: str) -> str:
+        # 点当前排序列切换升降序，点其它列按该列降序；换排序回到第一页
+        desc = not self.desc if sort == self.sort else True
+        return self.url(sort=sort, dir="desc" if desc else "asc", page=1)
+
+# 各列表页模板共用的宏：可排序的表头、分页导航
+LIST_MACROS = """
+{% macro th(p, key, label) -%}
+<th><a href="{{ p.sort_url(key) }}">{{ label }}{% if p.sort == key %}{{ " ▼" if p.desc else " ▲" }}{% endif %}</a></th>
+{%- endmacro %}
+{% macro pager(p) -%}
+<p>共 {{ p.total }} 条{% if p.pages > 1 %}，第 {{ p.page }}/{{ p.pages }} 页：
+  {% if p.page > 1 %}<a href="{{ p.url(page=1) }}">⏮ 首页</a> | <a href="{{ p.url(page=p.page - 1) }}">⬅️ 上一页</a>{% endif %}
+  {% if p.page > 1 and p.page < p.pages %} | {% endif %}
+  {% if p.page < p.pages %}<a href="{{ p.url(page=p.page + 1) }}">下一页 ➡️</a> | <a href="{{ p.url(page=p.pages) }}">末页 ⏭</a>{% endif %}
+{% endif %}</p>
+{%- endmacro %}
+"""
+
+def list_template(source: str):
+    # 模块加载时编译一次；from_string 模板默认开启自动转义
+    return app.jinja_env.from_string(LIST_MACROS + source)
 
 def action_cn(action_type: str) -> str:
     if action_type == "edit_send":
@@ -119,38 +151,51 @@ def home():
       <a href="/rules">📌 规则管理</a> |
       <a href="/users">👤 用户ID 管理</a> |
       <a href="/groups">👥 群ID 管理</a> |
-      <a href="/logs">📜 日志</a>
+      <a href="/logs">📜 日志</a> |
+      <a href="/metrics">📈 运行指标</a>
     </p>
     <hr>
     <p>提示：后台只负责配置；真正监听 Telegram 需要运行 <b>bot_runner.py</b>。</p>
     """
 
 # -------------------- Bots --------------------
-@app.route("/bots")
-def bots_page():
-    conn = get_db()
-    bots = conn.execute("SELECT * FROM bots ORDER BY id DESC").fetchall()
-    conn.close()
-
-    rows = ""
-    for b in bots:
-        last_seen = get_last_seen(int(b["id"]))
-        status_text = f"✅ 心跳: {last_seen}" if last_seen else "⚠️ 暂无心跳"
-        rows += f"""
-        <tr>
-          <td>{b['id']}</td>
-          <td>{b['name']}</td>
-          <td>{"启用" if b['enabled'] else "禁用"}</td>
-          <td>{status_text}</td>
-          <td>
-            <a href="/edit_bot/{b['id']}">编辑</a> |
-            <a href="/toggle_bot/{b['id']}">切换启用/禁用</a> |
-            <a href="/delete_bot/{b['id']}" onclick="return confirm('确定删除这个机器人吗？')">删除</a>
-          </td>
-        </tr>
-        """
-
-    return f"""
+# 机器人列表页显示的 status 键：先在内层查询里排序分页，外层只对本页的机器人 LEFT JOIN status 转成列
+BOT_STATUS_KEYS = (
+    "bot_last_seen", "messages_handled", "messages_forwarded", "errors", "last_error",
+    "runner_state", "runner_restarts", "runner_error", "runner_shard",
+    "dispatch_queue", "dispatch_wait_avg", "dispatch_run_avg", "dispatch_run_max",
+    "send_queue", "send_wait_avg", "send_wait_max", "send_retry_after",
+)
+# 外层排序（本页几十行）用转成列之后的名字
+BOT_SORTS = {
+    "id": "b.id",
+    "name": "b.name",
+    "enabled": "b.enabled",
+    "last_seen": "bot_last_seen",
+    "handled": "CAST(messages_handled AS INTEGER)",
+    "forwarded": "CAST(messages_forwarded AS INTEGER)",
+    "errors": "CAST(errors AS INTEGER)",
+}
+# 内层排序：按 status 列排序时只连接那一个键（sk）
+BOT_PAGE_SORTS = dict(BOT_SORTS, last_seen="sk.value", handled="CAST(sk.value AS INTEGER)",
+                      forwarded="CAST(sk.value AS INTEGER)", errors="CAST(sk.value AS INTEGER)")
+BOT_SORT_STATUS_KEYS = {
+    "last_seen": "bot_last_seen",
+    "handled": "messages_handled",
+    "forwarded": "messages_forwarded",
+    "errors": "errors",
+}
+
+def bots_sql(p: "ListPage") -> str:
+    inner = "SELECT b.* FROM bots b"
+    if p.sort in BOT_SORT_STATUS_KEYS:
+        inner += f" LEFT JOIN status sk ON sk.bot_id = b.id AND sk.key = '{BOT_SORT_STATUS_KEYS[p.sort]}'"
+    inner += " " + p.order_by(BOT_PAGE_SORTS) + " LIMIT ? OFFSET ?"
+    pivot = ", ".join(f"MAX(CASE WHEN s.key = '{k}' THEN s.value END) AS {k}" for k in BOT_STATUS_KEYS)
+    return (f"SELECT b.*, {pivot} FROM ({inner}) b "
+            f"LEFT JOIN status s ON s.bot_id = b.id GROUP BY b.id {p.order_by()}")
+
+BOTS_TEMPLATE = list_template("""
     <h2>🔑 机器人管理（Token）</h2>
     <p>
       <a href="/">⬅️ 返回</a> |
@@ -175,11 +220,50 @@ def bots_page():
 
     <hr>
     <h3>机器人列表</h3>
+    {% if shards %}
+    <p>🧩 分片：{% for k, v in shards %}{{ k[6:] }}：{{ v }}{{ "；" if not loop.last }}{% endfor %}</p>
+    {% endif %}
     <table border="1" cellpadding="8">
-      <tr><th>ID</th><th>名称</th><th>状态</th><th>在线心跳</th><th>操作</th></tr>
-      {rows}
+      <tr>
+        {{ th(p, "id", "ID") }}{{ th(p, "name", "名称") }}{{ th(p, "enabled", "状态") }}{{ th(p, "last_seen", "在线心跳") }}
+        <th>运行状态</th>{{ th(p, "handled", "处理消息") }}{{ th(p, "forwarded", "已发送") }}{{ th(p, "errors", "错误") }}<th>操作</th>
+      </tr>
+      {% for b in bots %}
+      <tr>
+        <td>{{ b.id }}</td>
+        <td>{{ b.name }}</td>
+        <td>{{ "启用" if b.enabled else "禁用" }}</td>
+        <td>{{ "✅ 心跳: " ~ b.bot_last_seen if b.bot_last_seen else "⚠️ 暂无心跳" }}</td>
+        <td title="{{ b.runner_error or '' }}">
+          {{- state_cn.get(b.runner_state, b.runner_state or "-") -}}
+          {% if b.runner_restarts not in (None, "", "0") %}（重启 {{ b.runner_restarts }} 次）{% endif %}
+          {%- if b.runner_shard %} · 分片 {{ b.runner_shard }}{% endif -%}
+        </td>
+        <td title="待执行 {{ b.dispatch_queue or 0 }}，平均排队 {{ b.dispatch_wait_avg or 0 }}s，平均执行 {{ b.dispatch_run_avg or 0 }}s，最长执行 {{ b.dispatch_run_max or 0 }}s">{{ b.messages_handled or 0 }}</td>
+        <td title="排队 {{ b.send_queue or 0 }}，平均等待 {{ b.send_wait_avg or 0 }}s，最长等待 {{ b.send_wait_max or 0 }}s，限流重发 {{ b.send_retry_after or 0 }} 次">{{ b.messages_forwarded or 0 }}</td>
+        <td title="{{ b.last_error or '' }}">{{ b.errors or 0 }}</td>
+        <td>
+          <a href="/edit_bot/{{ b.id }}">编辑</a> |
+          <a href="/toggle_bot/{{ b.id }}">切换启用/禁用</a> |
+          <a href="/delete_bot/{{ b.id }}" onclick="return confirm('确定删除这个机器人吗？')">删除</a>
+        </td>
+      </tr>
+      {% endfor %}
     </table>
-    """
+    {{ pager(p) }}
+""")
+
+@app.route("/bots")
+def bots_page():
+    p = ListPage(BOT_SORTS, "id", "b.id")
+    conn = get_db()
+    p.count(conn, "bots")
+    bots = conn.execute(bots_sql(p), p.limit_params()).fetchall()
+    conn.close()
+
+    # 分片模式下协调进程在 bot_id=0 下写入各分片心跳汇总（shard:<i>）
+    shards = sorted((k, v) for k, v in get_bot_status(0).items() if k.startswith("shard:"))
+    return BOTS_TEMPLATE.render(bots=bots, shards=shards, p=p, state_cn=RUNNER_STATE_CN)
 
 @app.route("/add_bot", methods=["POST"])
 def add_bot():
@@ -190,7 +274,7 @@ def add_bot():
         return "<script>alert('❌ 名称和Token必填');window.location.href='/bots';</script>"
     conn = get_db()
     conn.execute("INSERT INTO bots (name, token, enabled) VALUES (?, ?, ?)", (name, token, enabled))
-    conn.commit()
+    commit_config(conn, SCOPE_BOTS)
     conn.close()
     return "<script>alert('✅ 新增机器人成功');window.location.href='/bots';</script>"
 
@@ -226,7 +310,7 @@ def update_bot(bot_id):
         return "<script>alert('❌ 名称和Token必填');window.history.back();</script>"
     conn = get_db()
     conn.execute("UPDATE bots SET name=?, token=?, enabled=? WHERE id=?", (name, token, enabled, bot_id))
-    conn.commit()
+    commit_config(conn, SCOPE_BOTS)
     conn.close()
     return "<script>alert('✅ 保存成功');window.location.href='/bots';</script>"
 
@@ -237,7 +321,7 @@ def toggle_bot(bot_id):
     if b:
         new_status = 0 if b["enabled"] else 1
         conn.execute("UPDATE bots SET enabled=? WHERE id=?", (new_status, bot_id))
-        conn.commit()
+        commit_config(conn, SCOPE_BOTS)
     conn.close()
     return "<script>alert('🔄 已切换');window.location.href='/bots';</script>"
 
@@ -245,36 +329,20 @@ def toggle_bot(bot_id):
 def delete_bot(bot_id):
     conn = get_db()
     conn.execute("DELETE FROM bots WHERE id=?", (bot_id,))
+    conn.execute("DELETE FROM rule_stats WHERE rule_id IN (SELECT id FROM rules WHERE bot_id=?)", (bot_id,))
     conn.execute("DELETE FROM rules WHERE bot_id=?", (bot_id,))
-    conn.execute("DELETE FROM logs WHERE bot_id=?", (bot_id,))
     conn.execute("DELETE FROM status WHERE bot_id=?", (bot_id,))
-    conn.commit()
+    commit_config(conn, SCOPE_BOTS, SCOPE_RULES)
     conn.close()
+    # 日志可能很多：后台线程分批删除，不阻塞页面也不长时间占用写锁
+    threading.Thread(target=log_retention.delete_bot_logs, args=(bot_id,), daemon=True).start()
     return "<script>alert('🗑️ 已删除');window.location.href='/bots';</script>"
 
 
 # -------------------- Users (tg_users) --------------------
-@app.route("/users")
-def users_page():
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM tg_users ORDER BY id DESC").fetchall()
-    conn.close()
-
-    trs = ""
-    for r in rows:
-        trs += f"""
-        <tr>
-          <td>{r['id']}</td>
-          <td>{r['user_id']}</td>
-          <td>{r['name']}</td>
-          <td>
-            <a href="/edit_user/{r['id']}">编辑</a> |
-            <a href="/delete_user/{r['id']}" onclick="return confirm('确定删除该用户ID吗？')">删除</a>
-          </td>
-        </tr>
-        """
+USER_SORTS = {"id": "id", "user_id": "user_id", "name": "name"}
 
-    return f"""
+USERS_TEMPLATE = list_template("""
     <h2>👤 用户ID 管理</h2>
     <p><a href="/">⬅️ 返回</a> | <a href="/groups">👥 群ID 管理</a> | <a href="/rules">📌 规则管理</a></p>
     <hr>
@@ -289,10 +357,30 @@ def users_page():
     <hr>
     <h3>列表</h3>
     <table border="1" cellpadding="8">
-      <tr><th>ID</th><th>用户ID</th><th>备注名</th><th>操作</th></tr>
-      {trs}
+      <tr>{{ th(p, "id", "ID") }}{{ th(p, "user_id", "用户ID") }}{{ th(p, "name", "备注名") }}<th>操作</th></tr>
+      {% for r in rows %}
+      <tr>
+        <td>{{ r.id }}</td>
+        <td>{{ r.user_id }}</td>
+        <td>{{ r.name }}</td>
+        <td>
+          <a href="/edit_user/{{ r.id }}">编辑</a> |
+          <a href="/delete_user/{{ r.id }}" onclick="return confirm('确定删除该用户ID吗？')">删除</a>
+        </td>
+      </tr>
+      {% endfor %}
     </table>
-    """
+    {{ pager(p) }}
+""")
+
+@app.route("/users")
+def users_page():
+    p = ListPage(USER_SORTS, "id", "id")
+    conn = get_db()
+    p.count(conn, "tg_users")
+    rows = conn.execute("SELECT * FROM tg_users " + p.order_sql(), p.limit_params()).fetchall()
+    conn.close()
+    return USERS_TEMPLATE.render(rows=rows, p=p)
 
 @app.route("/add_user", methods=["POST"])
 def add_user():
@@ -354,27 +442,9 @@ def delete_user(rid):
 
 
 # -------------------- Groups (tg_groups) --------------------
-@app.route("/groups")
-def groups_page():
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM tg_groups ORDER BY id DESC").fetchall()
-    conn.close()
-
-    trs = ""
-    for r in rows:
-        trs += f"""
-        <tr>
-          <td>{r['id']}</td>
-          <td>{r['group_id']}</td>
-          <td>{r['name']}</td>
-          <td>
-            <a href="/edit_group/{r['id']}">编辑</a> |
-            <a href="/delete_group/{r['id']}" onclick="return confirm('确定删除该群ID吗？')">删除</a>
-          </td>
-        </tr>
-        """
+GROUP_SORTS = {"id": "id", "group_id": "group_id", "name": "name"}
 
-    return f"""
+GROUPS_TEMPLATE = list_template("""
     <h2>👥 群ID 管理</h2>
     <p><a href="/">⬅️ 返回</a> | <a href="/users">👤 用户ID 管理</a> | <a href="/rules">📌 规则管理</a></p>
     <hr>
@@ -389,10 +459,30 @@ def groups_page():
     <hr>
     <h3>列表</h3>
     <table border="1" cellpadding="8">
-      <tr><th>ID</th><th>群ID</th><th>备注名</th><th>操作</th></tr>
-      {trs}
+      <tr>{{ th(p, "id", "ID") }}{{ th(p, "group_id", "群ID") }}{{ th(p, "name", "备注名") }}<th>操作</th></tr>
+      {% for r in rows %}
+      <tr>
+        <td>{{ r.id }}</td>
+        <td>{{ r.group_id }}</td>
+        <td>{{ r.name }}</td>
+        <td>
+          <a href="/edit_group/{{ r.id }}">编辑</a> |
+          <a href="/delete_group/{{ r.id }}" onclick="return confirm('确定删除该群ID吗？')">删除</a>
+        </td>
+      </tr>
+      {% endfor %}
     </table>
-    """
+    {{ pager(p) }}
+""")
+
+@app.route("/groups")
+def groups_page():
+    p = ListPage(GROUP_SORTS, "id", "id")
+    conn = get_db()
+    p.count(conn, "tg_groups")
+    rows = conn.execute("SELECT * FROM tg_groups " + p.order_sql(), p.limit_params()).fetchall()
+    conn.close()
+    return GROUPS_TEMPLATE.render(rows=rows, p=p)
 
 @app.route("/add_group", methods=["POST"])
 def add_group():
@@ -454,66 +544,24 @@ def delete_group(rid):
 
 
 # -------------------- Rules --------------------
-@app.route("/rules")
-def rules_page():
-    conn = get_db()
-    bots = conn.execute("SELECT id, name FROM bots ORDER BY id DESC").fetchall()
-    rules = conn.execute("""
-        SELECT r.*, b.name AS bot_name
-        FROM rules r
-        LEFT JOIN bots b ON b.id = r.bot_id
-        ORDER BY r.id DESC
-    """).fetchall()
-
-    tg_users = conn.execute("SELECT * FROM tg_users ORDER BY id DESC").fetchall()
-    tg_groups = conn.execute("SELECT * FROM tg_groups ORDER BY id DESC").fetchall()
-    conn.close()
-
-    user_map = {str(u["user_id"]): (u["name"] or "").strip() for u in tg_users}
-    group_map = {str(g["group_id"]): (g["name"] or "").strip() for g in tg_groups}
-
-    bot_options = "".join([f"<option value='{b['id']}'>{b['id']} - {b['name']}</option>" for b in bots])
-
-    group_options = "".join([
-        f"<option value='{g['group_id']}'>{(g['name'] or '').strip()} ({g['group_id']})</option>"
-        for g in tg_groups
-    ])
-    user_options = "".join([
-        f"<option value='{u['user_id']}'>{(u['name'] or '').strip()} ({u['user_id']})</option>"
-        for u in tg_users
-    ])
-
-    rows = ""
-    for r in rules:
-        act = r["action_type"] or "edit_send"
-        users_raw = (r["user_ids"] or r["user_id"] or "").strip()
-        user_ids_list = [x.strip() for x in users_raw.replace("，", ",").split(",") if x.strip()]
-        users_show = ", ".join([f"{user_map.get(uid)}({uid})" if user_map.get(uid) else uid for uid in user_ids_list])
-
-        src = str(r["source_group_id"])
-        tgt = str(r["target_group_id"])
-        src_show = f"{group_map.get(src)} ({src})" if group_map.get(src) else src
-        tgt_show = f"{group_map.get(tgt)} ({tgt})" if group_map.get(tgt) else tgt
-
-        rows += f"""
-        <tr>
-          <td>{r['id']}</td>
-          <td>{r['bot_id']} - {r['bot_name'] or ''}</td>
-          <td>{action_cn(act)}</td>
-          <td>{src_show}</td>
-          <td>{tgt_show}</td>
-          <td>{users_show}</td>
-          <td>{r['keyword']}</td>
-          <td>{"启用" if r['enabled'] else "禁用"}</td>
-          <td>
-            <a href="/edit_rule/{r['id']}">编辑</a> |
-            <a href="/toggle_rule/{r['id']}">切换启用/禁用</a> |
-            <a href="/delete_rule/{r['id']}" onclick="return confirm('确定删除规则吗？')">删除</a>
-          </td>
-        </tr>
-        """
-
-    html = """
+RULE_SORTS = {
+    "id": "r.id",
+    "bot": "r.bot_id",
+    "action": "r.action_type",
+    "keyword": "r.keyword",
+    "enabled": "r.enabled",
+    # rule_stats（runner 定期写入）；没有统计的规则按 0 / 空排在最后（倒序）或最前（正序）
+    "evaluations": "COALESCE(s.evaluations, 0)",
+    "matches": "COALESCE(s.matches, 0)",
+    "last_match": "s.last_match_at",
+    "p95": "s.p95_ms",
+    "lookup_failures": "COALESCE(s.lookup_failures, 0)",
+}
+
+def split_ids(value: str) -> list:
+    return [x.strip() for x in (value or "").replace("，", ",").split(",") if x.strip()]
+
+RULES_TEMPLATE = list_template("""
     <h2>📌 规则管理</h2>
     <p>
       <a href="/">⬅️ 返回</a> |
@@ -530,10 +578,13 @@ def rules_page():
       关键词支持多个：用逗号分隔。填 * 表示匹配任意消息。<br>
       功能3：自动在源群回复 reply_text（可多行）。<br>
       你可以在「用户ID/群ID」页面先维护备注名，然后这里下拉选择更清晰。
+      {% if select_truncated %}<br>下拉框只列出最新的 {{ select_max }} 个群/用户，其它的请直接输入ID。{% endif %}
     </p>
 
     <form action="/add_rule" method="post">
-      绑定机器人：<select name="bot_id">__BOT_OPTIONS__</select><br><br>
+      绑定机器人：<select name="bot_id">
+        {% for b in bots %}<option value="{{ b.id }}">{{ b.id }} - {{ b.name }}</option>{% endfor %}
+      </select><br><br>
 
       动作类型：
       <select name="action_type">
@@ -545,7 +596,7 @@ def rules_page():
       源群（可选下拉）：
       <select id="src_sel">
         <option value="">-- 选择群 --</option>
-        __GROUP_OPTIONS__
+        {% for g in groups %}<option value="{{ g.group_id }}">{{ (g.name or "").strip() }} ({{ g.group_id }})</option>{% endfor %}
       </select>
       <button type="button" onclick="pickSrc()">使用</button>
       <br><br>
@@ -554,7 +605,7 @@ def rules_page():
       目标群（可选下拉）：
       <select id="tgt_sel">
         <option value="">-- 选择群 --</option>
-        __GROUP_OPTIONS__
+        {% for g in groups %}<option value="{{ g.group_id }}">{{ (g.name or "").strip() }} ({{ g.group_id }})</option>{% endfor %}
       </select>
       <button type="button" onclick="pickTgt()">使用</button>
       <br><br>
@@ -563,7 +614,7 @@ def rules_page():
       用户（可选下拉，可多次追加）：
       <select id="user_sel">
         <option value="">-- 选择用户 --</option>
-        __USER_OPTIONS__
+        {% for u in users %}<option value="{{ u.user_id }}">{{ (u.name or "").strip() }} ({{ u.user_id }})</option>{% endfor %}
       </select>
       <button type="button" onclick="addUser()">追加到用户列表</button>
       <br><br>
@@ -614,8 +665,10 @@ def rules_page():
       <input name="merchant_regex" style="width:720px;" value="商户订单号[:：]\\s*([A-Za-z0-9_-]+)"><br><br>
       查询接口URL（lookup_url）：<br>
       <input name="lookup_url" style="width:720px;" value="https://pay.sxjqwork.com/api/anon/robot/payOrder"><br><br>
-      替换模板（replace_template，{{pay}} 代表 payOrderId）：<br>
-      <input name="replace_template" style="width:720px;" value="支付订单号：{{pay}}"><br><br>
+      替换模板（replace_template，{{ "{{pay}}" }} 代表 payOrderId）：<br>
+      <input name="replace_template" style="width:720px;" value="支付订单号：{{ "{{pay}}" }}"><br><br>
+      查询超时（秒，留空默认 15）：<br>
+      <input name="lookup_timeout" style="width:120px;" value=""><br><br>
 
       <hr>
       <b>功能3参数（自动回复）</b><br>
@@ -627,19 +680,90 @@ def rules_page():
 
     <hr>
     <h3>规则列表</h3>
+    <p style="color:#555;">
+      评估：消息命中关键词、进入逐条检查的次数；命中：实际执行动作的次数；耗时：最近一个统计周期内动作（查询+发送）的 p50/p95。
+      按「评估」正序可找出从不触发的规则。统计由 bot_runner 每 {{ stats_flush_seconds|int }} 秒写入一次。
+    </p>
     <table border="1" cellpadding="8">
       <tr>
-        <th>ID</th><th>机器人</th><th>动作</th><th>源群</th><th>目标群</th>
-        <th>用户ID(可多个)</th><th>关键词</th><th>状态</th><th>操作</th>
+        {{ th(p, "id", "ID") }}{{ th(p, "bot", "机器人") }}{{ th(p, "action", "动作") }}<th>源群</th><th>目标群</th>
+        <th>用户ID(可多个)</th>{{ th(p, "keyword", "关键词") }}{{ th(p, "enabled", "状态") }}
+        {{ th(p, "evaluations", "评估") }}{{ th(p, "matches", "命中") }}{{ th(p, "last_match", "最近命中") }}
+        {{ th(p, "p95", "耗时 p50/p95") }}{{ th(p, "lookup_failures", "查询失败") }}<th>操作</th>
+      </tr>
+      {% for r in rules %}
+      <tr>
+        <td>{{ r.id }}</td>
+        <td>{{ r.bot_id }} - {{ r.bot_name or "" }}</td>
+        <td>{{ action_cn(r.action_type or "edit_send") }}</td>
+        <td>{{ group_show(r.source_group_id) }}</td>
+        <td>{{ group_show(r.target_group_id) }}</td>
+        <td>{{ users_show(r.user_ids or r.user_id) }}</td>
+        <td>{{ r.keyword }}</td>
+        <td>{{ "启用" if r.enabled else "禁用" }}</td>
+        <td title="统计更新于 {{ r.stats_updated_at or '-' }}">{{ r.evaluations or 0 }}</td>
+        <td>{{ r.matches or 0 }}</td>
+        <td>{{ r.last_match_at or "-" }}</td>
+        <td>{% if r.p50_ms is not none %}{{ r.p50_ms }} / {{ r.p95_ms }} ms{% else %}-{% endif %}</td>
+        <td>{{ r.lookup_failures or 0 }}</td>
+        <td>
+          <a href="/edit_rule/{{ r.id }}">编辑</a> |
+          <a href="/toggle_rule/{{ r.id }}">切换启用/禁用</a> |
+          <a href="/delete_rule/{{ r.id }}" onclick="return confirm('确定删除规则吗？')">删除</a>
+        </td>
       </tr>
-      __RULE_ROWS__
+      {% endfor %}
     </table>
-    """
-    html = (html.replace("__BOT_OPTIONS__", bot_options)
-                .replace("__GROUP_OPTIONS__", group_options)
-                .replace("__USER_OPTIONS__", user_options)
-                .replace("__RULE_ROWS__", rows))
-    return html
+    {{ pager(p) }}
+""")
+
+@app.route("/rules")
+def rules_page():
+    p = ListPage(RULE_SORTS, "id", "r.id")
+    conn = get_db()
+    p.count(conn, "rules")
+    rules = conn.execute("""
+        SELECT r.*, b.name AS bot_name,
+               s.evaluations, s.matches, s.lookup_failures, s.last_match_at, s.p50_ms, s.p95_ms,
+               s.updated_at AS stats_updated_at
+        FROM rules r
+        LEFT JOIN bots b ON b.id = r.bot_id
+        LEFT JOIN rule_stats s ON s.rule_id = r.id
+    """ + p.order_sql(), p.limit_params()).fetchall()
+    bots = conn.execute("SELECT id, name FROM bots ORDER BY id DESC").fetchall()
+    users = conn.execute("SELECT user_id, name FROM tg_users ORDER BY id DESC LIMIT ?", (ADMIN_SELECT_MAX + 1,)).fetchall()
+    groups = conn.execute("SELECT group_id, name FROM tg_groups ORDER BY id DESC LIMIT ?", (ADMIN_SELECT_MAX + 1,)).fetchall()
+
+    # 备注名只查本页规则用到的用户/群（user_id、group_id 上有唯一索引）
+    user_ids = sorted({uid for r in rules for uid in split_ids(r["user_ids"] or r["user_id"])})
+    group_ids = sorted({str(r[k]) for r in rules for k in ("source_group_id", "target_group_id")})
+    user_map, group_map = {}, {}
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        user_map.update((str(u["user_id"]), (u["name"] or "").strip()) for u in conn.execute(
+            f"SELECT user_id, name FROM tg_users WHERE user_id IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    for i in range(0, len(group_ids), 500):
+        chunk = group_ids[i:i + 500]
+        group_map.update((str(g["group_id"]), (g["name"] or "").strip()) for g in conn.execute(
+            f"SELECT group_id, name FROM tg_groups WHERE group_id IN ({','.join('?' * len(chunk))})", chunk
+        ))
+    conn.close()
+
+    def group_show(gid) -> str:
+        gid = str(gid)
+        return f"{group_map[gid]} ({gid})" if group_map.get(gid) else gid
+
+    def users_show(value) -> str:
+        return ", ".join(f"{user_map[uid]}({uid})" if user_map.get(uid) else uid for uid in split_ids(value))
+
+    return RULES_TEMPLATE.render(
+        rules=rules, p=p, bots=bots,
+        users=users[:ADMIN_SELECT_MAX], groups=groups[:ADMIN_SELECT_MAX],
+        select_truncated=len(users) > ADMIN_SELECT_MAX or len(groups) > ADMIN_SELECT_MAX,
+        select_max=ADMIN_SELECT_MAX, stats_flush_seconds=rule_stats.RULE_STATS_FLUSH_SECONDS,
+        action_cn=action_cn, group_show=group_show, users_show=users_show,
+    )
 
 @app.route("/add_rule", methods=["POST"])
 def add_rule():
@@ -655,23 +779,29 @@ def add_rule():
     lookup_url = request.form.get("lookup_url", "").strip()
     replace_template = request.form.get("replace_template", "").strip()
     reply_text = request.form.get("reply_text", "").strip()
+    lookup_timeout, err = parse_timeout(request.form.get("lookup_timeout", ""))
+    if not err and action_type == "lookup_replace" and merchant_regex:
+        err = safe_regex.validate(merchant_regex)
 
     if not (bot_id and source_group_id and target_group_id and user_ids and keyword):
         return "<script>alert('❌ 基本字段必须填写（机器人/群/用户/关键词）');window.location.href='/rules';</script>"
+    if err:
+        # 正则的错误信息里可能有引号、反斜杠
+        return f"<script>alert({json.dumps('❌ ' + err, ensure_ascii=False)});window.location.href='/rules';</script>"
 
     conn = get_db()
     conn.execute("""
         INSERT INTO rules
         (bot_id, action_type, source_group_id, target_group_id, user_id, user_ids, keyword, enabled,
-         append_text, merchant_regex, lookup_url, replace_template, reply_text)
-        VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+         append_text, merchant_regex, lookup_url, replace_template, reply_text, lookup_timeout)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
     """, (
         bot_id, action_type, source_group_id, target_group_id,
         user_ids.split(",")[0].strip(),
         user_ids, keyword,
-        append_text, merchant_regex, lookup_url, replace_template, reply_text
+        append_text, merchant_regex, lookup_url, replace_template, reply_text, lookup_timeout
     ))
-    conn.commit()
+    commit_config(conn, SCOPE_RULES)
     conn.close()
     return "<script>alert('✅ 规则添加成功');window.location.href='/rules';</script>"
 
@@ -733,6 +863,7 @@ def edit_rule(rule_id):
       merchant_regex：<input name="merchant_regex" style="width:720px;" value="{r["merchant_regex"] or ""}"><br><br>
       lookup_url：<input name="lookup_url" style="width:720px;" value="{r["lookup_url"] or ""}"><br><br>
       replace_template：<input name="replace_template" style="width:720px;" value="{r["replace_template"] or ""}"><br><br>
+      lookup_timeout（秒）：<input name="lookup_timeout" style="width:120px;" value="{r["lookup_timeout"] if r["lookup_timeout"] is not None else ""}"><br><br>
 
       <hr>
       <b>功能3参数</b><br>
@@ -758,25 +889,31 @@ def update_rule(rule_id):
     lookup_url = request.form.get("lookup_url", "").strip()
     replace_template = request.form.get("replace_template", "").strip()
     reply_text = request.form.get("reply_text", "").strip()
+    lookup_timeout, err = parse_timeout(request.form.get("lookup_timeout", ""))
+    if not err and action_type == "lookup_replace" and merchant_regex:
+        err = safe_regex.validate(merchant_regex)
 
     if not (bot_id and source_group_id and target_group_id and user_ids and keyword):
         return "<script>alert('❌ 基本字段必须填写（机器人/群/用户/关键词）');window.history.back();</script>"
+    if err:
+        # 正则的错误信息里可能有引号、反斜杠
+        return f"<script>alert({json.dumps('❌ ' + err, ensure_ascii=False)});window.history.back();</script>"
 
     conn = get_db()
     conn.execute("""
         UPDATE rules
         SET bot_id=?, action_type=?, source_group_id=?, target_group_id=?,
             user_id=?, user_ids=?, keyword=?, enabled=?,
-            append_text=?, merchant_regex=?, lookup_url=?, replace_template=?, reply_text=?
+            append_text=?, merchant_regex=?, lookup_url=?, replace_template=?, reply_text=?, lookup_timeout=?
         WHERE id=?
     """, (
         bot_id, action_type, source_group_id, target_group_id,
         user_ids.split(",")[0].strip(),
         user_ids, keyword, enabled,
-        append_text, merchant_regex, lookup_url, replace_template, reply_text,
+        append_text, merchant_regex, lookup_url, replace_template, reply_text, lookup_timeout,
         rule_id
     ))
-    conn.commit()
+    commit_config(conn, SCOPE_RULES)
     conn.close()
     return "<script>alert('✅ 保存成功');window.location.href='/rules';</script>"
 
@@ -787,7 +924,7 @@ def toggle_rule(rule_id):
     if r:
         new_status = 0 if r["enabled"] else 1
         conn.execute("UPDATE rules SET enabled=? WHERE id=?", (new_status, rule_id))
-        conn.commit()
+        commit_config(conn, SCOPE_RULES)
     conn.close()
     return "<script>alert('🔄 已切换');window.location.href='/rules';</script>"
 
@@ -795,15 +932,21 @@ def toggle_rule(rule_id):
 def delete_rule(rule_id):
     conn = get_db()
     conn.execute("DELETE FROM rules WHERE id=?", (rule_id,))
-    conn.commit()
+    conn.execute("DELETE FROM rule_stats WHERE rule_id=?", (rule_id,))
+    commit_config(conn, SCOPE_RULES)
     conn.close()
     return "<script>alert('🗑️ 已删除');window.location.href='/rules';</script>"
 
 
 # -------------------- Logs --------------------
+# /logs_json 每次最多返回的行数；页面上最多保留的行数
+LOGS_PAGE_LIMIT = 200
+LOGS_MAX_LIMIT = 1000
+LOGS_KEEP_ROWS = 400
+
 @app.route("/logs")
 def logs_page():
-    return """
+    return f"""
     <h2>📜 日志</h2>
     <p>
       <a href="/">⬅️ 返回</a> |
@@ -814,52 +957,350 @@ def logs_page():
     </p>
     <hr>
 
-    <div id="logs"></div>
+    <form action="/logs/search">
+      🔍 搜索日志内容：<input name="q" size="30" placeholder="订单号、关键字...">
+      <button type="submit">搜索</button>
+    </form>
+    <br>
+
+    <form id="filters" onsubmit="resetLogs(); return false;">
+      机器人ID：<input name="bot_id" size="6">
+      规则ID：<input name="rule_id" size="6">
+      类型：<input name="message_type" size="10" placeholder="text / photo ...">
+      <button type="submit">筛选</button>
+      <span id="hint" style="color:#888;"></span>
+    </form>
+    <br>
 
-    <script>
-    async function loadLogs(){
-      const res = await fetch('/logs_json');
-      const data = await res.json();
+    <table border="1" cellpadding="8">
+      <thead><tr><th>ID</th><th>时间</th><th>机器人</th><th>规则</th><th>类型</th><th>内容</th></tr></thead>
+      <tbody id="logs"></tbody>
+    </table>
+    <p><button id="more" onclick="loadOlder()">加载更早的日志</button></p>
 
-      let html = "<table border='1' cellpadding='8'>";
-      html += "<tr><th>ID</th><th>时间</th><th>机器人</th><th>规则</th><th>类型</th><th>内容</th></tr>";
-
-      data.forEach(l => {
-        html += `<tr>
-          <td>${l.id}</td>
-          <td>${l.ts}</td>
-          <td>${l.bot_id ?? ""}</td>
-          <td>${l.rule_id ?? ""}</td>
-          <td>${l.message_type ?? ""}</td>
-          <td style="max-width:700px; white-space:pre-wrap;">${(l.message_text ?? "").replaceAll("<","&lt;").replaceAll(">","&gt;")}</td>
+    <script>
+    const LIMIT = {LOGS_PAGE_LIMIT};
+    const KEEP = {LOGS_KEEP_ROWS};
+    let latestId = null;
+    let oldestId = null;
+
+    function esc(s) {{
+      return String(s ?? "").replaceAll("&","&amp;").replaceAll("<","&lt;").replaceAll(">","&gt;").replaceAll('"',"&quot;");
+    }}
+
+    function query(extra) {{
+      const params = new URLSearchParams();
+      for (const [k, v] of new FormData(document.getElementById("filters"))) {{
+        if (v.trim()) params.set(k, v.trim());
+      }}
+      params.set("limit", LIMIT);
+      for (const k in extra) params.set(k, extra[k]);
+      return "/logs_json?" + params.toString();
+    }}
+
+    function rowHtml(l) {{
+      return `<tr>
+          <td>${{l.id}}</td>
+          <td>${{esc(l.ts)}}</td>
+          <td>${{esc(l.bot_id)}}</td>
+          <td>${{esc(l.rule_id)}}</td>
+          <td>${{esc(l.message_type)}}</td>
+          <td style="max-width:700px; white-space:pre-wrap;">${{esc(l.message_text)}}</td>
         </tr>`;
-      });
-
-      html += "</table>";
-      document.getElementById("logs").innerHTML = html;
-    }
-
-    loadLogs();
-    setInterval(loadLogs, 3000);
+    }}
+
+    function trim() {{
+      // 只保留最新的 KEEP 行，超出的从底部移除
+      const tbody = document.getElementById("logs");
+      while (tbody.rows.length > KEEP) tbody.deleteRow(-1);
+      if (tbody.rows.length) oldestId = Number(tbody.rows[tbody.rows.length - 1].cells[0].textContent);
+    }}
+
+    function addNew(rows) {{
+      // rows 按 id 从新到旧，插到表格顶部
+      rows = rows.filter(l => latestId === null || l.id > latestId);
+      if (!rows.length) return;
+      document.getElementById("logs").insertAdjacentHTML("afterbegin", rows.map(rowHtml).join(""));
+      latestId = rows[0].id;
+      if (oldestId === null) oldestId = rows[rows.length - 1].id;
+      trim();
+    }}
+
+    async function loadNew() {{
+      // 只取 latestId 之后的新日志；没有新日志时服务端返回 304
+      const res = await fetch(query(latestId === null ? {{}} : {{since_id: latestId}}), {{cache: "no-cache"}});
+      if (!res.ok) return;
+      const data = await res.json();
+      if (data.rows.length) {{
+        document.getElementById("hint").textContent = data.gap ? "（新日志较多，中间部分未显示，可点“加载更早的日志”）" : "";
+      }}
+      addNew(data.rows);
+    }}
+
+    let stream = null;
+    let pollTimer = null;
+
+    function startPolling() {{
+      // 浏览器不支持 SSE 或推送连接被拒绝时退回定时拉取
+      if (pollTimer === null) pollTimer = setInterval(loadNew, 3000);
+    }}
+
+    function openStream() {{
+      // 新日志由服务端推送（/logs/stream）；断线后浏览器自动重连，并用 Last-Event-ID 补齐中间的日志
+      if (stream) stream.close();
+      if (!window.EventSource) {{ startPolling(); return; }}
+      stream = new EventSource(query({{since_id: latestId ?? 0}}).replace("/logs_json", "/logs/stream"));
+      stream.onmessage = e => addNew([JSON.parse(e.data)]);
+      stream.addEventListener("overflow", () => {{
+        // 推送积压过多被服务端断开：重新加载最新一页
+        stream.close();
+        stream = null;
+        resetLogs();
+      }});
+      stream.onerror = () => {{
+        if (stream && stream.readyState === EventSource.CLOSED) {{
+          stream = null;
+          startPolling();
+        }}
+      }};
+    }}
+
+    async function loadOlder() {{
+      if (oldestId === null) return;
+      const res = await fetch(query({{before_id: oldestId}}));
+      if (!res.ok) return;
+      const data = await res.json();
+      if (!data.rows.length) {{
+        document.getElementById("more").disabled = true;
+        return;
+      }}
+      document.getElementById("logs").insertAdjacentHTML("beforeend", data.rows.map(rowHtml).join(""));
+      oldestId = data.rows[data.rows.length - 1].id;
+    }}
+
+    async function resetLogs() {{
+      document.getElementById("logs").innerHTML = "";
+      document.getElementById("hint").textContent = "";
+      document.getElementById("more").disabled = false;
+      latestId = null;
+      oldestId = null;
+      await loadNew();
+      if (pollTimer === null) openStream();
+    }}
+
+    resetLogs();
     </script>
     """
 
+def int_arg(name: str):
+    value = (request.args.get(name) or "").strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} 必须是整数")
+
+def logs_query(since_id, before_id, bot_id, rule_id, message_type: str, order: str):
+    where, params = [], []
+    if since_id is not None:
+        where.append("id > ?")
+        params.append(since_id)
+    if before_id is not None:
+        where.append("id < ?")
+        params.append(before_id)
+    if bot_id is not None:
+        where.append("bot_id = ?")
+        params.append(bot_id)
+    if rule_id is not None:
+        where.append("rule_id = ?")
+        params.append(rule_id)
+    if message_type:
+        where.append("message_type = ?")
+        params.append(message_type)
+    sql = "SELECT * FROM logs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY id {order} LIMIT ?"
+    return sql, params
+
 @app.route("/logs_json")
 def logs_json():
+    # since_id：只返回更新的日志；before_id：往前翻页；bot_id / rule_id / message_type 筛选。
+    # 结果按 id 从新到旧；since_id 之后的新日志超过 limit 时只返回最新的 limit 条并标记 gap
+    try:
+        since_id = int_arg("since_id")
+        before_id = int_arg("before_id")
+        limit = int_arg("limit") or LOGS_PAGE_LIMIT
+        bot_id = int_arg("bot_id")
+        rule_id = int_arg("rule_id")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limit = max(1, min(limit, LOGS_MAX_LIMIT))
+    message_type = (request.args.get("message_type") or "").strip()
+
     conn = get_db()
-    rows = conn.execute("SELECT * FROM logs ORDER BY id DESC LIMIT 400").fetchall()
+    # 表里最小/最大 id 都走主键，代价很小；再加上日志删除计数（中间的行被删时 MIN/MAX 不变）和筛选条件，
+    # 同一组条件下没有新增、没有删除时内容不变
+    bounds = conn.execute("SELECT MIN(id), MAX(id) FROM logs").fetchone()
+    deletions = config_version.read_versions(conn).get(config_version.SCOPE_LOGS, 0)
+    query_key = json.dumps([since_id, before_id, limit, bot_id, rule_id, message_type], ensure_ascii=False)
+    query_hash = hashlib.sha1(query_key.encode("utf-8")).hexdigest()[:12]
+    etag = f'W/"logs-{bounds[0] or 0}-{bounds[1] or 0}-{deletions}-{query_hash}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        conn.close()
+        return Response(status=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    sql, params = logs_query(since_id, before_id, bot_id, rule_id, message_type, "DESC")
+    rows = conn.execute(sql, params + [limit]).fetchall()
     conn.close()
-    return jsonify([{
-        "id": r["id"],
-        "ts": r["ts"],
-        "bot_id": r["bot_id"],
-        "rule_id": r["rule_id"],
-        "message_type": r["message_type"],
-        "message_text": r["message_text"],
-    } for r in rows])
+
+    resp = jsonify({
+        "rows": [log_stream.row_dict(r) for r in rows],
+        "latest_id": bounds[1] or 0,
+        "gap": since_id is not None and len(rows) == limit,
+    })
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@app.route("/logs/search")
+def logs_search():
+    q = (request.args.get("q") or "").strip()
+    error = ""
+    rows, next_before_id = [], None
+    indexing = None
+    try:
+        bot_id = int_arg("bot_id")
+        rule_id = int_arg("rule_id")
+        before_id = int_arg("before_id")
+    except ValueError as e:
+        bot_id = rule_id = before_id = None
+        error = str(e)
+    if q and not error:
+        conn = get_db()
+        try:
+            rows, next_before_id = log_search.search(conn, q, bot_id, rule_id, before_id)
+            indexing = log_search.backfill_progress(conn)
+        except ValueError as e:
+            error = str(e)
+        finally:
+            conn.close()
+
+    def page_url(**extra) -> str:
+        params = {"q": q, "bot_id": bot_id, "rule_id": rule_id, **extra}
+        return "/logs/search?" + urlencode({k: v for k, v in params.items() if v not in (None, "")})
+
+    result_rows = "".join(f"""
+        <tr>
+          <td>{r['id']}</td>
+          <td>{html.escape(str(r['ts'] or ''))}</td>
+          <td>{r['bot_id']}</td>
+          <td>{r['rule_id']}</td>
+          <td>{html.escape(r['message_type'] or '')}</td>
+          <td style="max-width:700px; white-space:pre-wrap;">{log_search.highlight_html(r['hl'])}</td>
+        </tr>
+    """ for r in rows)
+
+    if error:
+        summary = f"<p style='color:red;'>{html.escape(error)}</p>"
+    elif not q:
+        summary = ""
+    elif not rows:
+        summary = "<p>没有找到匹配的日志</p>"
+    else:
+        summary = f"<p>显示 ID {rows[-1]['id']} ~ {rows[0]['id']} 的 {len(rows)} 条结果（从新到旧）</p>"
+    if indexing is not None:
+        summary = f"<p style='color:#b60;'>⏳ 正在为已有日志建立全文索引（约 {indexing}%），较早的日志暂时搜不到</p>" + summary
+
+    pager = []
+    if before_id is not None:
+        pager.append(f'<a href="{html.escape(page_url())}">⏮ 最新</a>')
+    if next_before_id is not None:
+        pager.append(f'<a href="{html.escape(page_url(before_id=next_before_id))}">下一页 ➡️</a>')
+
+    return f"""
+    <h2>🔍 日志搜索</h2>
+    <p><a href="/logs">⬅️ 返回日志</a></p>
+    <hr>
+
+    <form action="/logs/search">
+      关键字：<input name="q" size="30" value="{html.escape(q)}">
+      机器人ID：<input name="bot_id" size="6" value="{bot_id if bot_id is not None else ''}">
+      规则ID：<input name="rule_id" size="6" value="{rule_id if rule_id is not None else ''}">
+      <button type="submit">搜索</button>
+    </form>
+
+    {summary}
+    {'<table border="1" cellpadding="8"><tr><th>ID</th><th>时间</th><th>机器人</th><th>规则</th><th>类型</th><th>内容</th></tr>' + result_rows + '</table>' if rows else ''}
+    <p>{' | '.join(pager)}</p>
+    """
+
+def sse_event(row: dict) -> str:
+    return f"id: {row['id']}\ndata: {json.dumps(row, ensure_ascii=False)}\n\n"
+
+@app.route("/logs/stream")
+def logs_stream():
+    # SSE：先补发 since_id（或断线重连时的 Last-Event-ID）之后的日志，再持续推送新日志。
+    # 每个连接占一个线程，缓冲区满（客户端太慢）时发 overflow 事件并断开
+    try:
+        since_id = int_arg("since_id")
+        bot_id = int_arg("bot_id")
+        rule_id = int_arg("rule_id")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    message_type = (request.args.get("message_type") or "").strip()
+    last_event_id = request.headers.get("Last-Event-ID", "").strip()
+    if last_event_id.isdigit():
+        since_id = int(last_event_id)
+
+    sub = log_stream.Subscriber(bot_id, rule_id, message_type)
+    if not log_stream.broadcaster.subscribe(sub):
+        return Response("too many log viewers", 503)
+
+    def events():
+        sent_id = since_id or 0
+        try:
+            yield "retry: 3000\n\n"
+            if since_id is not None:
+                # 先订阅（推送起点在订阅时定下）再补发，两边重叠的日志按 id 去重
+                sql, params = logs_query(since_id, None, bot_id, rule_id, message_type, "ASC")
+                conn = get_db()
+                rows = conn.execute(sql, params + [LOGS_MAX_LIMIT + 1]).fetchall()
+                conn.close()
+                if len(rows) > LOGS_MAX_LIMIT:
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                for r in rows:
+                    sent_id = r["id"]
+                    yield sse_event(log_stream.row_dict(r))
+            while True:
+                try:
+                    row = sub.queue.get(timeout=15)
+                except queue.Empty:
+                    # 心跳：保持连接，也让已关闭的连接尽快写失败并释放
+                    yield ": ping\n\n"
+                    continue
+                if row is None:
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                if row["id"] <= sent_id:
+                    continue
+                sent_id = row["id"]
+                yield sse_event(row)
+        finally:
+            log_stream.broadcaster.unsubscribe(sub)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/metrics")
+def metrics_page():
+    # Prometheus 抓取入口：合并各 runner 进程本机端口上的 /metrics，tg_runner_up 为 0 表示那个进程没抓到
+    return Response(metrics.collect_runners(), content_type=metrics.CONTENT_TYPE)
 
 if __name__ == "__main__":
-    init_db_if_needed()
+    migrations.migrate()
     port = int(os.environ.get("PORT", 8888))
     print(f"✅ 后台启动成功：http://0.0.0.0:{port}")
     app.run(host="0.0.0.0", port=port)
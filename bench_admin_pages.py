@@ -0,0 +1,131 @@
+import os
+import statistics
+import tempfile
+import time
+
+# 后台列表页渲染耗时：1k 机器人 / 10k 规则 / 50k 用户
+#   改造前：全表 SELECT + 逐行 f-string 拼接，机器人页每行单独查一次 status（N+1）
+#   现在：bots LEFT JOIN status 一次查出、服务端分页排序、模块加载时编译好的模板
+# 用法：python bench_admin_pages.py
+
+BOTS = 1000
+RULES = 10000
+USERS = 50000
+GROUPS = 2000
+REPEAT = 5
+
+STATUS_KEYS = ("bot_last_seen", "messages_handled", "messages_forwarded", "errors", "last_error",
+               "runner_state", "runner_restarts", "dispatch_queue", "send_queue")
+
+
+def seed(conn):
+    conn.executemany("INSERT INTO bots (name, token) VALUES (?, ?)", [(f"机器人{i}", f"{i}:token") for i in range(BOTS)])
+    conn.executemany(
+        "INSERT INTO status (bot_id, key, value) VALUES (?, ?, ?)",
+        [(b, k, str(b * 7 % 1000)) for b in range(1, BOTS + 1) for k in STATUS_KEYS]
+    )
+    conn.executemany("INSERT INTO tg_users (user_id, name) VALUES (?, ?)", [(str(7000000000 + i), f"用户{i}") for i in range(USERS)])
+    conn.executemany("INSERT INTO tg_groups (group_id, name) VALUES (?, ?)", [(f"-100{i}", f"群{i}") for i in range(GROUPS)])
+    conn.executemany(
+        "INSERT INTO rules (bot_id, source_group_id, target_group_id, user_ids, keyword) VALUES (?, ?, ?, ?, ?)",
+        [(i % BOTS + 1, f"-100{i % GROUPS}", f"-100{(i + 1) % GROUPS}",
+          f"{7000000000 + i % USERS},{7000000000 + (i * 7) % USERS}", f"订单号,kw{i}") for i in range(RULES)]
+    )
+    conn.commit()
+
+
+# ---- 改造前的写法（只保留查询与拼接部分） ----
+def legacy_bots(get_db):
+    conn = get_db()
+    bots = conn.execute("SELECT * FROM bots ORDER BY id DESC").fetchall()
+    conn.close()
+    rows = ""
+    for b in bots:
+        conn = get_db()
+        st = {r["key"]: r["value"] or "" for r in conn.execute("SELECT key, value FROM status WHERE bot_id=?", (b["id"],))}
+        conn.close()
+        rows += f"""
+        <tr><td>{b['id']}</td><td>{b['name']}</td><td>{"启用" if b['enabled'] else "禁用"}</td>
+          <td>{st.get("bot_last_seen", "")}</td><td>{st.get("runner_state", "")}</td>
+          <td>{st.get("messages_handled") or 0}</td><td>{st.get("messages_forwarded") or 0}</td><td>{st.get("errors") or 0}</td>
+          <td><a href="/edit_bot/{b['id']}">编辑</a></td></tr>
+        """
+    return rows
+
+def legacy_rules(get_db):
+    conn = get_db()
+    conn.execute("SELECT id, name FROM bots ORDER BY id DESC").fetchall()
+    rules = conn.execute(
+        "SELECT r.*, b.name AS bot_name FROM rules r LEFT JOIN bots b ON b.id = r.bot_id ORDER BY r.id DESC"
+    ).fetchall()
+    tg_users = conn.execute("SELECT * FROM tg_users ORDER BY id DESC").fetchall()
+    tg_groups = conn.execute("SELECT * FROM tg_groups ORDER BY id DESC").fetchall()
+    conn.close()
+    user_map = {str(u["user_id"]): (u["name"] or "").strip() for u in tg_users}
+    group_map = {str(g["group_id"]): (g["name"] or "").strip() for g in tg_groups}
+    options = "".join(f"<option value='{u['user_id']}'>{u['name']} ({u['user_id']})</option>" for u in tg_users)
+    options += "".join(f"<option value='{g['group_id']}'>{g['name']} ({g['group_id']})</option>" for g in tg_groups) * 2
+    rows = ""
+    for r in rules:
+        uids = [x.strip() for x in (r["user_ids"] or "").split(",") if x.strip()]
+        users_show = ", ".join(f"{user_map.get(u)}({u})" if user_map.get(u) else u for u in uids)
+        src, tgt = str(r["source_group_id"]), str(r["target_group_id"])
+        rows += f"""
+        <tr><td>{r['id']}</td><td>{r['bot_id']} - {r['bot_name'] or ''}</td>
+          <td>{group_map.get(src)} ({src})</td><td>{group_map.get(tgt)} ({tgt})</td>
+          <td>{users_show}</td><td>{r['keyword']}</td><td>{"启用" if r['enabled'] else "禁用"}</td></tr>
+        """
+    return options + rows
+
+def legacy_users(get_db):
+    conn = get_db()
+    rows = conn.execute("SELECT * FROM tg_users ORDER BY id DESC").fetchall()
+    conn.close()
+    trs = ""
+    for r in rows:
+        trs += f"""
+        <tr><td>{r['id']}</td><td>{r['user_id']}</td><td>{r['name']}</td>
+          <td><a href="/edit_user/{r['id']}">编辑</a></td></tr>
+        """
+    return trs
+
+
+def timed(fn):
+    samples, size = [], 0
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        size = len(fn())
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000, size
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        # db 模块在导入时按 DATA_DIR 确定数据库路径
+        os.environ["DATA_DIR"] = tmp
+        import app
+        import migrations
+
+        migrations.migrate()
+        conn = app.get_db()
+        seed(conn)
+        conn.close()
+        client = app.app.test_client()
+
+        def page(url):
+            return lambda: client.get(url).get_data()
+
+        cases = (
+            ("机器人", legacy_bots, ("/bots", "/bots?sort=errors&page=10")),
+            ("规则", legacy_rules, ("/rules", "/rules?sort=keyword&dir=asc&page=100")),
+            ("用户", legacy_users, ("/users", "/users?sort=name&page=500")),
+        )
+        print(f"{'页面':<26}{'耗时':>10}{'大小':>12}")
+        for label, legacy, urls in cases:
+            ms, size = timed(lambda: legacy(app.get_db))
+            print(f"{label + '（改造前，全部行）':<20}{ms:>10.1f}ms{size / 1024:>10.0f}KB")
+            for url in urls:
+                ms, size = timed(page(url))
+                print(f"{url:<26}{ms:>10.1f}ms{size / 1024:>10.0f}KB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import db
+import migrations
+
+# 模拟后台与 bot_runner 两个进程同时读写同一个数据库：
+#   后台：改规则 + bump 配置版本、翻日志页；runner：日志攒批写入、状态落盘
+# 对比改造前（回滚日志模式、无索引、每次新建连接）与 db 模块（WAL、索引、连接池）
+# 用法：python bench_db.py
+
+DURATION = float(os.environ.get("BENCH_SECONDS", 5))
+BOTS = 50
+RULES = 2000
+SEED_LOGS = 200000
+LOG_BATCH = 200
+
+# (名称, 角色, 进程数, 两次操作间隔秒数；0 表示不停地做)
+ROLES = (
+    ("后台写规则", "admin_write", 2, 0.05),
+    ("后台读日志", "admin_read", 2, 0),
+    ("runner 写日志", "runner_logs", 1, 0),
+    ("runner 写状态", "runner_status", 1, 0.1),
+)
+
+SCHEMA = """
+CREATE TABLE bots (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, token TEXT NOT NULL, enabled INTEGER NOT NULL DEFAULT 1);
+CREATE TABLE rules (id INTEGER PRIMARY KEY AUTOINCREMENT, bot_id INTEGER NOT NULL, action_type TEXT DEFAULT 'edit_send',
+  source_group_id TEXT NOT NULL, target_group_id TEXT NOT NULL, user_id TEXT DEFAULT '', user_ids TEXT DEFAULT '',
+  keyword TEXT NOT NULL, enabled INTEGER NOT NULL DEFAULT 1, append_text TEXT DEFAULT '', merchant_regex TEXT DEFAULT '',
+  lookup_url TEXT DEFAULT '', replace_template TEXT DEFAULT '', reply_text TEXT DEFAULT '', lookup_timeout REAL);
+CREATE TABLE logs (id INTEGER PRIMARY KEY AUTOINCREMENT, ts TEXT NOT NULL, bot_id INTEGER, rule_id INTEGER,
+  message_type TEXT, message_text TEXT);
+CREATE TABLE status (bot_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT DEFAULT '', PRIMARY KEY (bot_id, key));
+CREATE TABLE config_version (scope TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0);
+"""
+
+
+def seed(path: str, tuned: bool):
+    conn = sqlite3.connect(path)
+    if tuned:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO bots (name, token) VALUES (?, ?)", [(f"b{i}", f"{i}:t") for i in range(BOTS)])
+    conn.executemany(
+        "INSERT INTO rules (bot_id, source_group_id, target_group_id, keyword) VALUES (?, ?, ?, ?)",
+        [(i % BOTS + 1, f"-100{i % 300}", f"-200{i % 300}", f"kw{i}") for i in range(RULES)]
+    )
+    conn.executemany(
+        "INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES (?, ?, ?, 'text', ?)",
+        [(f"2024-01-01 00:{i % 60:02d}:00", i % BOTS + 1, i % RULES + 1, f"msg {i} " * 5) for i in range(SEED_LOGS)]
+    )
+    conn.commit()
+    if tuned:
+        migrations.migrate(conn)
+    conn.close()
+
+def make_connect(path: str, tuned: bool):
+    if tuned:
+        pool = db.ConnectionPool(path)
+        return pool.acquire
+    def legacy():
+        conn = sqlite3.connect(path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+    return legacy
+
+def op_admin_write(conn, rnd):
+    rule_id = rnd.randint(1, RULES)
+    conn.execute("UPDATE rules SET keyword=? WHERE id=?", (f"kw{rnd.random()}", rule_id))
+    conn.execute(
+        "INSERT INTO config_version (scope, version) VALUES ('rules', 1) "
+        "ON CONFLICT(scope) DO UPDATE SET version=version+1"
+    )
+    conn.commit()
+
+def op_admin_read(conn, rnd):
+    bot_id = rnd.randint(1, BOTS)
+    conn.execute("SELECT * FROM logs WHERE bot_id=? ORDER BY id DESC LIMIT 100", (bot_id,)).fetchall()
+    conn.execute("SELECT * FROM rules WHERE bot_id=? AND enabled=1 ORDER BY id DESC", (bot_id,)).fetchall()
+
+def op_runner_logs(conn, rnd):
+    ts = time.strftime("%Y-%m-%d %H:%M:%S")
+    rows = [(ts, rnd.randint(1, BOTS), rnd.randint(1, RULES), "text", "forwarded " * 8) for _ in range(LOG_BATCH)]
+    with conn:
+        conn.executemany(
+            "INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES (?, ?, ?, ?, ?)", rows
+        )
+
+def op_runner_status(conn, rnd):
+    rows = [(b, k, str(rnd.randint(0, 10000))) for b in range(1, BOTS + 1) for k in ("messages_handled", "bot_last_seen")]
+    with conn:
+        conn.executemany(
+            "INSERT INTO status (bot_id, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(bot_id, key) DO UPDATE SET value=excluded.value", rows
+        )
+
+OPS = {
+    "admin_write": op_admin_write,
+    "admin_read": op_admin_read,
+    "runner_logs": op_runner_logs,
+    "runner_status": op_runner_status,
+}
+
+def worker(path: str, tuned: bool, role: str, pace: float, start_at: float, out):
+    connect = make_connect(path, tuned)
+    op = OPS[role]
+    rnd = random.Random(os.getpid())
+    latencies = []
+    errors = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    deadline = start_at + DURATION
+    while time.time() < deadline:
+        t0 = time.perf_counter()
+        conn = connect()
+        try:
+            op(conn, rnd)
+        except sqlite3.OperationalError:
+            errors += 1
+        finally:
+            conn.close()
+        latencies.append(time.perf_counter() - t0)
+        if pace:
+            time.sleep(pace)
+    out.put((role, latencies, errors))
+
+def run(label: str, tuned: bool, tmp: str):
+    path = os.path.join(tmp, f"{'tuned' if tuned else 'legacy'}.db")
+    seed(path, tuned)
+    ctx = multiprocessing.get_context("spawn")
+    out = ctx.Queue()
+    start_at = time.time() + 1.0
+    procs = [ctx.Process(target=worker, args=(path, tuned, role, pace, start_at, out))
+             for _, role, n, pace in ROLES for _ in range(n)]
+    for p in procs:
+        p.start()
+    results = {}
+    for _ in procs:
+        role, latencies, errors = out.get()
+        agg = results.setdefault(role, ([], [0]))
+        agg[0].extend(latencies)
+        agg[1][0] += errors
+    for p in procs:
+        p.join()
+
+    print(f"\n== {label} ==")
+    for name, role, _, _ in ROLES:
+        latencies, errors = results[role]
+        latencies.sort()
+        pct = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+        print(f"{name:<12} {len(latencies) / DURATION:8.1f} 次/秒  p50 {pct(0.5):7.2f} ms  "
+              f"p95 {pct(0.95):7.2f} ms  max {latencies[-1] * 1000:8.2f} ms  锁错误 {errors[0]}")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        run("改造前：回滚日志 + 无索引 + 每次新建连接", False, tmp)
+        run("db 模块：WAL + 索引 + 连接池", True, tmp)
+
+if __name__ == "__main__":
+    main()
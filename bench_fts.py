@@ -0,0 +1,133 @@
+import os
+import random
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import log_search
+import migrations
+
+# 在合成的百万行 logs 上对比 LIKE '%关键字%' 全表扫描与 logs_fts 全文索引：
+#   建索引耗时与磁盘占用、几类典型搜索的延迟、触发器给 runner 写日志带来的额外开销
+# 用法：python bench_fts.py   （BENCH_ROWS 调整行数）
+
+ROWS = int(os.environ.get("BENCH_ROWS", 1000000))
+BOTS = 50
+RULES = 2000
+LOG_BATCH = 200
+WRITE_BATCHES = 300
+REPEAT = 5
+
+TEMPLATES = (
+    "✅ 订单 {order} 支付成功，金额 {amount} 元，商户 M{merchant}",
+    "转发自 @user{user}：查单 {order} 状态 {status}",
+    "商户 M{merchant} 回调超时，订单 {order} 重试中",
+    "photo caption: order {order} amount {amount}",
+    "普通聊天消息 {user} 今天天气不错",
+)
+
+
+def make_row(rnd, i: int):
+    text = rnd.choice(TEMPLATES).format(
+        order=f"P{20240101000000 + i * 7919 % 10 ** 8:014d}",
+        amount=rnd.randint(1, 5000),
+        merchant=rnd.randint(100, 999),
+        user=rnd.randint(1, 5000),
+        status=rnd.choice(("PAID", "PENDING", "FAILED")),
+    )
+    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1700000000 + i))
+    return ts, rnd.randint(1, BOTS), rnd.randint(1, RULES), "text", text
+
+def seed(conn):
+    rnd = random.Random(1)
+    batch = 50000
+    for start in range(0, ROWS, batch):
+        conn.executemany(
+            "INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES (?, ?, ?, ?, ?)",
+            (make_row(rnd, i) for i in range(start, min(ROWS, start + batch)))
+        )
+        conn.commit()
+
+def write_batches(conn) -> float:
+    # runner 的 LogWriter 每批写 LOG_BATCH 行；返回每批平均毫秒数
+    rnd = random.Random(2)
+    t0 = time.perf_counter()
+    for n in range(WRITE_BATCHES):
+        rows = [make_row(rnd, ROWS + n * LOG_BATCH + i) for i in range(LOG_BATCH)]
+        with conn:
+            conn.executemany(
+                "INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES (?, ?, ?, ?, ?)", rows
+            )
+    return (time.perf_counter() - t0) / WRITE_BATCHES * 1000
+
+def timed(fn) -> float:
+    samples = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples) * 1000
+
+def like_search(conn, q: str, bot_id=None):
+    sql = "SELECT * FROM logs WHERE message_text LIKE ?"
+    params = ["%" + q + "%"]
+    if bot_id is not None:
+        sql += " AND bot_id = ?"
+        params.append(bot_id)
+    return conn.execute(sql + " ORDER BY id DESC LIMIT ?", params + [log_search.SEARCH_PAGE_LIMIT]).fetchall()
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        migrations.base_tables(conn)
+        conn.commit()
+
+        t0 = time.perf_counter()
+        seed(conn)
+        print(f"生成 {ROWS} 行日志：{time.perf_counter() - t0:.1f}s，数据库 {os.path.getsize(path) / 2 ** 20:.0f} MB")
+        write_plain = write_batches(conn)
+
+        t0 = time.perf_counter()
+        with conn:
+            migrations.logs_fts_table(conn)
+        print(f"迁移 v10 建表和触发器：{(time.perf_counter() - t0) * 1000:.1f}ms")
+        t0 = time.perf_counter()
+        result = log_search.backfill(conn, pause=0)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"分批补建全文索引（{log_search.fts_tokenizer(conn)}）：{time.perf_counter() - t0:.1f}s，"
+              f"{result['batches']} 批，数据库 {os.path.getsize(path) / 2 ** 20:.0f} MB")
+        write_fts = write_batches(conn)
+
+        # 从三分之一处往后找第一条带订单号的日志（"普通聊天消息" 模板没有订单号）
+        rare = conn.execute(
+            "SELECT message_text FROM logs WHERE id >= ? AND message_text LIKE '%P2024%' ORDER BY id LIMIT 1",
+            (ROWS // 3,)
+        ).fetchone()[0]
+        order = re.search(r"P\d{14}", rare).group(0)
+        cases = (
+            ("完整订单号（唯一）", order, None),
+            ("订单号片段", order[-8:], None),
+            ("常见短语", "回调超时", None),
+            ("常见短语 + 机器人", "回调超时", 7),
+            ("不存在", "ZZZNOTFOUND", None),
+        )
+        print(f"\n{'搜索':<16}{'LIKE 扫描':>12}{'FTS5':>12}{'结果数':>8}")
+        for label, q, bot_id in cases:
+            rows, _ = log_search.search(conn, q, bot_id)
+            like_rows = like_search(conn, q, bot_id)
+            assert [r["id"] for r in rows] == [r["id"] for r in like_rows], label
+            like_ms = timed(lambda: like_search(conn, q, bot_id))
+            fts_ms = timed(lambda: log_search.search(conn, q, bot_id))
+            print(f"{label:<16}{like_ms:>10.1f}ms{fts_ms:>10.1f}ms{len(rows):>8}")
+
+        print(f"\nrunner 每批写 {LOG_BATCH} 行：无索引 {write_plain:.1f}ms，有全文索引 {write_fts:.1f}ms")
+        conn.close()
+
+if __name__ == "__main__":
+    main()
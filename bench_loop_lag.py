@@ -0,0 +1,149 @@
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import db
+import migrations
+
+# 事件循环延迟：bot_runner 的典型数据库操作（读规则、写日志、写状态）在协程里直接同步调用 sqlite3，
+# 对比经过 db.AsyncDB（专用写线程 + 读线程池）。另一个进程不时长时间持有写锁（模拟后台批量改动、日志清理），
+# 探针协程每 5ms 醒一次，醒来的延迟就是所有机器人收消息/发消息会被推迟的时间
+# 用法：python bench_loop_lag.py
+
+DURATION = float(os.environ.get("BENCH_SECONDS", 5))
+BOTS = 20
+RULES_PER_BOT = 100
+PROBE_SECONDS = 0.005
+LOCK_HOLD_SECONDS = 0.2
+
+
+def seed(path: str):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    migrations.migrate(conn)
+    conn.executemany(
+        "INSERT INTO rules (bot_id, source_group_id, target_group_id, user_ids, keyword) VALUES (?, ?, ?, ?, ?)",
+        [(b, f"-100{i % 10}", "-200", "1", f"kw{i}") for b in range(1, BOTS + 1) for i in range(RULES_PER_BOT)]
+    )
+    conn.commit()
+    conn.close()
+
+def lock_holder(path: str, stop_at: float):
+    # 反复开写事务、写一批、持锁一段时间再提交
+    conn = sqlite3.connect(path, timeout=30)
+    rnd = random.Random(1)
+    while time.time() < stop_at:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES ('2024-01-01 00:00:00', ?, 0, 'text', ?)",
+            [(rnd.randint(1, BOTS), "bulk " * 20) for _ in range(2000)]
+        )
+        time.sleep(LOCK_HOLD_SECONDS)
+        conn.commit()
+        time.sleep(0.1)
+    conn.close()
+
+
+def read_rules(conn, bot_id):
+    return conn.execute("SELECT * FROM rules WHERE enabled=1 AND bot_id=? ORDER BY id DESC", (bot_id,)).fetchall()
+
+def write_logs(conn, rows):
+    conn.executemany("INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES (?, ?, ?, ?, ?)", rows)
+
+def write_status(conn, rows):
+    conn.executemany(
+        "INSERT INTO status (bot_id, key, value) VALUES (?, ?, ?) "
+        "ON CONFLICT(bot_id, key) DO UPDATE SET value=excluded.value", rows
+    )
+
+
+class SyncDB:
+    # 改造前：协程里直接调用
+    def __init__(self, conn_pool):
+        self.conn_pool = conn_pool
+
+    async def read(self, fn, *args):
+        conn = self.conn_pool.acquire()
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    async def write(self, fn, *args):
+        conn = self.conn_pool.acquire()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+
+async def workload(adb, deadline: float, counts: dict):
+    async def bot(bot_id):
+        # 规则变更后每条消息都要重新读规则的最坏情况
+        while time.monotonic() < deadline:
+            await adb.read(read_rules, bot_id)
+            counts["reads"] += 1
+            await asyncio.sleep(0.02)
+
+    async def logs():
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        while time.monotonic() < deadline:
+            await adb.write(write_logs, [(ts, 1, 1, "text", "forwarded " * 8)] * 200)
+            counts["writes"] += 1
+            await asyncio.sleep(0.05)
+
+    async def status():
+        while time.monotonic() < deadline:
+            await adb.write(write_status, [(b, "bot_last_seen", str(time.time())) for b in range(1, BOTS + 1)])
+            counts["writes"] += 1
+            await asyncio.sleep(0.1)
+
+    await asyncio.gather(*(bot(b) for b in range(1, BOTS + 1)), logs(), status())
+
+async def probe(deadline: float, lags: list):
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        await asyncio.sleep(PROBE_SECONDS)
+        lags.append(time.perf_counter() - t0 - PROBE_SECONDS)
+
+async def run_mode(make_db) -> tuple:
+    adb = make_db()
+    deadline = time.monotonic() + DURATION
+    lags, counts = [], {"reads": 0, "writes": 0}
+    await asyncio.gather(workload(adb, deadline, counts), probe(deadline, lags))
+    adb.close()
+    return lags, counts
+
+def run(label: str, make_db, path: str):
+    ctx = multiprocessing.get_context("spawn")
+    holder = ctx.Process(target=lock_holder, args=(path, time.time() + DURATION + 0.5))
+    holder.start()
+    time.sleep(0.3)
+    lags, counts = asyncio.run(run_mode(make_db))
+    holder.join()
+
+    lags.sort()
+    pct = lambda q: lags[min(len(lags) - 1, int(len(lags) * q))] * 1000
+    print(f"{label:<28} 循环延迟 p50 {pct(0.5):7.2f} ms  p99 {pct(0.99):7.2f} ms  max {lags[-1] * 1000:7.1f} ms  "
+          f"读 {counts['reads'] / DURATION:6.0f}/s  写 {counts['writes'] / DURATION:5.0f}/s")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        seed(path)
+        conn_pool = db.ConnectionPool(path)
+        run("协程里直接调用 sqlite3", lambda: SyncDB(conn_pool), path)
+        run("db.AsyncDB（写线程 + 读线程池）", lambda: db.AsyncDB(conn_pool), path)
+
+if __name__ == "__main__":
+    main()
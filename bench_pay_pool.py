@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import httpx
+
+import pay_api
+from mini_http import MiniHTTPServer, Response
+from pay_api import query_pay_order_by_mch_order_no
+
+# 本地桩支付接口：验证连接池复用 TCP 连接，并对比每次新建 AsyncClient 的耗时
+# 用法：python bench_pay_pool.py
+
+REQUESTS = 200
+CONCURRENCY = 20
+
+
+async def stub_pay(req):
+    return Response.json({"code": 0, "data": {"payOrderId": "P" + req.query.get("mchOrderNo", "")}})
+
+async def fresh_client_query(url: str, mch_order_no: str):
+    # 改造前的做法：每次请求新建客户端
+    async with httpx.AsyncClient(timeout=15, follow_redirects=True) as client:
+        r = await client.get(url, params={"mchOrderNo": mch_order_no})
+        r.raise_for_status()
+        return r.json()
+
+async def run_batch(fn, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    async def one(i):
+        async with sem:
+            return await fn(i)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(REQUESTS)))
+    return time.perf_counter() - t0
+
+async def main():
+    server = await MiniHTTPServer(stub_pay).start()
+    url = f"http://127.0.0.1:{server.port}/api/anon/robot/payOrder"
+
+    for label, concurrency in (("串行", 1), (f"并发{CONCURRENCY}", CONCURRENCY)):
+        server.connections = 0
+        elapsed = await run_batch(lambda i: query_pay_order_by_mch_order_no(f"M{i}", url), concurrency)
+        pooled_conns = server.connections
+        max_conns = 1 if concurrency == 1 else pay_api.pay_pool.limits.max_connections
+        assert pooled_conns <= max_conns, f"连接未复用：{pooled_conns} 个连接"
+        print(f"连接池   {label:>6}: {REQUESTS} 次请求 {elapsed * 1000:8.1f} ms，新建连接 {pooled_conns}")
+
+        server.connections = 0
+        elapsed = await run_batch(lambda i: fresh_client_query(url, f"M{i}"), concurrency)
+        print(f"每次新建 {label:>6}: {REQUESTS} 次请求 {elapsed * 1000:8.1f} ms，新建连接 {server.connections}")
+
+    await pay_api.pay_pool.aclose()
+    await server.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
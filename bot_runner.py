@@ -1,76 +1,111 @@
 import asyncio
-import sqlite3
+import multiprocessing
+import os
 import re
+import signal
 import time
-import hashlib
-import httpx
-import os
-from datetime import datetime
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
 
-# Railway 持久化磁盘建议挂载到 /app/data
-DATA_DIR = os.environ.get("DATA_DIR", "data")
-os.makedirs(DATA_DIR, exist_ok=True)
-
-DB_FILE = os.path.join(DATA_DIR, "bot.db")
-
-# ⚠️ 重要：请在 Railway 环境变量中设置 ROBOT_SECRET_KEY
-ROBOT_SECRET_KEY = os.environ.get("ROBOT_SECRET_KEY", "RobotSecret123456")
-
-def db_connect():
-    conn = sqlite3.connect(DB_FILE, timeout=10)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_enabled_bots():
-    conn = db_connect()
-    bots = conn.execute("SELECT * FROM bots WHERE enabled=1 ORDER BY id ASC").fetchall()
-    conn.close()
+import config_version
+import db
+import metrics
+import migrations
+from config_version import SCOPE_BOTS, SCOPE_RULES
+from bot_status import (
+    StatusTracker, KEY_HANDLED, KEY_FORWARDED, KEY_ERRORS, KEY_LAST_ERROR,
+    KEY_RUNNER_STATE, KEY_RUNNER_RESTARTS, KEY_RUNNER_ERROR, KEY_RUNNER_SHARD, SHARD_KEY_PREFIX,
+)
+from log_writer import LogWriter
+from log_retention import RetentionTask
+from log_search import BackfillTask
+import log_stream
+from pay_api import pay_pool, order_cache, query_pay_order_cached
+from send_scheduler import SendScheduler
+from dispatch_queue import DispatchQueue
+from supervisor import BotSupervisor, STATE_STOPPED
+from rule_index import RuleIndexCache
+from rule_stats import RuleStats
+from safe_regex import RegexSandboxError, RegexTimeout, sandbox as regex_sandbox
+from sharding import RUNNER_SHARDS, HashRing, ShardWorker, ShardLink
+from webhook import RUNNER_MODE, WEBHOOK_BASE_URL, WebhookIngress
+
+# 未收到后台通知时，多久兜底检查一次配置版本号（秒）
+CONFIG_POLL_SECONDS = float(os.environ.get("CONFIG_POLL_SECONDS", 2))
+# 自建 Bot API 服务器（或压测用的假服务器 loadtest.py）地址，例如 http://127.0.0.1:8081；留空用 api.telegram.org
+TELEGRAM_BASE_URL = os.environ.get("TELEGRAM_BASE_URL", "").strip().rstrip("/")
+
+# 协程里的数据库读写都经过 adb：写操作在专用写线程串行执行，读操作在读线程池，事件循环不等磁盘
+adb = db.AsyncDB()
+
+async def get_enabled_bots():
+    return await adb.fetchall("SELECT * FROM bots WHERE enabled=1 ORDER BY id ASC")
+
+async def enabled_bot_configs():
+    # [(bot_id, token, name)]，跳过 token 为空的机器人
+    bots = []
+    for b in await get_enabled_bots():
+        token = str(b["token"]).strip()
+        if not token:
+            print(f"⚠️ bot_id={b['id']} token 为空，跳过")
+            continue
+        bots.append((int(b["id"]), token, str(b["name"]).strip()))
     return bots
 
-def load_rules_for_bot(bot_id: int):
-    conn = db_connect()
-    rows = conn.execute("SELECT * FROM rules WHERE enabled=1 AND bot_id=? ORDER BY id DESC", (bot_id,)).fetchall()
-    conn.close()
-    return rows
+async def load_rules_for_bot(bot_id: int):
+    return await adb.fetchall("SELECT * FROM rules WHERE enabled=1 AND bot_id=? ORDER BY id DESC", (bot_id,))
+
+status_tracker = StatusTracker(adb)
 
 def set_heartbeat(bot_id: int):
-    conn = db_connect()
-    conn.execute(
-        "INSERT INTO status (bot_id, key, value) VALUES (?, 'bot_last_seen', ?) "
-        "ON CONFLICT(bot_id, key) DO UPDATE SET value=excluded.value",
-        (bot_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-    )
-    conn.commit()
-    conn.close()
+    status_tracker.touch(bot_id)
+
+log_writer = LogWriter(adb, on_flush=log_stream.notify)
+
+rule_stats = RuleStats(adb)
+
+send_schedulers = {}
+dispatchers = {}
+
+def collect_runtime_stats():
+    out = {}
+    for bot_id, scheduler in send_schedulers.items():
+        st = scheduler.stats()
+        out.setdefault(bot_id, {}).update({
+            "send_queue": st["waiting"],
+            "send_wait_avg": st["wait_avg"],
+            "send_wait_max": st["wait_max"],
+            "send_retry_after": st["retry_after"],
+        })
+    for bot_id, dispatcher in dispatchers.items():
+        st = dispatcher.stats()
+        out.setdefault(bot_id, {}).update({
+            "dispatch_queue": st["depth"],
+            "dispatch_wait_avg": st["wait_avg"],
+            "dispatch_run_avg": st["run_avg"],
+            "dispatch_run_max": st["run_max"],
+        })
+    return out
+
+status_tracker.add_collector(collect_runtime_stats)
+
+metrics.Gauge("tg_dispatch_queue", "等待执行的规则动作数", ("bot_id",),
+              collect=lambda: [((b,), d.depth()) for b, d in list(dispatchers.items())])
+metrics.Gauge("tg_send_queue", "在限流令牌桶里排队的发送请求数", ("bot_id",),
+              collect=lambda: [((b,), s.waiting) for b, s in list(send_schedulers.items())])
+metrics.Gauge("tg_log_queue", "内存里待写入数据库的日志条数", collect=lambda: [((), log_writer.queue.qsize())])
+metrics.Counter("tg_logs_written_total", "写入数据库的日志条数", collect=lambda: [((), log_writer.written)])
+metrics.Counter("tg_logs_dropped_total", "日志队列满被丢弃的条数", collect=lambda: [((), log_writer.dropped)])
+metrics.Counter("tg_lookup_cache_total", "商户订单号查询缓存：hit 命中，miss 实际查询，shared 合并到进行中的查询", ("result",),
+                collect=lambda: [(("hit",), order_cache.hits), (("miss",), order_cache.misses),
+                                 (("shared",), order_cache.shared)])
 
 def write_log(bot_id, rule_id, message_type, message_text):
-    conn = db_connect()
-    conn.execute(
-        "INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES (?, ?, ?, ?, ?)",
-        (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), bot_id, rule_id, message_type, (message_text or "")[:5000])
-    )
-    conn.commit()
-    conn.close()
-
-def normalize_list(s: str):
-    s = (s or "").replace("，", ",").strip()
-    return [x.strip() for x in s.split(",") if x.strip()]
-
-def normalize_keywords(keyword_field: str):
-    k = (keyword_field or "").strip()
-    if k == "*":
-        return ["*"]
-    return normalize_list(k)
-
-def normalize_user_ids(rule_row):
-    ids = (rule_row["user_ids"] if "user_ids" in rule_row.keys() else "") or ""
-    ids = ids.strip()
-    if ids:
-        return set(normalize_list(ids))
-    old = str(rule_row["user_id"] or "").strip()
-    return set([old]) if old else set()
+    # 每次规则动作发送成功后才写日志，顺便计入已转发数
+    status_tracker.incr(bot_id, KEY_FORWARDED)
+    log_writer.put(bot_id, rule_id, message_type, message_text)
+
+rule_cache = RuleIndexCache(load_rules_for_bot)
 
 def extract_text_for_match(msg):
     return msg.text or msg.caption or ""
@@ -124,55 +159,102 @@ async def send_as_bot(update: Update, context: ContextTypes.DEFAULT_TYPE, target
     except Exception:
         await context.bot.send_message(chat_id=target_group_id, text=final_text)
 
-def robot_sign(params: dict, secret_key: str) -> str:
-    items = []
-    for k in sorted(params.keys()):
-        if k == "sign":
-            continue
-        v = params.get(k)
-        if v is None:
-            continue
-        sv = str(v).strip()
-        if sv == "":
-            continue
-        items.append(f"{k}={sv}")
-    raw = "&".join(items) + f"&key={secret_key}"
-    return hashlib.md5(raw.encode("utf-8")).hexdigest().upper()
-
-async def call_pay_api(base_api: str, query_params: dict) -> dict:
-    async with httpx.AsyncClient(timeout=15, follow_redirects=True) as client:
-        r = await client.get(base_api, params=query_params)
-        r.raise_for_status()
-        return r.json()
-
-async def query_pay_order_by_mch_order_no(mch_order_no: str, base_api: str):
-    async def do_request(ts: str) -> dict:
-        params = {"mchOrderNo": mch_order_no, "timestamp": ts}
-        params["sign"] = robot_sign(params, ROBOT_SECRET_KEY)
-        return await call_pay_api(base_api, params)
-
-    ts_ms = str(int(time.time() * 1000))
-    ts_s = str(int(time.time()))
-
-    last = None
-    for ts in (ts_ms, ts_s):
+ACTION_TYPES = ("auto_reply", "edit_send", "lookup_replace")
+
+async def run_action(bot_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE, r, matched: str, mch_order_no):
+    msg = update.message
+    chat_id = str(update.effective_chat.id)
+    user_id = str(update.effective_user.id)
+    text_for_match = extract_text_for_match(msg)
+    msg_type = detect_message_type(msg)
+    rule_id = r.id
+    target_group_id = r.target_group_id
+
+    # 功能3：自动回复
+    if r.action_type == "auto_reply":
+        reply_text = r.reply_text
+        try:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text=reply_text,
+                reply_to_message_id=msg.message_id
+            )
+        except Exception:
+            await context.bot.send_message(chat_id=chat_id, text=reply_text)
+
+        write_log(bot_id, rule_id, msg_type, f"[自动回复] 用户:{user_id} kw:{matched}\n{reply_text}")
+        return
+
+    # 功能1：编辑后发送
+    if r.action_type == "edit_send":
+        final_text = merge_text(text_for_match, r.append_text)
+        await send_as_bot(update, context, target_group_id, final_text)
+        write_log(bot_id, rule_id, msg_type, final_text)
+        return
+
+    # 功能2：查询替换后发送
+    if r.action_type == "lookup_replace":
+        base_api = r.lookup_url
+
+        if not base_api:
+            final_text = f"{text_for_match}\n\n⚠️ 规则未配置 lookup_url（查询接口URL）"
+            await send_as_bot(update, context, target_group_id, final_text)
+            write_log(bot_id, rule_id, msg_type, final_text)
+            return
+
+        pay_order_id, debug = await query_pay_order_cached(mch_order_no, base_api, r.lookup_timeout)
+
+        if not pay_order_id:
+            rule_stats.lookup_failed(rule_id)
+            final_text = f"{text_for_match}\n\n⚠️ 未查询到支付订单号（商户订单号：{mch_order_no}）\n调试：{debug}"
+            await send_as_bot(update, context, target_group_id, final_text)
+            write_log(bot_id, rule_id, msg_type, final_text)
+            return
+
+        replacement = r.replace_template.replace("{{pay}}", pay_order_id).replace("{pay}", pay_order_id)
         try:
-            js = await do_request(ts)
-            last = js
-            if js.get("code") == 0:
-                data = js.get("data") or {}
-                pay_order_id = data.get("payOrderId")
-                if pay_order_id:
-                    return str(pay_order_id), f"OK(ts={ts})"
-        except Exception as e:
-            last = {"exception": str(e), "ts": ts}
-    return None, f"FAIL(resp={last})"
-
-async def build_app(bot_id: int, token: str, name: str) -> Application:
-    app = Application.builder().token(token).build()
+            final_text = await r.merchant_regex.sub(replacement, text_for_match, count=1)
+        except (RegexSandboxError, re.error) as e:
+            if isinstance(e, RegexTimeout):
+                metrics.regex_timeouts.inc(bot_id)
+            record_error(bot_id, e)
+            final_text = f"{text_for_match}\n\n⚠️ 替换商户订单号失败（支付订单号：{pay_order_id}）\n调试：{type(e).__name__}: {e}"
+
+        await send_as_bot(update, context, target_group_id, final_text)
+        write_log(bot_id, rule_id, msg_type, final_text)
+
+async def run_action_timed(bot_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE, r, matched: str, mch_order_no):
+    t0 = time.perf_counter()
+    try:
+        await run_action(bot_id, update, context, r, matched, mch_order_no)
+    finally:
+        rule_stats.observe(r.id, time.perf_counter() - t0)
+
+def record_error(bot_id: int, error: BaseException):
+    status_tracker.incr(bot_id, KEY_ERRORS)
+    status_tracker.set(bot_id, KEY_LAST_ERROR, f"{type(error).__name__}: {error}"[:500])
+    print(f"❌ bot_id={bot_id} 处理消息出错：{error!r}")
+
+async def build_app(bot_id: int, token: str, name: str, request=None, get_updates_request=None) -> Application:
+    scheduler = SendScheduler(bot_id)
+    builder = Application.builder().token(token).rate_limiter(scheduler)
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(f"{TELEGRAM_BASE_URL}/bot").base_file_url(f"{TELEGRAM_BASE_URL}/file/bot")
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    app = builder.build()
+    # build() 成功后才登记、启动队列：build() 抛异常时 supervisor 拿不到 app，不会调用 on_bot_stopped 来关闭它
+    send_schedulers[bot_id] = scheduler
+    dispatcher = DispatchQueue(bot_id, on_error=lambda e: record_error(bot_id, e))
+    dispatchers[bot_id] = dispatcher
+    dispatcher.start()
+    app.bot_data["dispatcher"] = dispatcher
 
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         set_heartbeat(bot_id)
+        metrics.updates_received.inc(bot_id)
         if update.message:
             await update.message.reply_text(f"✅ {name} 已启动（bot_id={bot_id}）")
 
@@ -181,134 +263,286 @@ async def build_app(bot_id: int, token: str, name: str) -> Application:
         msg = update.message
         if not msg:
             return
+        status_tracker.incr(bot_id, KEY_HANDLED)
+        metrics.updates_received.inc(bot_id)
 
         chat_id = str(update.effective_chat.id)
         user_id = str(update.effective_user.id)
         text_for_match = extract_text_for_match(msg)
-        msg_type = detect_message_type(msg)
-
-        rules = load_rules_for_bot(bot_id)
-
-        for r in rules:
-            rule_id = int(r["id"])
-            source_group_id = str(r["source_group_id"])
-            target_group_id = str(r["target_group_id"])
-            action_type = (r["action_type"] or "edit_send").strip()
-
-            if chat_id != source_group_id:
-                continue
 
-            allowed_users = normalize_user_ids(r)
-            if allowed_users and user_id not in allowed_users:
+        # 这里只做匹配；查询接口和发送放进 dispatcher 排队执行，慢接口不会卡住后续消息
+        rules = await rule_cache.get(bot_id)
+        t0 = time.perf_counter()
+        evaluated = 0
+        found = None
+        for r, matched in rules.matches(chat_id, text_for_match):
+            evaluated += 1
+            rule_stats.evaluated(r.id)
+            if r.action_type not in ACTION_TYPES:
                 continue
 
-            keys = normalize_keywords(str(r["keyword"]))
-            matched = None
-            if keys == ["*"]:
-                matched = "*"
-            else:
-                if not text_for_match:
-                    continue
-                for k in keys:
-                    if k in text_for_match:
-                        matched = k
-                        break
-            if matched is None:
+            if r.allowed_users and user_id not in r.allowed_users:
                 continue
 
-            # 功能3：自动回复
-            if action_type == "auto_reply":
-                reply_text = (r["reply_text"] or "").strip() or "✅ 已收到"
+            mch_order_no = None
+            if r.action_type == "lookup_replace" and r.lookup_url:
                 try:
-                    await context.bot.send_message(
-                        chat_id=chat_id,
-                        text=reply_text,
-                        reply_to_message_id=msg.message_id
-                    )
-                except Exception:
-                    await context.bot.send_message(chat_id=chat_id, text=reply_text)
-
-                write_log(bot_id, rule_id, msg_type, f"[自动回复] 用户:{user_id} kw:{matched}\n{reply_text}")
-                return
-
-            # 功能1：编辑后发送
-            if action_type == "edit_send":
-                append_text = r["append_text"] or ""
-                final_text = merge_text(text_for_match, append_text)
-                await send_as_bot(update, context, target_group_id, final_text)
-                write_log(bot_id, rule_id, msg_type, final_text)
-                return
-
-            # 功能2：查询替换后发送
-            if action_type == "lookup_replace":
-                merchant_regex = r["merchant_regex"] or r"商户订单号[:：]\s*([A-Za-z0-9_-]+)"
-                base_api = (r["lookup_url"] or "").strip()
-                replace_template = (r["replace_template"] or "支付订单号：{{pay}}").strip()
-
-                if not base_api:
-                    final_text = f"{text_for_match}\n\n⚠️ 规则未配置 lookup_url（查询接口URL）"
-                    await send_as_bot(update, context, target_group_id, final_text)
-                    write_log(bot_id, rule_id, msg_type, final_text)
-                    return
-
-                m = re.search(merchant_regex, text_for_match or "")
-                if not m:
+                    groups = await r.merchant_regex.search(text_for_match or "")
+                except (RegexSandboxError, re.error) as e:
+                    # 这条规则的正则超时、出错或子进程异常：记错误和日志，继续尝试后面的规则
+                    if isinstance(e, RegexTimeout):
+                        metrics.regex_timeouts.inc(bot_id)
+                    record_error(bot_id, e)
+                    write_log(bot_id, r.id, detect_message_type(msg), f"⚠️ 商户订单号正则执行失败，已跳过该规则：{type(e).__name__}: {e}")
                     continue
+                if groups is None:
+                    continue
+                mch_order_no = groups[0]
+
+            found = (r, matched, mch_order_no)
+            break
+        metrics.match_seconds.observe(time.perf_counter() - t0, bot_id)
+        if evaluated:
+            metrics.rules_evaluated.inc(bot_id, amount=evaluated)
+        if found is None:
+            return
 
-                mch_order_no = m.group(1)
-                pay_order_id, debug = await query_pay_order_by_mch_order_no(mch_order_no, base_api)
-
-                if not pay_order_id:
-                    final_text = f"{text_for_match}\n\n⚠️ 未查询到支付订单号（商户订单号：{mch_order_no}）\n调试：{debug}"
-                    await send_as_bot(update, context, target_group_id, final_text)
-                    write_log(bot_id, rule_id, msg_type, final_text)
-                    return
-
-                replacement = replace_template.replace("{{pay}}", pay_order_id).replace("{pay}", pay_order_id)
-                final_text = re.sub(merchant_regex, replacement, text_for_match, count=1)
+        r, matched, mch_order_no = found
+        metrics.rule_matches.inc(bot_id, r.action_type)
+        rule_stats.matched(r.id)
+        target = chat_id if r.action_type == "auto_reply" else r.target_group_id
+        await dispatcher.submit(
+            (chat_id, target),
+            lambda: run_action_timed(bot_id, update, context, r, matched, mch_order_no)
+        )
 
-                await send_as_bot(update, context, target_group_id, final_text)
-                write_log(bot_id, rule_id, msg_type, final_text)
-                return
+    async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
+        record_error(bot_id, context.error)
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, monitor))
+    app.add_error_handler(on_error)
     return app
 
-async def run_one_bot(bot_id: int, token: str, name: str):
-    app = await build_app(bot_id, token, name)
-    print(f"🤖 启动机器人 bot_id={bot_id} name={name}")
-    await app.initialize()
-    await app.start()
-    await app.updater.start_polling()
-    await asyncio.Event().wait()
-
-async def main():
-    tasks = {}
-    while True:
-        enabled = get_enabled_bots()
-        enabled_ids = {int(b["id"]) for b in enabled}
-
-        for b in enabled:
-            bot_id = int(b["id"])
-            if bot_id in tasks and not tasks[bot_id].done():
-                continue
-            token = str(b["token"]).strip()
-            name = str(b["name"]).strip()
-            if not token:
-                print(f"⚠️ bot_id={bot_id} token 为空，跳过")
-                continue
-            tasks[bot_id] = asyncio.create_task(run_one_bot(bot_id, token, name))
+async def on_bot_stopped(bot_id: int, app: Application):
+    # 已停止接收新消息：把排队中的动作执行完再释放
+    await app.bot_data["dispatcher"].close()
+    if dispatchers.get(bot_id) is app.bot_data["dispatcher"]:
+        send_schedulers.pop(bot_id, None)
+        dispatchers.pop(bot_id, None)
+
+def on_bot_state(handle):
+    status_tracker.set(handle.bot_id, KEY_RUNNER_STATE, handle.state)
+    status_tracker.set(handle.bot_id, KEY_RUNNER_RESTARTS, str(handle.restarts))
+    status_tracker.set(handle.bot_id, KEY_RUNNER_ERROR, handle.last_error)
+    if handle.state == STATE_STOPPED:
+        rule_cache.drop(handle.bot_id)
+
+class ConfigWatcher(asyncio.DatagramProtocol):
+    # 监听后台的 UDP 提醒，并以 config_version 表为准判断哪些配置真的变了
+    def __init__(self):
+        self.versions = {}
+        self.wakeup = asyncio.Event()
+
+    def datagram_received(self, data, addr):
+        self.wakeup.set()
+
+    async def listen(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.create_datagram_endpoint(
+                lambda: self,
+                local_addr=(config_version.CONFIG_NOTIFY_HOST, config_version.CONFIG_NOTIFY_PORT)
+            )
+        except OSError as e:
+            print(f"⚠️ 配置通知端口 {config_version.CONFIG_NOTIFY_PORT} 不可用，改为每 {CONFIG_POLL_SECONDS}s 轮询：{e}")
 
-        for bot_id in list(tasks.keys()):
-            if bot_id not in enabled_ids:
-                t = tasks[bot_id]
-                if not t.done():
-                    t.cancel()
-                del tasks[bot_id]
-                print(f"🛑 已停止 bot_id={bot_id}（后台已禁用）")
+    async def check(self) -> set:
+        versions = await adb.read(config_version.read_versions)
+        changed = {s for s in set(versions) | set(self.versions) if versions.get(s) != self.versions.get(s)}
+        self.versions = versions
+        return changed
 
-        await asyncio.sleep(5)
+    async def wait_changes(self, timeout: float) -> set:
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+        return await self.check()
+
+async def get_lookup_urls():
+    rows = await adb.fetchall(
+        "SELECT DISTINCT lookup_url FROM rules WHERE enabled=1 AND action_type='lookup_replace'"
+    )
+    return [(r["lookup_url"] or "").strip() for r in rows]
+
+def install_stop_handlers(request_stop, signals):
+    loop = asyncio.get_running_loop()
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, request_stop)
+        except NotImplementedError:
+            pass
+
+async def main(link: ShardLink = None):
+    # link 为空：单进程模式，自己监听配置变化；否则是分片 worker，机器人列表由协调进程下发
+    # （分片 worker 由协调进程迁移过数据库）
+    if link is None:
+        await adb.write(migrations.migrate)
+        watcher = ConfigWatcher()
+        await watcher.listen()
+        await watcher.check()
+    else:
+        watcher = link
+    log_writer.start()
+    status_tracker.start()
+    rule_stats.start()
+    pay_pool.warm(await get_lookup_urls())
+    # 分片 worker 的指标端口排在协调进程之后
+    metrics_port = metrics.METRICS_PORT
+    if link is not None and metrics_port:
+        metrics_port += 1 + link.index
+    metrics_server = await metrics.serve(metrics_port)
+    # 旧日志清理和全文索引补建只在一个进程里做：单进程模式自己做，分片模式由协调进程做
+    retention = RetentionTask()
+    fts_backfill = BackfillTask()
+    if link is None:
+        retention.start()
+        fts_backfill.start()
+
+    stop = asyncio.Event()
+    def request_stop():
+        stop.set()
+        watcher.wakeup.set()
+    if link is None:
+        install_stop_handlers(request_stop, (signal.SIGTERM, signal.SIGINT))
+    else:
+        # Ctrl+C 由协调进程统一处理，worker 只响应 stop 消息 / SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        install_stop_handlers(request_stop, (signal.SIGTERM,))
+        link.attach(request_stop)
+
+    ingress = None
+    if RUNNER_MODE == "webhook":
+        if WEBHOOK_BASE_URL:
+            ingress = await WebhookIngress(WEBHOOK_BASE_URL).start()
+        else:
+            print("⚠️ RUNNER_MODE=webhook 但未设置 WEBHOOK_BASE_URL，改用长轮询")
+
+    supervisor = BotSupervisor(build_app, on_state=on_bot_state, on_stopped=on_bot_stopped, ingress=ingress)
+    changed = {SCOPE_BOTS}
+    try:
+        while not stop.is_set():
+            if SCOPE_RULES in changed:
+                rule_cache.invalidate()
+                print("🔄 规则已变更，索引将重建")
+
+            if SCOPE_BOTS in changed:
+                supervisor.reconcile(await enabled_bot_configs() if link is None else link.bots)
+
+            if link is not None:
+                link.send_heartbeat(supervisor.states())
+            changed = await watcher.wait_changes(CONFIG_POLL_SECONDS)
+    finally:
+        await fts_backfill.close()
+        await retention.close()
+        await supervisor.close()
+        if ingress is not None:
+            await ingress.close()
+            print(f"🌐 Webhook 统计：{ingress.stats()}")
+        await pay_pool.aclose()
+        regex_sandbox.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+        await status_tracker.close()
+        await rule_stats.close()
+        await log_writer.close()
+        adb.close()
+        print(f"👋 bot_runner 已退出，日志统计：{log_writer.stats()}，订单查询缓存：{order_cache.stats()}")
+
+def run_shard(index: int, conn):
+    # worker 进程入口
+    asyncio.run(main(ShardLink(index, conn)))
+
+async def coordinate(shards: int):
+    # 协调进程：监听配置变化，按一致性哈希把机器人分给各分片；重启退出/卡死的分片，汇总心跳写入 status
+    await adb.write(migrations.migrate)
+    watcher = ConfigWatcher()
+    await watcher.listen()
+    await watcher.check()
+    status_tracker.start()
+    metrics_server = await metrics.serve()
+    retention = RetentionTask()
+    retention.start()
+    fts_backfill = BackfillTask()
+    fts_backfill.start()
+
+    stop = asyncio.Event()
+    def request_stop():
+        stop.set()
+        watcher.wakeup.set()
+    install_stop_handlers(request_stop, (signal.SIGTERM, signal.SIGINT))
+
+    ring = HashRing(range(shards))
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ShardWorker(i, run_shard, ctx) for i in range(shards)]
+    for w in workers:
+        w.start()
+    print(f"🧩 bot_runner 分片模式：{shards} 个 worker 进程")
+
+    assignment = {}
+    changed = {SCOPE_BOTS}
+    try:
+        while not stop.is_set():
+            restarted = []
+            for w in workers:
+                w.receive()
+                if w.alive() and not w.stale():
+                    continue
+                reason = "无心跳" if w.alive() else f"exitcode={w.process.exitcode}"
+                print(f"💥 分片 {w.index} 异常（{reason}），重启")
+                w.kill()
+                w.start()
+                restarted.append(w)
+
+            if SCOPE_BOTS in changed:
+                assignment = ring.assign(await enabled_bot_configs())
+                for w in workers:
+                    w.send("assign", assignment.get(w.index, []))
+                    for bot_id, _, _ in assignment.get(w.index, []):
+                        status_tracker.set(bot_id, KEY_RUNNER_SHARD, str(w.index))
+            else:
+                for w in restarted:
+                    w.send("assign", assignment.get(w.index, []))
+            if SCOPE_RULES in changed:
+                for w in workers:
+                    w.send("changed", [SCOPE_RULES])
+
+            for w in workers:
+                states = w.heartbeat.get("states", {})
+                running = sum(1 for st in states.values() if st == "running")
+                status_tracker.set(0, f"{SHARD_KEY_PREFIX}{w.index}",
+                                   f"pid={w.process.pid} bots={len(states)} running={running} starts={w.starts}")
+            changed = await watcher.wait_changes(CONFIG_POLL_SECONDS)
+    finally:
+        for w in workers:
+            w.send("stop")
+        await asyncio.to_thread(lambda: [w.stop() for w in workers])
+        await fts_backfill.close()
+        await retention.close()
+        if metrics_server is not None:
+            await metrics_server.close()
+        await status_tracker.close()
+        adb.close()
+        print("👋 bot_runner 协调进程已退出")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if RUNNER_SHARDS > 1 and RUNNER_MODE == "webhook":
+        # 各分片进程无法共用一个 webhook 端口
+        print("⚠️ webhook 模式暂不支持分片，忽略 RUNNER_SHARDS，以单进程运行")
+        asyncio.run(main())
+    elif RUNNER_SHARDS > 1:
+        asyncio.run(coordinate(RUNNER_SHARDS))
+    else:
+        asyncio.run(main())
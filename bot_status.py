@@ -0,0 +1,96 @@
+import asyncio
+import os
+import sqlite3
+from datetime import datetime
+
+STATUS_FLUSH_SECONDS = float(os.environ.get("STATUS_FLUSH_SECONDS", 10))
+
+# status 表里按 (bot_id, key) 存放的运行状态
+KEY_LAST_SEEN = "bot_last_seen"
+KEY_HANDLED = "messages_handled"
+KEY_FORWARDED = "messages_forwarded"
+KEY_ERRORS = "errors"
+KEY_LAST_ERROR = "last_error"
+# supervisor 维护的机器人运行状态
+KEY_RUNNER_STATE = "runner_state"
+KEY_RUNNER_RESTARTS = "runner_restarts"
+KEY_RUNNER_ERROR = "runner_error"
+# 分片模式下由协调进程写入：机器人所在分片；bot_id=0 下的 shard:<i> 是各分片心跳汇总
+KEY_RUNNER_SHARD = "runner_shard"
+SHARD_KEY_PREFIX = "shard:"
+
+COUNTER_KEYS = (KEY_HANDLED, KEY_FORWARDED, KEY_ERRORS)
+
+SET_STATUS_SQL = (
+    "INSERT INTO status (bot_id, key, value) VALUES (?, ?, ?) "
+    "ON CONFLICT(bot_id, key) DO UPDATE SET value=excluded.value"
+)
+ADD_STATUS_SQL = (
+    "INSERT INTO status (bot_id, key, value) VALUES (?, ?, ?) "
+    "ON CONFLICT(bot_id, key) DO UPDATE SET value=CAST(status.value AS INTEGER) + CAST(excluded.value AS INTEGER)"
+)
+
+
+class StatusTracker:
+    # 心跳和计数先记在内存，每 STATUS_FLUSH_SECONDS 把所有机器人的变化合并成一个事务写入
+    def __init__(self, adb, flush_seconds: float = STATUS_FLUSH_SECONDS):
+        self.adb = adb
+        self.flush_seconds = flush_seconds
+        self.values = {}
+        self.counters = {}
+        self.collectors = []
+        self.task = None
+
+    def touch(self, bot_id: int):
+        self.set(bot_id, KEY_LAST_SEEN, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    def set(self, bot_id: int, key: str, value: str):
+        self.values[(bot_id, key)] = value
+
+    def incr(self, bot_id: int, key: str, n: int = 1):
+        self.counters[(bot_id, key)] = self.counters.get((bot_id, key), 0) + n
+
+    def add_collector(self, fn):
+        # fn() 返回 {bot_id: {key: value}}，每次落盘前采集一次（队列深度、等待时间等瞬时值）
+        self.collectors.append(fn)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    async def flush(self):
+        for fn in self.collectors:
+            for bot_id, kv in fn().items():
+                for key, value in kv.items():
+                    self.set(bot_id, key, str(value))
+        values, self.values = self.values, {}
+        counters, self.counters = self.counters, {}
+        if not values and not counters:
+            return
+        try:
+            await self.adb.write(self.write, values, counters)
+        except sqlite3.Error as e:
+            print(f"⚠️ 状态写入失败，下次重试：{e}")
+            # 写失败时合并回去，不丢计数；期间产生的新值优先
+            self.values = {**values, **self.values}
+            for k, n in counters.items():
+                self.counters[k] = self.counters.get(k, 0) + n
+
+    @staticmethod
+    def write(conn, values: dict, counters: dict):
+        conn.executemany(SET_STATUS_SQL, [(b, k, v) for (b, k), v in values.items()])
+        conn.executemany(ADD_STATUS_SQL, [(b, k, str(n)) for (b, k), n in counters.items()])
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
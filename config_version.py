@@ -0,0 +1,34 @@
+import os
+import socket
+
+# 后台改动配置后向 bot_runner 发 UDP 提醒（同机部署），runner 收到后立即比对版本号；
+# 提醒丢失时 runner 仍会按 CONFIG_POLL_SECONDS 轮询版本号兜底
+CONFIG_NOTIFY_HOST = os.environ.get("CONFIG_NOTIFY_HOST", "127.0.0.1")
+CONFIG_NOTIFY_PORT = int(os.environ.get("CONFIG_NOTIFY_PORT", 8899))
+
+SCOPE_BOTS = "bots"
+SCOPE_RULES = "rules"
+# 日志被删除（清理、删机器人）时递增；runner 不关心，后台 /logs_json 的 ETag 用它判断中间的行有没有被删
+SCOPE_LOGS = "logs"
+
+
+def bump(conn, *scopes):
+    # 与业务写入放在同一个事务里，由调用方 commit
+    for scope in scopes:
+        conn.execute(
+            "INSERT INTO config_version (scope, version) VALUES (?, 1) "
+            "ON CONFLICT(scope) DO UPDATE SET version=version+1",
+            (scope,)
+        )
+
+def read_versions(conn) -> dict:
+    rows = conn.execute("SELECT scope, version FROM config_version").fetchall()
+    return {r[0]: int(r[1]) for r in rows}
+
+def notify(*scopes):
+    payload = ",".join(scopes).encode("utf-8")
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(payload, (CONFIG_NOTIFY_HOST, CONFIG_NOTIFY_PORT))
+    except OSError:
+        pass
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import queue
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# 后台（app.py）和 bot_runner 共用的数据库连接层：WAL + 连接复用；表结构和索引见 migrations.py
+
+# Railway 持久化磁盘建议挂载到 /app/data
+DATA_DIR = os.environ.get("DATA_DIR", "data")
+os.makedirs(DATA_DIR, exist_ok=True)
+
+DB_FILE = os.path.join(DATA_DIR, "bot.db")
+
+# 拿不到写锁时最多等待的毫秒数
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 10000))
+# WAL 下 NORMAL 只在检查点 fsync，断电最多丢最近的事务，不会损坏数据库
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+# 每个连接的页缓存（KB）与内存映射大小（MB）
+DB_CACHE_KB = int(os.environ.get("DB_CACHE_KB", 16384))
+DB_MMAP_MB = int(os.environ.get("DB_MMAP_MB", 64))
+# 每个进程最多保留的空闲连接数
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+# AsyncDB 的读线程数（写线程固定 1 个）
+DB_READERS = int(os.environ.get("DB_READERS", 4))
+
+
+class PooledConnection(sqlite3.Connection):
+    # close() 不真正关闭，而是回滚未提交的事务后还给连接池；调用方代码照旧 conn.close()
+    pool = None
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+            return
+        pool, self.pool = self.pool, None
+        pool.release(self)
+
+    def discard(self):
+        self.pool = None
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, path: str = DB_FILE, size: int = DB_POOL_SIZE):
+        self.path = path
+        self.idle = queue.LifoQueue(size)
+        self.opened = 0
+        self.reused = 0
+
+    def open(self) -> PooledConnection:
+        # check_same_thread=False：同一时间只有一个线程持有，但 Flask 每个请求的线程都不同
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                               factory=PooledConnection, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_MB * 1024 * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        self.opened += 1
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        try:
+            conn = self.idle.get_nowait()
+            self.reused += 1
+        except queue.Empty:
+            conn = self.open()
+        conn.row_factory = sqlite3.Row
+        conn.pool = self
+        return conn
+
+    def release(self, conn: PooledConnection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            conn.discard()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().discard()
+            except queue.Empty:
+                return
+
+
+pool = ConnectionPool()
+
+def connect() -> PooledConnection:
+    return pool.acquire()
+
+
+class AsyncDB:
+    # 协程里访问数据库的入口（bot_runner）：写操作排进一个专用写线程串行执行，同进程内的写入不再互相抢锁；
+    # 读操作在小线程池里并行。fn(conn, *args) 在线程里执行，事件循环只 await，磁盘/锁等待不会卡住所有机器人
+    def __init__(self, conn_pool: ConnectionPool = None, readers: int = DB_READERS):
+        self.conn_pool = conn_pool
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="db-writer")
+        self.readers = ThreadPoolExecutor(max(1, readers), thread_name_prefix="db-reader")
+
+        self.reads = 0
+        self.writes = 0
+
+    def call(self, fn, args, commit: bool):
+        conn = (self.conn_pool or pool).acquire()
+        t0 = time.perf_counter()
+        try:
+            result = fn(conn, *args)
+            if commit:
+                conn.commit()
+            return result
+        finally:
+            # 出错时未提交的事务在归还连接时回滚
+            conn.close()
+            if commit:
+                metrics.db_write_seconds.observe(time.perf_counter() - t0, getattr(fn, "__qualname__", "?"))
+
+    async def read(self, fn, *args):
+        self.reads += 1
+        return await asyncio.get_running_loop().run_in_executor(self.readers, self.call, fn, args, False)
+
+    async def write(self, fn, *args):
+        # fn 返回后自动 commit；fn 自己管理事务（BEGIN IMMEDIATE / commit）也可以
+        self.writes += 1
+        return await asyncio.get_running_loop().run_in_executor(self.writer, self.call, fn, args, True)
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    def close(self):
+        # 等已排队的读写执行完
+        self.writer.shutdown(wait=True)
+        self.readers.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {"reads": self.reads, "writes": self.writes}
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+# 每个机器人同时执行的动作数；动作大多在等查询接口和 Telegram，某个会话慢或被限流只占其中一个
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", 16))
+DISPATCH_QUEUE_MAX = int(os.environ.get("DISPATCH_QUEUE_MAX", 1000))
+DISPATCH_DRAIN_SECONDS = float(os.environ.get("DISPATCH_DRAIN_SECONDS", 10))
+
+
+class DispatchQueue:
+    # 每个机器人一个：命中规则后的动作（查询 + 发送 + 写日志）作为任务排队，由多个 worker 并行执行。
+    # 每个 key（源群, 目标群）一条先进先出队列，同一个 key 同时只执行一个任务，保证顺序；
+    # worker 从所有 key 里取已就绪的一个，不相关的 key 不会排在别人的慢任务后面
+    def __init__(self, bot_id: int, workers: int = DISPATCH_WORKERS, max_queue: int = DISPATCH_QUEUE_MAX,
+                 on_error=None):
+        self.bot_id = bot_id
+        self.workers = max(1, workers)
+        # key → deque[(入队时间, job)]；有任务排队或正在执行的 key 才在这里
+        self.pending = {}
+        # 可以执行下一个任务的 key：每个 key 最多出现一次，正在执行时不在里面
+        self.ready = asyncio.Queue()
+        # 排队任务总数上限，满了 submit 等待
+        self.slots = asyncio.Semaphore(max(1, max_queue))
+        self.queued = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.on_error = on_error
+        self.tasks = []
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+        self.run_max = 0.0
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def submit(self, key, job):
+        # job 是无参协程函数；队列满时在这里等待（反压到消息处理）
+        await self.slots.acquire()
+        self.submitted += 1
+        self.queued += 1
+        self.idle.clear()
+        jobs = self.pending.get(key)
+        if jobs is None:
+            self.pending[key] = deque([(time.monotonic(), job)])
+            self.ready.put_nowait(key)
+        else:
+            jobs.append((time.monotonic(), job))
+
+    async def worker(self):
+        while True:
+            key = await self.ready.get()
+            jobs = self.pending[key]
+            enqueued_at, job = jobs.popleft()
+            self.queued -= 1
+            self.slots.release()
+            started = time.monotonic()
+            waited = started - enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            try:
+                await job()
+            except Exception as e:
+                self.failed += 1
+                if self.on_error is not None:
+                    self.on_error(e)
+            finally:
+                elapsed = time.monotonic() - started
+                self.completed += 1
+                self.run_total += elapsed
+                self.run_max = max(self.run_max, elapsed)
+                # 执行完才放回就绪队列，同一个 key 的下一个任务不会和这个并行
+                if jobs:
+                    self.ready.put_nowait(key)
+                else:
+                    del self.pending[key]
+                    if not self.pending:
+                        self.idle.set()
+
+    def depth(self) -> int:
+        return self.queued
+
+    async def close(self, timeout: float = DISPATCH_DRAIN_SECONDS):
+        # 先尽量执行完已排队的任务，超时后放弃
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ bot_id={self.bot_id} 停止时仍有 {self.depth()} 个任务未执行，已丢弃")
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_avg": round(self.wait_total / self.completed, 3) if self.completed else 0.0,
+            "wait_max": round(self.wait_max, 3),
+            "run_avg": round(self.run_total / self.completed, 3) if self.completed else 0.0,
+            "run_max": round(self.run_max, 3),
+        }
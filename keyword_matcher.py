@@ -0,0 +1,50 @@
+from collections import deque
+
+
+class KeywordAutomaton:
+    # Aho-Corasick 自动机：一次扫描文本即可找出所有出现过的关键词
+    def __init__(self, keywords):
+        goto = [{}]
+        fail = [0]
+        outs = [set()]
+        for kw in keywords:
+            node = 0
+            for ch in kw:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto.append({})
+                    fail.append(0)
+                    outs.append(set())
+                    goto[node][ch] = nxt
+                node = nxt
+            outs[node].add(kw)
+
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                outs[nxt] |= outs[fail[nxt]]
+
+        self.goto = goto
+        self.fail = fail
+        self.out = [frozenset(o) for o in outs]
+
+    def find(self, text: str) -> set:
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        node = 0
+        found = set()
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found |= out[node]
+        return found
@@ -0,0 +1,387 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from urllib.parse import parse_qsl
+
+import httpx
+
+import migrations
+from mini_http import MiniHTTPServer, Response
+
+# 端到端压测：本进程起一个假的 Telegram Bot API（getMe/getUpdates/sendMessage/copyMessage，可注入延迟和 RetryAfter）
+# 和一个桩支付接口（lookup_url），在临时数据库里生成 N 个机器人 × M 个群 × K 条规则，以子进程方式运行真正的
+# bot_runner.py（TELEGRAM_BASE_URL 指向假服务器），按固定速率注入消息，统计吞吐、端到端延迟和数据库写入次数
+# 用法：
+#   python loadtest.py                                        默认 10 机器人 × 5 群 × 20 规则，200 条/秒 × 20 秒
+#   python loadtest.py --bots 50 --rate 1000 --tg-latency 0.05 --retry-after-rate 0.01
+#   python loadtest.py --telegram-limits                      保留 Telegram 发送限速（同一群 20 条/分钟），测限流排队
+# 端到端延迟：消息进入 getUpdates 队列 → 假服务器收到对应的 sendMessage/copyMessage（含注入的 Telegram 延迟）
+
+# 消息里带 #序号，转发出去的文本/标题里还能找到；自动回复没有原文，按 reply_to 的 message_id 对应
+SEQ_RE = re.compile(r"#(\d+)")
+MERCHANT_REGEX = r"商户订单号[:：]\s*([A-Za-z0-9_-]+)"
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def parse_params(req) -> dict:
+    # PTB 以表单提交，复杂参数是 JSON 字符串
+    if req.headers.get("content-type", "").startswith("application/json"):
+        return req.json() or {}
+    return dict(parse_qsl(req.body.decode("utf-8"), keep_blank_values=True))
+
+def ok(result):
+    return Response.json({"ok": True, "result": result})
+
+def percentiles(values: list) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))] * 1000
+    return f"p50 {pick(0.5):.1f} ms  p95 {pick(0.95):.1f} ms  p99 {pick(0.99):.1f} ms  max {values[-1] * 1000:.1f} ms"
+
+
+class FakeTelegram:
+    # 按 token 分队列的 getUpdates 长轮询；发送类接口按 latency 延迟后返回，按 retry_rate 概率返回 429
+    def __init__(self, latency: float, retry_rate: float, retry_after: int, seed: int):
+        self.latency = latency
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.server = MiniHTTPServer(self.handle)
+        self.queues = {}
+        self.wakeups = {}
+        self.polling = set()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.closing = False
+
+        self.injected = {}
+        self.latencies = []
+        self.calls = {}
+        self.retry_after_sent = 0
+
+    async def start(self):
+        await self.server.start()
+        return self
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.port}"
+
+    def push(self, token: str, seq: int, message: dict):
+        message["message_id"] = seq
+        self.queues.setdefault(token, deque()).append({"update_id": self.next_update_id, "message": message})
+        self.next_update_id += 1
+        self.injected[seq] = time.perf_counter()
+        self.wakeup(token).set()
+
+    def wakeup(self, token: str) -> asyncio.Event:
+        ev = self.wakeups.get(token)
+        if ev is None:
+            ev = self.wakeups[token] = asyncio.Event()
+        return ev
+
+    def delivered(self, params: dict):
+        text = params.get("text") or params.get("caption") or ""
+        m = SEQ_RE.search(text)
+        seq = int(m.group(1)) if m else None
+        if seq is None:
+            reply = params.get("reply_parameters")
+            if reply:
+                seq = json.loads(reply).get("message_id")
+            elif params.get("reply_to_message_id"):
+                seq = int(params["reply_to_message_id"])
+        t0 = self.injected.pop(seq, None)
+        if t0 is not None:
+            self.latencies.append(time.perf_counter() - t0)
+
+    async def handle(self, req):
+        m = re.match(r"^/bot([^/]+)/(\w+)$", req.path)
+        if not m:
+            return Response("not found", 404)
+        token, method = m.group(1), m.group(2)
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = parse_params(req)
+
+        if method == "getMe":
+            bot_id = int(token.split(":", 1)[0])
+            return ok({"id": bot_id, "is_bot": True, "first_name": f"loadtest{bot_id}", "username": f"loadtest{bot_id}_bot"})
+        if method == "getUpdates":
+            return ok(await self.get_updates(token, params))
+        if method in ("sendMessage", "copyMessage"):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.retry_rate and self.rnd.random() < self.retry_rate:
+                self.retry_after_sent += 1
+                return Response.json({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }, 429)
+            self.delivered(params)
+            self.next_message_id += 1
+            if method == "copyMessage":
+                return ok({"message_id": self.next_message_id})
+            chat_id = int(params.get("chat_id", 0))
+            return ok({
+                "message_id": self.next_message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "text": params.get("text", ""),
+            })
+        # deleteWebhook 等
+        return ok(True)
+
+    async def get_updates(self, token: str, params: dict) -> list:
+        self.polling.add(token)
+        q = self.queues.setdefault(token, deque())
+        offset = int(params.get("offset") or 0)
+        while q and q[0]["update_id"] < offset:
+            q.popleft()
+        if not q and not self.closing:
+            ev = self.wakeup(token)
+            ev.clear()
+            try:
+                await asyncio.wait_for(ev.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return [u for _, u in zip(range(limit), q)]
+
+    async def close(self):
+        self.closing = True
+        for ev in self.wakeups.values():
+            ev.set()
+        await self.server.close()
+
+
+class StubPay:
+    def __init__(self, latency: float, fail_rate: float, seed: int):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rnd = random.Random(seed)
+        self.server = MiniHTTPServer(self.handle)
+        self.requests = 0
+
+    async def start(self):
+        await self.server.start()
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.port}/api/anon/robot/payOrder"
+
+    async def handle(self, req):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and self.rnd.random() < self.fail_rate:
+            return Response.json({"code": 1, "msg": "order not found"})
+        return Response.json({"code": 0, "data": {"payOrderId": "P" + req.query.get("mchOrderNo", "")}})
+
+    async def close(self):
+        await self.server.close()
+
+
+def seed_db(path: str, args, lookup_url: str):
+    # 返回 {bot_id: (token, [(keyword, source_group_id, action_type)])}
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    migrations.migrate(conn)
+    rnd = random.Random(args.seed)
+    bots = {}
+    for b in range(1, args.bots + 1):
+        token = f"{b}:LOADTEST{b:04d}"
+        conn.execute("INSERT INTO bots (id, name, token) VALUES (?, ?, ?)", (b, f"压测{b}", token))
+        rules = []
+        for k in range(args.rules):
+            source = f"-100{b:04d}{k % args.groups:04d}"
+            r = rnd.random()
+            action = "lookup_replace" if r < args.lookup_share else \
+                "auto_reply" if r < args.lookup_share + args.reply_share else "edit_send"
+            keyword = f"<k{k}>"
+            conn.execute(
+                "INSERT INTO rules (bot_id, action_type, source_group_id, target_group_id, keyword, append_text, "
+                "merchant_regex, lookup_url, replace_template, reply_text) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (b, action, source, f"-200{b:04d}{k % args.groups:04d}", keyword, "—— 压测转发",
+                 MERCHANT_REGEX, lookup_url, "支付订单号：{{pay}}", "✅ 已收到")
+            )
+            rules.append((keyword, source, action))
+        bots[b] = (token, rules)
+    conn.commit()
+    conn.close()
+    return bots
+
+def make_message(seq: int, keyword: str, source: str, rnd, media_share: float) -> dict:
+    text = f"{keyword} 商户订单号：M{seq:010d} #{seq}"
+    message = {
+        "date": int(time.time()),
+        "chat": {"id": int(source), "type": "supergroup", "title": "loadtest"},
+        "from": {"id": 10000 + rnd.randrange(500), "is_bot": False, "first_name": "u"},
+    }
+    if rnd.random() < media_share:
+        message["photo"] = [{"file_id": f"F{seq}", "file_unique_id": f"U{seq}", "width": 90, "height": 90}]
+        message["caption"] = text
+    else:
+        message["text"] = text
+    return message
+
+async def scrape_db_writes(urls) -> dict:
+    # runner /metrics 里 tg_db_write_seconds_count{op=...} 按操作汇总
+    out = {}
+    async with httpx.AsyncClient(timeout=5) as client:
+        for url in urls:
+            try:
+                text = (await client.get(url)).text
+            except httpx.HTTPError:
+                continue
+            for m in re.finditer(r'^tg_db_write_seconds_count\{op="([^"]*)"\} (\S+)$', text, re.M):
+                out[m.group(1)] = out.get(m.group(1), 0) + int(float(m.group(2)))
+    return out
+
+def runner_env(args, tmp: str, telegram: FakeTelegram, metrics_port: int) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DATA_DIR": tmp,
+        "TELEGRAM_BASE_URL": telegram.base_url,
+        "METRICS_HOST": "127.0.0.1",
+        "METRICS_PORT": str(metrics_port),
+        "CONFIG_NOTIFY_PORT": str(free_port()),
+        "LOG_NOTIFY_PORT": str(free_port()),
+        "RUNNER_SHARDS": str(args.shards),
+        "RUNNER_MODE": "polling",
+        "LOG_RETENTION_DAYS": "0",
+        "LOG_MAX_ROWS": "0",
+        "PYTHONUNBUFFERED": "1",
+    })
+    if not args.telegram_limits:
+        # 默认放开发送限速，测 runner 本身的处理能力
+        env.update({"SEND_GLOBAL_PER_SECOND": "100000", "SEND_GROUP_PER_MINUTE": "6000000",
+                    "SEND_PRIVATE_PER_SECOND": "100000", "SEND_CHAT_BURST": "1000"})
+    return env
+
+async def run(args):
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    telegram = await FakeTelegram(args.tg_latency, args.retry_after_rate, args.retry_after, args.seed).start()
+    pay = await StubPay(args.pay_latency, args.pay_fail_rate, args.seed).start()
+    bots = seed_db(os.path.join(tmp, "bot.db"), args, pay.url)
+    total_rules = args.bots * args.rules
+    print(f"🧪 {args.bots} 机器人 × {args.groups} 群 × {args.rules} 规则（共 {total_rules} 条），"
+          f"{args.rate} 条/秒 × {args.duration}s，数据目录 {tmp}")
+
+    metrics_port = free_port()
+    metrics_urls = [f"http://127.0.0.1:{metrics_port}/metrics"]
+    if args.shards > 1:
+        metrics_urls += [f"http://127.0.0.1:{metrics_port + 1 + i}/metrics" for i in range(args.shards)]
+    log_path = os.path.join(tmp, "runner.log")
+    log_file = open(log_path, "w")
+    cmd = [sys.executable, os.path.join(REPO_DIR, "bot_runner.py")]
+    if args.profile:
+        # 单进程模式下 runner 收到 SIGTERM 正常退出时写出，用 python -m pstats 查看
+        cmd[1:1] = ["-m", "cProfile", "-o", os.path.join(tmp, "runner.prof")]
+    proc = subprocess.Popen(cmd, cwd=REPO_DIR,
+                            env=runner_env(args, tmp, telegram, metrics_port), stdout=log_file, stderr=subprocess.STDOUT)
+    try:
+        deadline = time.monotonic() + args.startup_timeout
+        while len(telegram.polling) < args.bots:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise SystemExit(f"❌ bot_runner 未能启动全部机器人（{len(telegram.polling)}/{args.bots}），日志：{log_path}")
+            await asyncio.sleep(0.1)
+        print(f"✅ {args.bots} 个机器人已开始拉取消息")
+
+        rnd = random.Random(args.seed)
+        flat = [(token, kw, src) for token, rules in bots.values() for kw, src, _ in rules]
+        total = int(args.rate * args.duration)
+        tick = 0.01
+        t_start = time.perf_counter()
+        for seq in range(1, total + 1):
+            # 按目标速率均匀注入；落后时不补睡眠，一次多推几条
+            due = t_start + seq / args.rate
+            now = time.perf_counter()
+            if due - now > tick:
+                await asyncio.sleep(due - now)
+            token, kw, src = rnd.choice(flat)
+            telegram.push(token, seq, make_message(seq, kw, src, rnd, args.media_share))
+        injected_s = time.perf_counter() - t_start
+
+        drain_deadline = time.monotonic() + args.drain
+        while telegram.injected and time.monotonic() < drain_deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - t_start
+        # 等日志攒批写完再读写入次数
+        await asyncio.sleep(1)
+        db_writes = await scrape_db_writes(metrics_urls)
+    finally:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.to_thread(proc.wait, 60)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        log_file.close()
+        await telegram.close()
+        await pay.close()
+
+    # CPU 时间：压测进程（假服务器 + 注入）接近用时说明瓶颈在压测端，结果不可信
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    child = resource.getrusage(resource.RUSAGE_CHILDREN)
+    conn = sqlite3.connect(os.path.join(tmp, "bot.db"))
+    log_rows = conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+    conn.close()
+
+    done = len(telegram.latencies)
+    print(f"\n📊 注入 {total} 条（实际用时 {injected_s:.1f}s），完成 {done} 条（{done / total * 100:.1f}%），"
+          f"未完成 {len(telegram.injected)} 条")
+    print(f"   吞吐：{done / elapsed:.1f} 条/秒")
+    print(f"   端到端延迟：{percentiles(telegram.latencies)}")
+    print(f"   Telegram 请求：{json.dumps(telegram.calls, ensure_ascii=False)}，注入 RetryAfter {telegram.retry_after_sent} 次")
+    print(f"   查询接口请求：{pay.requests}")
+    print(f"   数据库写事务（运行期间，按操作）：{json.dumps(db_writes, ensure_ascii=False)}，共 {sum(db_writes.values())}")
+    print(f"   CPU：bot_runner {child.ru_utime + child.ru_stime:.1f}s，压测进程 {own.ru_utime + own.ru_stime:.1f}s（总用时 {elapsed:.1f}s）")
+    print(f"   日志表行数：{log_rows}；runner 日志：{log_path}")
+    if args.profile:
+        print(f"   性能剖析：{os.path.join(tmp, 'runner.prof')}")
+
+def main():
+    ap = argparse.ArgumentParser(description="bot_runner 端到端压测（假 Telegram Bot API + 桩支付接口）")
+    ap.add_argument("--bots", type=int, default=10)
+    ap.add_argument("--groups", type=int, default=5, help="每个机器人的源群数")
+    ap.add_argument("--rules", type=int, default=20, help="每个机器人的规则数，平均分到各源群")
+    ap.add_argument("--rate", type=float, default=200, help="所有机器人合计每秒注入的消息数")
+    ap.add_argument("--duration", type=float, default=20, help="注入时长（秒）")
+    ap.add_argument("--drain", type=float, default=30, help="注入结束后最多等待未完成消息的秒数")
+    ap.add_argument("--lookup-share", type=float, default=0.2, help="查询替换（功能2）规则占比")
+    ap.add_argument("--reply-share", type=float, default=0.1, help="自动回复（功能3）规则占比")
+    ap.add_argument("--media-share", type=float, default=0.1, help="图片消息占比（走 copyMessage）")
+    ap.add_argument("--tg-latency", type=float, default=0.0, help="假 Telegram 发送接口的延迟（秒）")
+    ap.add_argument("--retry-after-rate", type=float, default=0.0, help="发送接口返回 429 RetryAfter 的概率")
+    ap.add_argument("--retry-after", type=int, default=1, help="RetryAfter 的秒数")
+    ap.add_argument("--pay-latency", type=float, default=0.0, help="桩支付接口的延迟（秒）")
+    ap.add_argument("--pay-fail-rate", type=float, default=0.0, help="桩支付接口查不到订单的概率")
+    ap.add_argument("--shards", type=int, default=1, help="RUNNER_SHARDS")
+    ap.add_argument("--telegram-limits", action="store_true", help="保留 Telegram 发送限速设置")
+    ap.add_argument("--profile", action="store_true", help="用 cProfile 运行 bot_runner，结果写到数据目录的 runner.prof")
+    ap.add_argument("--startup-timeout", type=float, default=60)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import config_version
+import db
+
+# logs 表清理：超过保留天数或超过行数上限的旧日志分批删除，删除前按小时汇总进 logs_hourly，
+# 可选把原始日志追加到按天分的 gzip JSONL 归档。bot_runner 定期执行，也可手动执行：
+#   python log_retention.py [--dry-run] [--days N] [--max-rows N]
+
+# 0 表示不按该条件清理
+LOG_RETENTION_DAYS = float(os.environ.get("LOG_RETENTION_DAYS", 30))
+LOG_MAX_ROWS = int(os.environ.get("LOG_MAX_ROWS", 1000000))
+# 每批删除的行数与批间隔：每批一个短事务，批与批之间让出写锁给 runner 写日志
+LOG_PRUNE_BATCH = int(os.environ.get("LOG_PRUNE_BATCH", 2000))
+LOG_PRUNE_PAUSE = float(os.environ.get("LOG_PRUNE_PAUSE", 0.05))
+LOG_PRUNE_INTERVAL_SECONDS = float(os.environ.get("LOG_PRUNE_INTERVAL_SECONDS", 600))
+# 设置后被清理的原始日志追加写入 {LOG_ARCHIVE_DIR}/logs-YYYYMMDD.jsonl.gz（按日志时间分文件）
+LOG_ARCHIVE_DIR = os.environ.get("LOG_ARCHIVE_DIR", "").strip()
+
+# 归档临时文件：logs-YYYYMMDD.jsonl.gz.{lo}-{hi}.pending
+PENDING_RE = re.compile(r"^(logs-\w+\.jsonl\.gz)\.(\d+)-(\d+)\.pending$")
+
+ROLLUP_SQL = (
+    "INSERT INTO logs_hourly (hour, bot_id, rule_id, message_type, count) "
+    "SELECT substr(ts, 1, 13) || ':00', COALESCE(bot_id, 0), COALESCE(rule_id, 0), COALESCE(message_type, ''), COUNT(*) "
+    "FROM logs WHERE id BETWEEN ? AND ? GROUP BY 1, 2, 3, 4 "
+    "ON CONFLICT(hour, bot_id, rule_id, message_type) DO UPDATE SET count=count+excluded.count"
+)
+
+
+def prune_upto(conn, days: float = LOG_RETENTION_DAYS, max_rows: int = LOG_MAX_ROWS) -> int:
+    # 返回需要删除的最大 id（id <= 它的都删），0 表示没有要删的。日志按时间顺序写入，id 与 ts 同序
+    upto = 0
+    if days > 0:
+        cutoff = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        row = conn.execute("SELECT MAX(id) FROM logs WHERE ts < ?", (cutoff,)).fetchone()
+        upto = max(upto, row[0] or 0)
+    if max_rows > 0:
+        row = conn.execute("SELECT id FROM logs ORDER BY id DESC LIMIT 1 OFFSET ?", (max_rows,)).fetchone()
+        if row is not None:
+            upto = max(upto, row[0])
+    return upto
+
+def archive_rows(archive_dir: str, rows, lo: int, hi: int) -> list:
+    # 先写成临时文件（每个是完整的 gzip member），删除事务提交后再追加到归档文件；
+    # 返回 [(临时文件, 归档文件)]
+    by_day = {}
+    for r in rows:
+        day = str(r["ts"] or "")[:10].replace("-", "") or "unknown"
+        by_day.setdefault(day, []).append(r)
+    os.makedirs(archive_dir, exist_ok=True)
+    chunks = []
+    for day, day_rows in by_day.items():
+        final = os.path.join(archive_dir, f"logs-{day}.jsonl.gz")
+        pending = f"{final}.{lo}-{hi}.pending"
+        with gzip.open(pending, "wt", encoding="utf-8") as f:
+            for r in day_rows:
+                f.write(json.dumps(dict(r), ensure_ascii=False) + "\n")
+        chunks.append((pending, final))
+    return chunks
+
+def publish_archive(chunks: list):
+    # gzip 允许多个 member 直接拼接，gzip.open / zcat 可以连续读出
+    for pending, final in chunks:
+        with open(pending, "rb") as src, open(final, "ab") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(pending)
+
+def discard_archive(chunks: list):
+    for pending, _ in chunks:
+        try:
+            os.remove(pending)
+        except FileNotFoundError:
+            pass
+
+def recover_pending(conn, archive_dir: str):
+    # 上次在提交与追加之间退出留下的临时文件：对应的日志已经删掉说明事务提交了，补追加；否则丢弃，本次会重新归档
+    if not os.path.isdir(archive_dir):
+        return
+    for name in sorted(os.listdir(archive_dir)):
+        m = PENDING_RE.match(name)
+        if not m:
+            continue
+        chunk = [(os.path.join(archive_dir, name), os.path.join(archive_dir, m.group(1)))]
+        lo, hi = int(m.group(2)), int(m.group(3))
+        if conn.execute("SELECT 1 FROM logs WHERE id BETWEEN ? AND ? LIMIT 1", (lo, hi)).fetchone() is None:
+            publish_archive(chunk)
+        else:
+            discard_archive(chunk)
+
+def prune_batch(conn, lo: int, hi: int, archive_dir: str) -> int:
+    chunks = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if archive_dir:
+            rows = conn.execute("SELECT * FROM logs WHERE id BETWEEN ? AND ? ORDER BY id", (lo, hi)).fetchall()
+            chunks = archive_rows(archive_dir, rows, lo, hi)
+        conn.execute(ROLLUP_SQL, (lo, hi))
+        deleted = conn.execute("DELETE FROM logs WHERE id BETWEEN ? AND ?", (lo, hi)).rowcount
+        config_version.bump(conn, config_version.SCOPE_LOGS)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        # 没删成，下次会重新归档这些行，临时文件不能追加
+        discard_archive(chunks)
+        raise
+    publish_archive(chunks)
+    return deleted
+
+def prune(days: float = LOG_RETENTION_DAYS, max_rows: int = LOG_MAX_ROWS, batch: int = LOG_PRUNE_BATCH,
+          pause: float = LOG_PRUNE_PAUSE, archive_dir: str = LOG_ARCHIVE_DIR, dry_run: bool = False,
+          should_stop=None) -> dict:
+    # should_stop()：每批之间检查，返回 True 时提前结束（进程退出时不必等全部删完）
+    t0 = time.monotonic()
+    result = {"upto_id": 0, "deleted": 0, "batches": 0}
+    conn = db.connect()
+    try:
+        if archive_dir and not dry_run:
+            recover_pending(conn, archive_dir)
+        upto = result["upto_id"] = prune_upto(conn, days, max_rows)
+        if dry_run:
+            result["would_delete"] = conn.execute("SELECT COUNT(*) FROM logs WHERE id <= ?", (upto,)).fetchone()[0]
+            return result
+        while upto and not (should_stop and should_stop()):
+            lo = conn.execute("SELECT MIN(id) FROM logs WHERE id <= ?", (upto,)).fetchone()[0]
+            if lo is None:
+                break
+            # 按主键取第 batch 行作为本批上界，id 有空洞时每批行数也稳定
+            row = conn.execute(
+                "SELECT id FROM logs WHERE id BETWEEN ? AND ? ORDER BY id LIMIT 1 OFFSET ?", (lo, upto, batch - 1)
+            ).fetchone()
+            hi = row[0] if row is not None else upto
+            result["deleted"] += prune_batch(conn, lo, hi, archive_dir)
+            result["batches"] += 1
+            if pause:
+                time.sleep(pause)
+        return result
+    finally:
+        conn.close()
+        result["seconds"] = round(time.monotonic() - t0, 2)
+
+def delete_bot_logs(bot_id: int, batch: int = LOG_PRUNE_BATCH, pause: float = LOG_PRUNE_PAUSE) -> int:
+    # 删除机器人时分批删它的日志与汇总，避免一次 DELETE 长时间占用写锁
+    deleted = 0
+    conn = db.connect()
+    try:
+        for table, key in (("logs", "id"), ("logs_hourly", "rowid")):
+            while True:
+                with conn:
+                    n = conn.execute(
+                        f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} WHERE bot_id=? LIMIT ?)",
+                        (bot_id, batch)
+                    ).rowcount
+                    if n and table == "logs":
+                        config_version.bump(conn, config_version.SCOPE_LOGS)
+                deleted += n
+                if n < batch:
+                    break
+                if pause:
+                    time.sleep(pause)
+    finally:
+        conn.close()
+    return deleted
+
+
+class RetentionTask:
+    # bot_runner 里每隔 LOG_PRUNE_INTERVAL_SECONDS 在线程中执行一次 prune()
+    def __init__(self, interval: float = LOG_PRUNE_INTERVAL_SECONDS):
+        self.interval = interval
+        self.task = None
+        self.stopping = False
+        self.last = {}
+
+    def start(self):
+        if self.task is None and (LOG_RETENTION_DAYS > 0 or LOG_MAX_ROWS > 0):
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                self.last = await asyncio.to_thread(prune, should_stop=lambda: self.stopping)
+                if self.last["deleted"]:
+                    print(f"🧹 已清理旧日志：{self.last}")
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️ 日志清理失败，下次重试：{e}")
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        self.stopping = True
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="清理 logs 表旧日志（先汇总到 logs_hourly，可选归档）")
+    parser.add_argument("--days", type=float, default=LOG_RETENTION_DAYS, help="保留天数，0 表示不按时间清理")
+    parser.add_argument("--max-rows", type=int, default=LOG_MAX_ROWS, help="最多保留行数，0 表示不限")
+    parser.add_argument("--archive-dir", default=LOG_ARCHIVE_DIR, help="归档目录，留空不归档")
+    parser.add_argument("--dry-run", action="store_true", help="只统计要删除的行数")
+    args = parser.parse_args()
+    print(prune(args.days, args.max_rows, archive_dir=args.archive_dir, dry_run=args.dry_run))
+
+if __name__ == "__main__":
+    main()
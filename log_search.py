@@ -0,0 +1,243 @@
+import asyncio
+import html
+import os
+import sqlite3
+import time
+
+import db
+
+# 日志全文搜索：logs_fts 是 logs.message_text 的 FTS5 索引（迁移 v10 建表并用触发器同步，
+# runner 写日志、log_retention 清理日志时自动更新），/logs/search 通过它按订单号等关键字查日志。
+# 建表时已有的日志由 runner 在后台分批补建索引（BackfillTask），补完之前搜索结果只含已建索引的部分
+SEARCH_PAGE_LIMIT = int(os.environ.get("LOG_SEARCH_PAGE_LIMIT", 50))
+# 0 关闭全文索引：启动迁移时删除 logs_fts 和触发器，写日志不再付索引开销，/logs/search 不可用；
+# 改回 1 后重新建表，已有日志在后台补建索引
+LOG_FTS = os.environ.get("LOG_FTS", "1") == "1"
+# 补建索引每批一个短事务：批大小按上一批耗时调整，使每批持有写锁约这么多秒；批与批之间让出写锁
+LOG_FTS_BACKFILL_SECONDS = float(os.environ.get("LOG_FTS_BACKFILL_SECONDS", 0.2))
+LOG_FTS_BACKFILL_PAUSE = float(os.environ.get("LOG_FTS_BACKFILL_PAUSE", 0.1))
+# trigram 分词按 3 个字符一组建索引，更短的关键字用不上索引
+TRIGRAM_MIN_CHARS = 3
+
+# highlight() 用控制字符标出命中位置，转义 HTML 后再换成 <mark>
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+# 补建进度：logs_fts_backfill 唯一一行，id 在 (done_id, upto_id] 之间的日志还没有进索引；
+# upto_id 是建表时最大的日志 id，之后写入的日志由插入触发器建索引。补完后保留这一行（done_id = upto_id）
+BACKFILL_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS logs_fts_backfill (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  start_id INTEGER NOT NULL,
+  done_id INTEGER NOT NULL,
+  upto_id INTEGER NOT NULL
+)
+"""
+# 删除/修改的日志只有已经进了索引才从索引里删（外部内容表删除没建过索引的行会破坏索引）；没有进度表时全部已建
+INDEXED_WHEN = (
+    "old.id > COALESCE((SELECT upto_id FROM logs_fts_backfill WHERE id = 1), 0) "
+    "OR old.id <= COALESCE((SELECT done_id FROM logs_fts_backfill WHERE id = 1), 0)"
+)
+TRIGGERS = ("logs_fts_insert", "logs_fts_delete", "logs_fts_update")
+
+
+def fts_tokenizer(conn) -> str:
+    # 'trigram'（任意子串）或 'unicode61'（SQLite < 3.34，按词、前缀搜索）；表不存在时返回 ''。
+    # 不缓存：LOG_FTS 切换时 runner 会删表/重建
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='logs_fts'").fetchone()
+    if row is None:
+        return ""
+    return "trigram" if "trigram" in row[0] else "unicode61"
+
+def create_fts(conn):
+    # 在调用方的事务里执行，只建表和触发器，不扫描已有日志，持锁时间与日志量无关。
+    # trigram 支持任意子串（订单号片段也能搜到），SQLite < 3.34 没有 trigram 时退回 unicode61 按词搜索
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5("
+            "message_text, content='logs', content_rowid='id', tokenize='trigram')"
+        )
+    except sqlite3.OperationalError:
+        print("⚠️ 当前 SQLite 不支持 trigram 分词，日志搜索改为按词匹配")
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5("
+            "message_text, content='logs', content_rowid='id', tokenize='unicode61')"
+        )
+    conn.execute(BACKFILL_TABLE_SQL)
+    conn.execute("INSERT OR IGNORE INTO logs_fts_backfill (id, start_id, done_id, upto_id) "
+                 "SELECT 1, COALESCE(MIN(id) - 1, 0), COALESCE(MIN(id) - 1, 0), COALESCE(MAX(id), 0) FROM logs")
+    # 触发器在写日志的同一事务里更新索引，runner 和日志清理都不需要改
+    conn.execute("""
+    CREATE TRIGGER IF NOT EXISTS logs_fts_insert AFTER INSERT ON logs BEGIN
+      INSERT INTO logs_fts (rowid, message_text) VALUES (new.id, new.message_text);
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS logs_fts_delete AFTER DELETE ON logs WHEN {INDEXED_WHEN} BEGIN
+      INSERT INTO logs_fts (logs_fts, rowid, message_text) VALUES ('delete', old.id, old.message_text);
+    END
+    """)
+    # 还没补建的行改了内容不用处理，补建时按新内容建索引
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS logs_fts_update AFTER UPDATE OF message_text ON logs WHEN {INDEXED_WHEN} BEGIN
+      INSERT INTO logs_fts (logs_fts, rowid, message_text) VALUES ('delete', old.id, old.message_text);
+      INSERT INTO logs_fts (rowid, message_text) VALUES (new.id, new.message_text);
+    END
+    """)
+    # 每次写入触发的段合并：默认 4 个段就合并，runner 每批日志都要做一轮合并；8 摊得更开，写入更平稳
+    conn.execute("INSERT INTO logs_fts (logs_fts, rank) VALUES ('automerge', 8)")
+
+def drop_fts(conn):
+    for name in TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute("DROP TABLE IF EXISTS logs_fts")
+    conn.execute("DROP TABLE IF EXISTS logs_fts_backfill")
+
+def apply_setting(conn):
+    # migrate() 最后调用：按 LOG_FTS 建表或删表；状态一致时不开写事务
+    if (fts_tokenizer(conn) != "") == LOG_FTS:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        exists = fts_tokenizer(conn) != ""
+        if LOG_FTS and not exists:
+            create_fts(conn)
+            print("🔍 已启用日志全文索引，已有日志将在后台补建索引")
+        elif not LOG_FTS and exists:
+            drop_fts(conn)
+            print("🔍 LOG_FTS=0，已删除日志全文索引")
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+def backfill_progress(conn):
+    # 返回按 id 估计的补建进度百分比；补完或没有进度表时返回 None
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='logs_fts_backfill'").fetchone():
+        return None
+    row = conn.execute("SELECT start_id, done_id, upto_id FROM logs_fts_backfill WHERE id = 1").fetchone()
+    if row is None or row[1] >= row[2]:
+        return None
+    start_id, done_id, upto_id = row
+    return round((done_id - start_id) * 100 / (upto_id - start_id), 1)
+
+def backfill_batch(conn, batch: int) -> int:
+    # 补建一批（最多 batch 行）并推进 done_id，返回本批行数；0 表示已补完
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = None
+        if fts_tokenizer(conn):
+            row = conn.execute("SELECT done_id, upto_id FROM logs_fts_backfill WHERE id = 1").fetchone()
+        if row is None or row[0] >= row[1]:
+            conn.rollback()
+            return 0
+        done_id, upto_id = row
+        # 按主键取第 batch 行作为本批上界，id 有空洞（日志已清理）时每批行数也稳定
+        hi = conn.execute(
+            "SELECT id FROM logs WHERE id > ? AND id <= ? ORDER BY id LIMIT 1 OFFSET ?", (done_id, upto_id, batch - 1)
+        ).fetchone()
+        hi = hi[0] if hi is not None else upto_id
+        n = conn.execute(
+            "INSERT INTO logs_fts (rowid, message_text) SELECT id, message_text FROM logs WHERE id > ? AND id <= ?",
+            (done_id, hi)
+        ).rowcount
+        conn.execute("UPDATE logs_fts_backfill SET done_id = ? WHERE id = 1", (hi,))
+        conn.commit()
+        # 剩下的区间里已经没有日志（都被清理了）时也要推进到 upto_id，返回 1 让调用方再跑一轮确认
+        return max(n, 1)
+    except Exception:
+        conn.rollback()
+        raise
+
+def backfill(conn=None, seconds: float = LOG_FTS_BACKFILL_SECONDS, pause: float = LOG_FTS_BACKFILL_PAUSE,
+             should_stop=None) -> dict:
+    # 分批补建直到补完；should_stop()：每批之间检查，返回 True 时提前结束，下次从 done_id 继续
+    t0 = time.monotonic()
+    result = {"rows": 0, "batches": 0}
+    batch = 100
+    own = conn is None
+    if own:
+        conn = db.connect()
+    try:
+        while not (should_stop and should_stop()):
+            t = time.monotonic()
+            n = backfill_batch(conn, batch)
+            if not n:
+                break
+            result["rows"] += n
+            result["batches"] += 1
+            # 日志长短差别很大（几十字到几千字），按耗时调整下一批的行数
+            elapsed = time.monotonic() - t
+            if elapsed < seconds / 2:
+                batch = min(batch * 2, 20000)
+            elif elapsed > seconds:
+                batch = max(batch // 2, 10)
+            if pause:
+                time.sleep(pause)
+        return result
+    finally:
+        if own:
+            conn.close()
+        result["seconds"] = round(time.monotonic() - t0, 2)
+
+
+class BackfillTask:
+    # bot_runner 启动时在线程里补建一次，补完即结束；进程退出时中断，下次启动从进度表继续
+    def __init__(self):
+        self.task = None
+        self.stopping = False
+
+    def start(self):
+        if self.task is None and LOG_FTS:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        try:
+            result = await asyncio.to_thread(backfill, should_stop=lambda: self.stopping)
+            if result["rows"]:
+                print(f"🔍 日志全文索引补建：{result}")
+        except sqlite3.Error as e:
+            print(f"⚠️ 日志全文索引补建失败，下次启动继续：{e}")
+
+    async def close(self):
+        self.stopping = True
+        if self.task is not None:
+            await self.task
+
+def match_expr(q: str, tokenizer: str) -> str:
+    # 整个关键字作为一个短语，用户输入里的 FTS 语法字符不生效
+    phrase = '"' + q.replace('"', '""') + '"'
+    if tokenizer == "unicode61":
+        return phrase + " *"
+    return phrase
+
+def highlight_html(text: str) -> str:
+    return html.escape(text or "").replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+def search(conn, q: str, bot_id=None, rule_id=None, before_id=None, limit: int = SEARCH_PAGE_LIMIT):
+    # 返回 (rows, next_before_id)；按 id 从新到旧，next_before_id 为 None 表示没有下一页
+    tokenizer = fts_tokenizer(conn)
+    if not tokenizer:
+        raise ValueError("日志全文索引未启用（LOG_FTS=0），或尚未执行数据库迁移（python migrations.py）")
+    if tokenizer == "trigram" and len(q) < TRIGRAM_MIN_CHARS:
+        raise ValueError(f"关键字至少 {TRIGRAM_MIN_CHARS} 个字符")
+
+    where, params = ["logs_fts MATCH ?"], [match_expr(q, tokenizer)]
+    if before_id is not None:
+        where.append("logs_fts.rowid < ?")
+        params.append(before_id)
+    if bot_id is not None:
+        where.append("l.bot_id = ?")
+        params.append(bot_id)
+    if rule_id is not None:
+        where.append("l.rule_id = ?")
+        params.append(rule_id)
+    rows = conn.execute(
+        "SELECT l.id, l.ts, l.bot_id, l.rule_id, l.message_type, "
+        f"highlight(logs_fts, 0, '{MARK_START}', '{MARK_END}') AS hl "
+        "FROM logs_fts JOIN logs l ON l.id = logs_fts.rowid "
+        f"WHERE {' AND '.join(where)} ORDER BY logs_fts.rowid DESC LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
+    next_before_id = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_before_id
@@ -0,0 +1,167 @@
+import os
+import queue
+import socket
+import threading
+
+import db
+
+# /logs/stream 的数据源：后台进程里一个线程按 id 追新日志，分发给所有打开日志页的浏览器。
+# bot_runner 每批日志落盘后发一个 UDP 提醒，线程立即去查；提醒丢失时每 LOG_STREAM_POLL_SECONDS 兜底查一次
+LOG_NOTIFY_HOST = os.environ.get("LOG_NOTIFY_HOST", "127.0.0.1")
+LOG_NOTIFY_PORT = int(os.environ.get("LOG_NOTIFY_PORT", 8898))
+LOG_STREAM_POLL_SECONDS = float(os.environ.get("LOG_STREAM_POLL_SECONDS", 1))
+# 每个浏览器最多积压的日志条数，超过说明客户端跟不上，断开让它重连补拉
+LOG_STREAM_CLIENT_BUFFER = int(os.environ.get("LOG_STREAM_CLIENT_BUFFER", 500))
+LOG_STREAM_MAX_CLIENTS = int(os.environ.get("LOG_STREAM_MAX_CLIENTS", 50))
+# 每次最多取多少条新日志
+LOG_STREAM_FETCH = 1000
+
+
+def notify():
+    # bot_runner 调用：有新日志落盘
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(b"logs", (LOG_NOTIFY_HOST, LOG_NOTIFY_PORT))
+    except OSError:
+        pass
+
+def row_dict(r) -> dict:
+    return {
+        "id": r["id"],
+        "ts": r["ts"],
+        "bot_id": r["bot_id"],
+        "rule_id": r["rule_id"],
+        "message_type": r["message_type"],
+        "message_text": r["message_text"],
+    }
+
+
+class Subscriber:
+    def __init__(self, bot_id=None, rule_id=None, message_type: str = "", buffer: int = LOG_STREAM_CLIENT_BUFFER):
+        self.bot_id = bot_id
+        self.rule_id = rule_id
+        self.message_type = message_type
+        self.queue = queue.Queue(buffer)
+        # 缓冲区满时置为 True，连接随后被关闭
+        self.overflowed = False
+
+    def wants(self, row: dict) -> bool:
+        if self.bot_id is not None and row["bot_id"] != self.bot_id:
+            return False
+        if self.rule_id is not None and row["rule_id"] != self.rule_id:
+            return False
+        if self.message_type and row["message_type"] != self.message_type:
+            return False
+        return True
+
+    def offer(self, row: dict):
+        if self.overflowed or not self.wants(row):
+            return
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self.overflowed = True
+            # 放一个结束标记，唤醒正在等待的连接
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(None)
+
+
+class LogBroadcaster:
+    def __init__(self, max_clients: int = LOG_STREAM_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.wakeup = threading.Event()
+        self.last_id = None
+
+        self.queries = 0
+        self.sent = 0
+        self.overflows = 0
+
+    def subscribe(self, sub: Subscriber) -> bool:
+        # 调用方在 subscribe 之后再查库补发：没人订阅时起点在这里（锁内）定下，而不是等推送线程下次去查，
+        # 否则补发查询和推送起点之间写入的日志两边都不会发
+        with self.lock:
+            if len(self.subscribers) >= self.max_clients:
+                return False
+            if self.last_id is None:
+                conn = db.connect()
+                try:
+                    self.last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM logs").fetchone()[0]
+                finally:
+                    conn.close()
+            self.subscribers.add(sub)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="log-stream", daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return True
+
+    def unsubscribe(self, sub: Subscriber):
+        with self.lock:
+            self.subscribers.discard(sub)
+            if sub.overflowed:
+                self.overflows += 1
+
+    def listen(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((LOG_NOTIFY_HOST, LOG_NOTIFY_PORT))
+        except OSError as e:
+            print(f"⚠️ 日志通知端口 {LOG_NOTIFY_PORT} 不可用，改为每 {LOG_STREAM_POLL_SECONDS}s 查询一次：{e}")
+            return
+        while True:
+            sock.recv(64)
+            self.wakeup.set()
+
+    def run(self):
+        threading.Thread(target=self.listen, name="log-stream-notify", daemon=True).start()
+        while True:
+            self.wakeup.wait(LOG_STREAM_POLL_SECONDS)
+            self.wakeup.clear()
+            with self.lock:
+                subs = list(self.subscribers)
+                if not subs:
+                    # 没人看时不查库；下次有人订阅时从当时的最新 id 开始
+                    self.last_id = None
+            if not subs:
+                continue
+            try:
+                self.poll(subs)
+            except Exception as e:
+                print(f"⚠️ 日志推送查询失败：{e}")
+
+    def poll(self, subs):
+        conn = db.connect()
+        try:
+            while True:
+                rows = conn.execute(
+                    "SELECT * FROM logs WHERE id > ? ORDER BY id LIMIT ?", (self.last_id, LOG_STREAM_FETCH)
+                ).fetchall()
+                self.queries += 1
+                for r in rows:
+                    row = row_dict(r)
+                    for sub in subs:
+                        sub.offer(row)
+                    self.last_id = row["id"]
+                self.sent += len(rows)
+                if len(rows) < LOG_STREAM_FETCH:
+                    return
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.subscribers),
+            "last_id": self.last_id,
+            "queries": self.queries,
+            "sent": self.sent,
+            "overflows": self.overflows,
+        }
+
+
+broadcaster = LogBroadcaster()
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import sqlite3
+from datetime import datetime
+
+LOG_QUEUE_MAX = int(os.environ.get("LOG_QUEUE_MAX", 10000))
+LOG_BATCH_SIZE = int(os.environ.get("LOG_BATCH_SIZE", 200))
+LOG_FLUSH_SECONDS = float(os.environ.get("LOG_FLUSH_SECONDS", 0.5))
+LOG_WRITE_RETRIES = 3
+
+INSERT_LOG_SQL = "INSERT INTO logs (ts, bot_id, rule_id, message_type, message_text) VALUES (?, ?, ?, ?, ?)"
+
+
+class LogWriter:
+    # handler 只把日志放进内存队列；后台任务攒批后交给 AsyncDB 的写线程 executemany + 一次 commit。
+    # 队列满时丢弃新日志并计数，不阻塞消息处理
+    def __init__(self, adb, max_queue: int = LOG_QUEUE_MAX, batch_size: int = LOG_BATCH_SIZE,
+                 flush_seconds: float = LOG_FLUSH_SECONDS, on_flush=None):
+        # on_flush()：每批写入成功后调用（通知后台有新日志）
+        self.adb = adb
+        self.on_flush = on_flush
+        self.queue = asyncio.Queue(max_queue)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.task = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def put(self, bot_id, rule_id, message_type, message_text) -> bool:
+        record = (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), bot_id, rule_id, message_type, (message_text or "")[:5000])
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                print(f"⚠️ 日志队列已满（{self.queue.maxsize}），累计丢弃 {self.dropped} 条")
+            return False
+        self.enqueued += 1
+        if self.queue.qsize() >= self.batch_size:
+            self.wakeup.set()
+        return True
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while not (self.closing and self.queue.empty()):
+            if self.queue.qsize() < self.batch_size and not self.closing:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.flush_seconds)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeup.clear()
+
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if batch:
+                await self.flush(batch)
+
+    async def flush(self, batch):
+        for attempt in range(1, LOG_WRITE_RETRIES + 1):
+            try:
+                await self.adb.write(self.write_batch, batch)
+                self.written += len(batch)
+                self.batches += 1
+                if self.on_flush is not None:
+                    self.on_flush()
+                return
+            except sqlite3.Error as e:
+                if attempt == LOG_WRITE_RETRIES:
+                    self.failed += len(batch)
+                    print(f"❌ 日志写入失败，丢弃 {len(batch)} 条：{e}")
+                    return
+                await asyncio.sleep(0.2 * attempt)
+
+    @staticmethod
+    def write_batch(conn, batch):
+        conn.executemany(INSERT_LOG_SQL, batch)
+
+    async def close(self):
+        # 停止接收后把队列里剩余日志全部落盘
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+        else:
+            while not self.queue.empty():
+                batch = []
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                await self.flush(batch)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -0,0 +1,230 @@
+import bisect
+import os
+import time
+import urllib.request
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from sharding import RUNNER_SHARDS
+
+# runner 运行指标（计数器/直方图），按 Prometheus 文本格式从本机端口 /metrics 输出；
+# 后台 /metrics 把各 runner 进程的指标合并后再输出，Prometheus 只需要抓后台一个地址
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+# 0 表示不开端口；分片模式下协调进程用 METRICS_PORT，第 i 个 worker 用 METRICS_PORT + 1 + i
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9464))
+# 后台抓取的 runner 地址，逗号分隔；不设置时按 METRICS_PORT / RUNNER_SHARDS 推算本机地址
+RUNNER_METRICS_URLS = os.environ.get("RUNNER_METRICS_URLS", "").strip()
+METRICS_SCRAPE_TIMEOUT = float(os.environ.get("METRICS_SCRAPE_TIMEOUT", 2))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 网络请求（查询接口、Telegram）与本地操作（规则匹配、数据库写入）用不同的桶
+NETWORK_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LOCAL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+
+registry = []
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=(), collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        # {标签值元组: 值}；各进程只在事件循环线程里更新，数据库写入时间在写线程里更新（只有一个写线程）
+        self.series = {}
+        # collect 返回 [(标签值元组, 值)]，输出时调用，直接读各模块已有的统计，不用在热路径上重复计数
+        self.collect = collect
+        registry.append(self)
+
+    def items(self):
+        return list(self.collect()) if self.collect else list(self.series.items())
+
+    def samples(self):
+        # [(后缀, 标签字符串, 值)]
+        return [("", format_labels(self.labels, k), v) for k, v in self.items()]
+
+    def render(self, lines: list):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {format_value(value)}")
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *label_values):
+        self.series[label_values] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=NETWORK_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, seconds: float, *label_values):
+        s = self.series.get(label_values)
+        if s is None:
+            # [各桶计数（最后一个是 +Inf）, 总和, 总数]
+            s = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        s[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        s[1] += seconds
+        s[2] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *label_values)
+
+    def samples(self):
+        out = []
+        for k, (counts, total, n) in self.items():
+            cumulative = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le_text = "+Inf" if le == float("inf") else format_value(float(le))
+                out.append(("_bucket", format_labels(self.labels, k, f'le="{le_text}"'), cumulative))
+            out.append(("_sum", format_labels(self.labels, k), total))
+            out.append(("_count", format_labels(self.labels, k), n))
+        return out
+
+
+def render() -> str:
+    lines = []
+    for m in registry:
+        m.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+# ---- runner 指标 ----
+updates_received = Counter("tg_updates_received_total", "收到的 Telegram 消息/命令数", ("bot_id",))
+rules_evaluated = Counter("tg_rules_evaluated_total", "关键字命中后逐条检查的候选规则数", ("bot_id",))
+rule_matches = Counter("tg_rule_matches_total", "匹配成功并提交执行的规则数", ("bot_id", "action"))
+match_seconds = Histogram("tg_match_seconds", "单条消息的规则匹配耗时（含商户订单号正则）", ("bot_id",), LOCAL_BUCKETS)
+regex_timeouts = Counter("tg_regex_timeouts_total", "商户订单号正则执行超时次数", ("bot_id",))
+lookup_seconds = Histogram("tg_lookup_seconds", "查询接口（lookup_url）请求耗时，status 为 HTTP 状态码或 timeout/error",
+                           ("host", "status"))
+send_seconds = Histogram("tg_send_seconds", "Telegram 发送请求耗时（不含限流排队）", ("bot_id", "endpoint"))
+send_wait_seconds = Histogram("tg_send_wait_seconds", "Telegram 发送在限流令牌桶里的排队时间", ("bot_id",))
+send_errors = Counter("tg_send_errors_total", "Telegram 发送失败次数（含随后被降级重发的）", ("bot_id", "endpoint", "error"))
+send_retry_after = Counter("tg_send_retry_after_total", "Telegram 返回 RetryAfter（限流）次数", ("bot_id",))
+db_write_seconds = Histogram("tg_db_write_seconds", "runner 写数据库耗时（含等待写锁）", ("op",), LOCAL_BUCKETS)
+
+
+def start_time_gauge():
+    started = time.time()
+    Gauge("tg_process_start_time_seconds", "进程启动时间（Unix 时间戳）", collect=lambda: [((), started)])
+
+start_time_gauge()
+
+
+async def serve(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    # runner 里调用：在本机端口提供 GET /metrics；返回 MiniHTTPServer，端口为 0 或不可用时返回 None
+    from mini_http import MiniHTTPServer, Response
+
+    async def handle(req):
+        if req.path != "/metrics":
+            return Response("not found", 404)
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    if not port:
+        return None
+    try:
+        server = await MiniHTTPServer(handle).start(host, port)
+    except OSError as e:
+        print(f"⚠️ 指标端口 {host}:{port} 不可用，不输出 /metrics：{e}")
+        return None
+    print(f"📈 运行指标：http://{host}:{port}/metrics")
+    return server
+
+
+# ---- 后台合并 ----
+def runner_metrics_urls() -> list:
+    if RUNNER_METRICS_URLS:
+        return [u.strip() for u in RUNNER_METRICS_URLS.split(",") if u.strip()]
+    if not METRICS_PORT:
+        return []
+    host = "127.0.0.1" if METRICS_HOST in ("0.0.0.0", "") else METRICS_HOST
+    ports = [METRICS_PORT]
+    if RUNNER_SHARDS > 1:
+        ports += [METRICS_PORT + 1 + i for i in range(RUNNER_SHARDS)]
+    return [f"http://{host}:{p}/metrics" for p in ports]
+
+def add_label(line: str, label: str) -> str:
+    # 给一行样本加上 instance 标签：name{a="1"} 3 → name{instance="x",a="1"} 3
+    brace, space = line.find("{"), line.find(" ")
+    if brace != -1 and (space == -1 or brace < space):
+        return f"{line[:brace + 1]}{label},{line[brace + 1:]}"
+    return f"{line[:space]}{{{label}}}{line[space:]}"
+
+def merge(sources) -> str:
+    # sources: [(instance, 指标文本或 None)]；同名指标的 HELP/TYPE 只保留一份，样本加上 instance 标签，
+    # 另外输出 tg_runner_up 表示每个地址是否抓取成功
+    families, order = {}, []
+    up = []
+    for instance, text in sources:
+        up.append((instance, 0 if text is None else 1))
+        if text is None:
+            continue
+        label = f'instance="{escape_label(instance)}"'
+        current = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    current = parts[2]
+                    if current not in families:
+                        families[current] = {"HELP": None, "TYPE": None, "samples": []}
+                        order.append(current)
+                    families[current][parts[1]] = families[current][parts[1]] or line
+                continue
+            if current is not None:
+                families[current]["samples"].append(add_label(line, label))
+
+    lines = ["# HELP tg_runner_up runner 指标地址是否抓取成功", "# TYPE tg_runner_up gauge"]
+    lines += [f'tg_runner_up{{instance="{escape_label(i)}"}} {v}' for i, v in up]
+    for name in order:
+        f = families[name]
+        lines += [h for h in (f["HELP"], f["TYPE"]) if h]
+        lines += f["samples"]
+    return "\n".join(lines) + "\n"
+
+def scrape(url: str, timeout: float = METRICS_SCRAPE_TIMEOUT):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            return resp.read().decode("utf-8")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 抓取 runner 指标失败 {url}：{e}")
+        return None
+
+def collect_runners() -> str:
+    return merge((urlsplit(url).netloc or url, scrape(url)) for url in runner_metrics_urls())
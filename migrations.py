@@ -0,0 +1,217 @@
+import sqlite3
+from datetime import datetime
+
+import db
+import log_search
+
+# 统一的数据库迁移：后台和 bot_runner 启动时都调用 migrate()，按版本号顺序执行尚未执行的步骤。
+# 每一步在自己的 BEGIN IMMEDIATE 事务里执行并记录到 schema_version，两个进程同时启动时只会有一个执行；
+# 步骤本身也写成幂等的，兼容旧版 migrate_*.py 建过表的数据库。
+# 用法：python migrations.py
+
+
+def ensure_column(conn, table: str, column: str, decl: str):
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def table_exists(conn, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+def create_index(table: str, name: str, columns: str):
+    # 大 logs 表上建索引会持有写锁一段时间：每个索引单独一步（单独一个短事务），
+    # 期间 runner 的日志写入在 busy_timeout 内等待、LogWriter 失败会重试
+    def step(conn):
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    return step
+
+
+def base_tables(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bots (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      name TEXT NOT NULL,
+      token TEXT NOT NULL,
+      enabled INTEGER NOT NULL DEFAULT 1
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS rules (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      bot_id INTEGER NOT NULL,
+      action_type TEXT DEFAULT 'edit_send',
+      source_group_id TEXT NOT NULL,
+      target_group_id TEXT NOT NULL,
+      user_id TEXT DEFAULT '',
+      user_ids TEXT DEFAULT '',
+      keyword TEXT NOT NULL,
+      enabled INTEGER NOT NULL DEFAULT 1,
+      append_text TEXT DEFAULT '',
+      merchant_regex TEXT DEFAULT '',
+      lookup_url TEXT DEFAULT '',
+      replace_template TEXT DEFAULT '',
+      reply_text TEXT DEFAULT ''
+    )
+    """)
+
+    # 旧版 migrate_v3 建的 logs.ts 是 TIMESTAMP 类型；写入的都是 'YYYY-MM-DD HH:MM:SS' 文本，比较和排序一致，不需要重建表
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS logs (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      ts TEXT NOT NULL,
+      bot_id INTEGER,
+      rule_id INTEGER,
+      message_type TEXT,
+      message_text TEXT
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS status (
+      bot_id INTEGER NOT NULL,
+      key TEXT NOT NULL,
+      value TEXT DEFAULT '',
+      PRIMARY KEY (bot_id, key)
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tg_users (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id TEXT UNIQUE NOT NULL,
+      name TEXT NOT NULL DEFAULT ''
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS tg_groups (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      group_id TEXT UNIQUE NOT NULL,
+      name TEXT NOT NULL DEFAULT ''
+    )
+    """)
+
+def rules_lookup_timeout(conn):
+    ensure_column(conn, "rules", "lookup_timeout", "REAL")
+
+def config_version_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS config_version (
+      scope TEXT PRIMARY KEY,
+      version INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+def drop_empty_contacts(conn):
+    # 旧版 migrate_contacts 建的占位表，没有任何代码使用；有数据时保留，避免误删
+    if not table_exists(conn, "contacts"):
+        return
+    n = conn.execute("SELECT COUNT(*) FROM contacts").fetchone()[0]
+    if n == 0:
+        conn.execute("DROP TABLE contacts")
+    else:
+        print(f"⚠️ contacts 表还有 {n} 行数据，未删除")
+
+def logs_hourly_table(conn):
+    # 按小时汇总被清理的日志条数（log_retention 删除原始日志前写入）
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS logs_hourly (
+      hour TEXT NOT NULL,
+      bot_id INTEGER NOT NULL,
+      rule_id INTEGER NOT NULL,
+      message_type TEXT NOT NULL,
+      count INTEGER NOT NULL DEFAULT 0,
+      PRIMARY KEY (hour, bot_id, rule_id, message_type)
+    )
+    """)
+
+def logs_fts_table(conn):
+    # logs.message_text 的全文索引（log_search.py）。外部内容表：不重复存正文，只存索引。
+    # 这一步只建表和触发器；已有日志不在迁移事务里建索引（大表要几分钟，会让另一个进程的迁移和 runner 写日志
+    # 等不到写锁），由 runner 的 log_search.BackfillTask 分批补建。LOG_FTS=0 时不建，之后由 apply_setting 处理
+    if log_search.LOG_FTS:
+        log_search.create_fts(conn)
+
+def rule_stats_table(conn):
+    # 每条规则的评估/命中次数、最近命中时间、动作耗时 p50/p95（毫秒）、查询失败次数（rule_stats.py 定期写入）
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS rule_stats (
+      rule_id INTEGER PRIMARY KEY,
+      evaluations INTEGER NOT NULL DEFAULT 0,
+      matches INTEGER NOT NULL DEFAULT 0,
+      lookup_failures INTEGER NOT NULL DEFAULT 0,
+      last_match_at TEXT,
+      p50_ms REAL,
+      p95_ms REAL,
+      updated_at TEXT
+    )
+    """)
+
+
+# (版本号, 说明, 步骤)；只能在末尾追加，已发布的步骤不要修改
+MIGRATIONS = (
+    (1, "基础表 bots/rules/logs/status/tg_users/tg_groups", base_tables),
+    (2, "rules.lookup_timeout", rules_lookup_timeout),
+    (3, "config_version 表", config_version_table),
+    (4, "索引 rules(bot_id, enabled)", create_index("rules", "idx_rules_bot_enabled", "bot_id, enabled")),
+    (5, "索引 logs(bot_id)", create_index("logs", "idx_logs_bot_id", "bot_id")),
+    (6, "索引 logs(rule_id)", create_index("logs", "idx_logs_rule_id", "rule_id")),
+    (7, "索引 logs(ts)", create_index("logs", "idx_logs_ts", "ts")),
+    (8, "删除空的 contacts 占位表", drop_empty_contacts),
+    (9, "logs_hourly 汇总表", logs_hourly_table),
+    (10, "日志全文索引 logs_fts", logs_fts_table),
+    (11, "索引 tg_users(name)", create_index("tg_users", "idx_tg_users_name", "name")),
+    (12, "索引 tg_groups(name)", create_index("tg_groups", "idx_tg_groups_name", "name")),
+    (13, "rule_stats 规则命中统计表", rule_stats_table),
+)
+
+
+def current_version(conn) -> int:
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+def migrate(conn=None) -> int:
+    own = conn is None
+    if own:
+        conn = db.connect()
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+          version INTEGER PRIMARY KEY,
+          name TEXT NOT NULL,
+          applied_at TEXT NOT NULL
+        )
+        """)
+        conn.commit()
+
+        for version, name, step in MIGRATIONS:
+            if current_version(conn) >= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 拿到写锁后再确认一次：另一个进程可能刚执行完
+                if current_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                step(conn)
+                conn.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+                )
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            print(f"🗃️ 数据库迁移 v{version}：{name}")
+        log_search.apply_setting(conn)
+        return current_version(conn)
+    finally:
+        if own:
+            conn.close()
+
+
+if __name__ == "__main__":
+    print(f"✅ 数据库结构版本：v{migrate()}")
+    # 手动执行时顺便补完日志全文索引（分批短事务，runner 运行中也可以执行）
+    if log_search.LOG_FTS:
+        print(f"🔍 日志全文索引补建：{log_search.backfill()}")
@@ -0,0 +1,101 @@
+import asyncio
+import json
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl
+
+# 极简 asyncio HTTP/1.1 服务端（支持 keep-alive），给 runner 的本地端口和压测桩服务用；
+# 不处理 chunked 请求体，只适合内网/本机
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: dict, body: bytes):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b"null")
+
+
+class Response:
+    def __init__(self, body=b"", status: int = 200, content_type: str = "text/plain; charset=utf-8", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, data, status: int = 200):
+        return cls(json.dumps(data, ensure_ascii=False), status, "application/json")
+
+
+class MiniHTTPServer:
+    def __init__(self, handler):
+        self.handler = handler
+        self.server = None
+        self.connections = 0
+        self.requests = 0
+        self.writers = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            # 3.12+ 的 wait_closed 会等所有连接结束，先主动断开 keep-alive 连接
+            for w in list(self.writers):
+                w.close()
+            await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+
+                self.requests += 1
+                try:
+                    resp = await self.handler(Request(method, target, headers, body))
+                except Exception as e:
+                    resp = Response(f"internal error: {e!r}", 500)
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+                head = [f"HTTP/1.1 {resp.status} {HTTPStatus(resp.status).phrase}",
+                        f"Content-Type: {resp.content_type}",
+                        f"Content-Length: {len(resp.body)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head += [f"{k}: {v}" for k, v in resp.headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + resp.body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        # CancelledError 不吞掉：关闭时要能取消正在处理中的连接
+        finally:
+            self.writers.discard(writer)
+            writer.close()
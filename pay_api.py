@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+
+import metrics
+
+# ⚠️ 重要：请在 Railway 环境变量中设置 ROBOT_SECRET_KEY
+ROBOT_SECRET_KEY = os.environ.get("ROBOT_SECRET_KEY", "RobotSecret123456")
+
+# 查询接口连接池：每个 lookup_url 主机一个长连接客户端
+PAY_TIMEOUT = float(os.environ.get("PAY_TIMEOUT", 15))
+PAY_MAX_CONNECTIONS = int(os.environ.get("PAY_MAX_CONNECTIONS", 20))
+PAY_MAX_KEEPALIVE = int(os.environ.get("PAY_MAX_KEEPALIVE", 20))
+PAY_KEEPALIVE_EXPIRY = float(os.environ.get("PAY_KEEPALIVE_EXPIRY", 60))
+PAY_HTTP2 = os.environ.get("PAY_HTTP2", "0") == "1"
+
+# mchOrderNo → payOrderId 缓存：查到的结果缓存 PAY_CACHE_TTL 秒，查不到的只缓存 PAY_CACHE_NEGATIVE_TTL 秒
+PAY_CACHE_SIZE = int(os.environ.get("PAY_CACHE_SIZE", 5000))
+PAY_CACHE_TTL = float(os.environ.get("PAY_CACHE_TTL", 600))
+PAY_CACHE_NEGATIVE_TTL = float(os.environ.get("PAY_CACHE_NEGATIVE_TTL", 10))
+
+# 签名时间戳格式：记住每个 lookup_url 上哪种格式（毫秒/秒）查询成功过，下次先用它；
+# 每隔 PAY_TS_REPROBE_SECONDS 按默认顺序（毫秒优先）重新探测一次
+PAY_TS_REPROBE_SECONDS = float(os.environ.get("PAY_TS_REPROBE_SECONDS", 3600))
+# 尚无偏好时同时发出毫秒、秒两个请求，先成功的胜出并取消另一个
+PAY_TS_RACE = os.environ.get("PAY_TS_RACE", "0") == "1"
+
+TS_MS = "ms"
+TS_S = "s"
+DEFAULT_TS_ORDER = (TS_MS, TS_S)
+
+
+def robot_sign(params: dict, secret_key: str) -> str:
+    items = []
+    for k in sorted(params.keys()):
+        if k == "sign":
+            continue
+        v = params.get(k)
+        if v is None:
+            continue
+        sv = str(v).strip()
+        if sv == "":
+            continue
+        items.append(f"{k}={sv}")
+    raw = "&".join(items) + f"&key={secret_key}"
+    return hashlib.md5(raw.encode("utf-8")).hexdigest().upper()
+
+
+class PayClientPool:
+    def __init__(self, max_connections: int = PAY_MAX_CONNECTIONS, max_keepalive: int = PAY_MAX_KEEPALIVE,
+                 keepalive_expiry: float = PAY_KEEPALIVE_EXPIRY, http2: bool = PAY_HTTP2):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("⚠️ PAY_HTTP2=1 但未安装 h2（pip install httpx[http2]），改用 HTTP/1.1")
+                http2 = False
+        self.http2 = http2
+        self.clients = {}
+
+    def client_for(self, url: str) -> httpx.AsyncClient:
+        u = httpx.URL(url)
+        key = (u.scheme, u.host, u.port)
+        client = self.clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=PAY_TIMEOUT,
+                follow_redirects=True,
+                limits=self.limits,
+                http2=self.http2,
+            )
+            self.clients[key] = client
+        return client
+
+    def warm(self, urls):
+        for url in urls:
+            if url:
+                self.client_for(url)
+
+    async def aclose(self):
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+
+pay_pool = PayClientPool()
+
+async def call_pay_api(base_api: str, query_params: dict, timeout: float = None) -> dict:
+    client = pay_pool.client_for(base_api)
+    host = httpx.URL(base_api).host
+    t0 = time.perf_counter()
+    try:
+        r = await client.get(base_api, params=query_params, timeout=timeout or PAY_TIMEOUT)
+    except httpx.TimeoutException:
+        metrics.lookup_seconds.observe(time.perf_counter() - t0, host, "timeout")
+        raise
+    except Exception:
+        metrics.lookup_seconds.observe(time.perf_counter() - t0, host, "error")
+        raise
+    metrics.lookup_seconds.observe(time.perf_counter() - t0, host, str(r.status_code))
+    r.raise_for_status()
+    return r.json()
+
+def make_timestamp(fmt: str) -> str:
+    if fmt == TS_MS:
+        return str(int(time.time() * 1000))
+    return str(int(time.time()))
+
+
+class TimestampPreference:
+    def __init__(self, reprobe_seconds: float = PAY_TS_REPROBE_SECONDS):
+        self.reprobe_seconds = reprobe_seconds
+        # base_api → (格式, 下次重新探测的时间)
+        self.learned = {}
+
+    def order(self, base_api: str):
+        # 返回尝试顺序；未知或到了重新探测的时间返回 None
+        entry = self.learned.get(base_api)
+        if entry is None:
+            return None
+        fmt, probe_at = entry
+        if time.monotonic() >= probe_at:
+            return None
+        return (fmt, TS_S if fmt == TS_MS else TS_MS)
+
+    def learn(self, base_api: str, fmt: str, probed: bool = False):
+        # 只有格式变化或这次是按默认顺序探测出来的才重新计时；按已知偏好查询成功不推迟探测，
+        # 否则流量不断时永远不会重新探测
+        entry = self.learned.get(base_api)
+        if entry is None or entry[0] != fmt or probed:
+            self.learned[base_api] = (fmt, time.monotonic() + self.reprobe_seconds)
+
+
+ts_preference = TimestampPreference()
+
+async def query_pay_order_by_mch_order_no(mch_order_no: str, base_api: str, timeout: float = None):
+    async def attempt(fmt: str, probed: bool):
+        ts = make_timestamp(fmt)
+        params = {"mchOrderNo": mch_order_no, "timestamp": ts}
+        params["sign"] = robot_sign(params, ROBOT_SECRET_KEY)
+        try:
+            js = await call_pay_api(base_api, params, timeout)
+        except Exception as e:
+            return None, {"exception": str(e), "ts": ts}
+        if js.get("code") == 0:
+            data = js.get("data") or {}
+            pay_order_id = data.get("payOrderId")
+            if pay_order_id:
+                ts_preference.learn(base_api, fmt, probed)
+                return str(pay_order_id), f"OK(ts={ts})"
+        return None, js
+
+    order = ts_preference.order(base_api)
+    last = None
+    if order is None and PAY_TS_RACE:
+        tasks = [asyncio.ensure_future(attempt(fmt, True)) for fmt in DEFAULT_TS_ORDER]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                pay_order_id, info = await fut
+                if pay_order_id:
+                    return pay_order_id, info
+                last = info
+        finally:
+            for t in tasks:
+                t.cancel()
+        return None, f"FAIL(resp={last})"
+
+    for fmt in order or DEFAULT_TS_ORDER:
+        pay_order_id, info = await attempt(fmt, order is None)
+        if pay_order_id:
+            return pay_order_id, info
+        last = info
+    return None, f"FAIL(resp={last})"
+
+
+class OrderLookupCache:
+    # LRU + TTL；同一个 key 正在查询时，后来的请求直接等待同一个查询结果
+    def __init__(self, max_size: int = PAY_CACHE_SIZE, ttl: float = PAY_CACHE_TTL,
+                 negative_ttl: float = PAY_CACHE_NEGATIVE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()
+        self.inflight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.expired = 0
+        self.evictions = 0
+
+    async def get(self, key, fetch):
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self.entries[key]
+            self.expired += 1
+
+        task = self.inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(fetch())
+            self.inflight[key] = task
+            task.add_done_callback(lambda t, key=key: self.fetch_done(key, t))
+        else:
+            self.shared += 1
+        # shield：某个等待方被取消时不影响其他等待方共享的查询
+        return await asyncio.shield(task)
+
+    def fetch_done(self, key, task):
+        self.inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        self.put(key, result, self.ttl if result[0] else self.negative_ttl)
+
+    def put(self, key, result, ttl: float):
+        if ttl <= 0:
+            return
+        self.entries[key] = (time.monotonic() + ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.entries),
+            "inflight": len(self.inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared": self.shared,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
+
+
+order_cache = OrderLookupCache()
+
+async def query_pay_order_cached(mch_order_no: str, base_api: str, timeout: float = None):
+    return await order_cache.get(
+        (base_api, mch_order_no),
+        lambda: query_pay_order_by_mch_order_no(mch_order_no, base_api, timeout)
+    )
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import re
+from dataclasses import dataclass
+
+from keyword_matcher import KeywordAutomaton
+from safe_regex import SafeRegex
+
+DEFAULT_MERCHANT_REGEX = r"商户订单号[:：]\s*([A-Za-z0-9_-]+)"
+
+# 同一源群的不同关键词数达到该值才编译自动机；关键词少时逐个 `in` 更快（见 bench_keyword_match.py）
+AC_MIN_KEYWORDS = int(os.environ.get("AC_MIN_KEYWORDS", 64))
+
+
+def normalize_list(s: str):
+    s = (s or "").replace("，", ",").strip()
+    return [x.strip() for x in s.split(",") if x.strip()]
+
+def normalize_keywords(keyword_field: str):
+    k = (keyword_field or "").strip()
+    if k == "*":
+        return ["*"]
+    return normalize_list(k)
+
+def normalize_user_ids(rule_row):
+    ids = (rule_row["user_ids"] if "user_ids" in rule_row.keys() else "") or ""
+    ids = ids.strip()
+    if ids:
+        return set(normalize_list(ids))
+    old = str(rule_row["user_id"] or "").strip()
+    return set([old]) if old else set()
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    id: int
+    source_group_id: str
+    target_group_id: str
+    action_type: str
+    allowed_users: frozenset
+    keywords: tuple
+    match_all: bool
+    append_text: str
+    merchant_regex: object
+    lookup_url: str
+    replace_template: str
+    lookup_timeout: object
+    reply_text: str
+
+    def match_keyword(self, text: str):
+        if self.match_all:
+            return "*"
+        if not text:
+            return None
+        for k in self.keywords:
+            if k in text:
+                return k
+        return None
+
+
+def compile_rule(r) -> CompiledRule:
+    keys = normalize_keywords(str(r["keyword"]))
+    action_type = (r["action_type"] or "edit_send").strip()
+    merchant_regex = None
+    if action_type == "lookup_replace":
+        merchant_regex = SafeRegex(r["merchant_regex"] or DEFAULT_MERCHANT_REGEX)
+    return CompiledRule(
+        id=int(r["id"]),
+        source_group_id=str(r["source_group_id"]),
+        target_group_id=str(r["target_group_id"]),
+        action_type=action_type,
+        allowed_users=frozenset(normalize_user_ids(r)),
+        keywords=tuple(keys),
+        match_all=keys == ["*"],
+        append_text=r["append_text"] or "",
+        merchant_regex=merchant_regex,
+        lookup_url=(r["lookup_url"] or "").strip(),
+        replace_template=(r["replace_template"] or "支付订单号：{{pay}}").strip(),
+        lookup_timeout=float(r["lookup_timeout"]) if "lookup_timeout" in r.keys() and r["lookup_timeout"] else None,
+        reply_text=(r["reply_text"] or "").strip() or "✅ 已收到",
+    )
+
+
+class RuleGroup:
+    # 同一源群下的规则，保持 id DESC 顺序
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self.wildcard_positions = tuple(i for i, r in enumerate(self.rules) if r.match_all)
+        kw_positions = {}
+        for i, r in enumerate(self.rules):
+            if r.match_all:
+                continue
+            for k in r.keywords:
+                kw_positions.setdefault(k, []).append(i)
+        self.kw_positions = {k: tuple(v) for k, v in kw_positions.items()}
+        self.automaton = None
+        if len(self.kw_positions) >= AC_MIN_KEYWORDS:
+            self.automaton = KeywordAutomaton(self.kw_positions.keys())
+
+    def matches(self, text: str):
+        # 按 id DESC 依次产出 (规则, 命中的关键词)；关键词取规则自身顺序中第一个出现的
+        if self.automaton is None:
+            for r in self.rules:
+                matched = r.match_keyword(text)
+                if matched is not None:
+                    yield r, matched
+            return
+
+        found = self.automaton.find(text) if text else set()
+        positions = set(self.wildcard_positions)
+        for k in found:
+            positions.update(self.kw_positions[k])
+        for i in sorted(positions):
+            r = self.rules[i]
+            if r.match_all:
+                yield r, "*"
+                continue
+            for k in r.keywords:
+                if k in found:
+                    yield r, k
+                    break
+
+
+class RuleIndex:
+    # 某个机器人的规则快照：按源群分桶，桶内保持 id DESC 顺序；构建后只读
+    def __init__(self, rows):
+        by_group = {}
+        for r in rows:
+            try:
+                rule = compile_rule(r)
+            except re.error as e:
+                print(f"⚠️ rule_id={r['id']} 正则无效，已跳过：{e}")
+                continue
+            by_group.setdefault(rule.source_group_id, []).append(rule)
+        self.by_group = {g: RuleGroup(rules) for g, rules in by_group.items()}
+
+    def rules_for_chat(self, chat_id: str):
+        group = self.by_group.get(chat_id)
+        return group.rules if group else ()
+
+    def matches(self, chat_id: str, text: str):
+        group = self.by_group.get(chat_id)
+        return group.matches(text) if group else ()
+
+    def __len__(self):
+        return sum(len(group.rules) for group in self.by_group.values())
+
+
+class RuleIndexCache:
+    # 每个机器人一份 RuleIndex；重建完成后整体替换引用，读取方永远拿到完整快照。
+    # 规则变更（config_version 的 rules 版本号变化）时 invalidate，下一条消息惰性重建。
+    # loader(bot_id) 是协程函数（在数据库线程里读规则）；同一机器人同时到达的消息共用一次加载
+    def __init__(self, loader):
+        self.loader = loader
+        self.indexes = {}
+        self.loading = {}
+        self.generation = 0
+
+    async def get(self, bot_id: int) -> RuleIndex:
+        index = self.indexes.get(bot_id)
+        if index is None:
+            index = await self.reload(bot_id)
+        return index
+
+    async def reload(self, bot_id: int) -> RuleIndex:
+        task = self.loading.get(bot_id)
+        if task is None:
+            task = asyncio.ensure_future(self.build(bot_id, self.generation))
+            self.loading[bot_id] = task
+            task.add_done_callback(lambda t: self.loading.pop(bot_id) if self.loading.get(bot_id) is t else None)
+        # 某条消息的处理被取消时不影响其它在等同一次加载的消息
+        return await asyncio.shield(task)
+
+    async def build(self, bot_id: int, generation: int) -> RuleIndex:
+        index = RuleIndex(await self.loader(bot_id))
+        # 加载期间规则又变了：这次结果只给已经在等的消息用，不缓存
+        if generation == self.generation:
+            self.indexes[bot_id] = index
+        return index
+
+    def drop(self, bot_id: int):
+        self.indexes.pop(bot_id, None)
+        self.loading.pop(bot_id, None)
+
+    def invalidate(self):
+        self.generation += 1
+        self.indexes = {}
+        self.loading = {}
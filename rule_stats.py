@@ -0,0 +1,127 @@
+import asyncio
+import os
+import sqlite3
+from collections import deque
+from datetime import datetime
+
+# 每条规则的命中统计：runner 先记在内存，每 RULE_STATS_FLUSH_SECONDS 合并写入 rule_stats 表，
+# /rules 页显示并可按评估次数、命中次数、最近命中、耗时排序，用来找出热点规则和从不命中的规则
+RULE_STATS_FLUSH_SECONDS = float(os.environ.get("RULE_STATS_FLUSH_SECONDS", 30))
+# p50/p95 按每个落盘周期内的动作处理耗时计算，每条规则每周期最多保留最近这么多次
+RULE_STATS_WINDOW = int(os.environ.get("RULE_STATS_WINDOW", 200))
+
+# 计数累加；p50/p95 只在这个周期里有新耗时时覆盖，没有动作的规则保留上次的值。规则已被删除的不再写入
+ADD_STATS_SQL = """
+INSERT INTO rule_stats (rule_id, evaluations, matches, lookup_failures, last_match_at, p50_ms, p95_ms, updated_at)
+SELECT ?, ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM rules WHERE id = ?)
+ON CONFLICT(rule_id) DO UPDATE SET
+  evaluations = evaluations + excluded.evaluations,
+  matches = matches + excluded.matches,
+  lookup_failures = lookup_failures + excluded.lookup_failures,
+  last_match_at = COALESCE(excluded.last_match_at, last_match_at),
+  p50_ms = COALESCE(excluded.p50_ms, p50_ms),
+  p95_ms = COALESCE(excluded.p95_ms, p95_ms),
+  updated_at = excluded.updated_at
+"""
+
+# 内存计数下标
+EVALUATIONS = 0
+MATCHES = 1
+LOOKUP_FAILURES = 2
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+class RuleStats:
+    # 消息热路径上只做字典计数，落盘时把所有规则的增量合并成一个事务
+    def __init__(self, adb, flush_seconds: float = RULE_STATS_FLUSH_SECONDS, window: int = RULE_STATS_WINDOW):
+        self.adb = adb
+        self.flush_seconds = flush_seconds
+        self.window = window
+        # rule_id → [评估, 命中, 查询失败]（上次落盘后的增量）
+        self.counts = {}
+        self.last_match = {}
+        # rule_id → 本周期的处理耗时（秒），落盘后清空，内存只跟最近一个周期的流量有关
+        self.latencies = {}
+        self.task = None
+
+    def add(self, rule_id: int, index: int):
+        c = self.counts.get(rule_id)
+        if c is None:
+            c = self.counts[rule_id] = [0, 0, 0]
+        c[index] += 1
+
+    def evaluated(self, rule_id: int):
+        # 关键字索引选出的候选规则，逐条检查用户/正则之前计一次
+        self.add(rule_id, EVALUATIONS)
+
+    def matched(self, rule_id: int):
+        self.add(rule_id, MATCHES)
+        self.last_match[rule_id] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def lookup_failed(self, rule_id: int):
+        self.add(rule_id, LOOKUP_FAILURES)
+
+    def observe(self, rule_id: int, seconds: float):
+        # 规则动作（查询接口 + 发送）的处理耗时
+        window = self.latencies.get(rule_id)
+        if window is None:
+            window = self.latencies[rule_id] = deque(maxlen=self.window)
+        window.append(seconds)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    @staticmethod
+    def rows(counts: dict, last_match: dict, latencies: dict) -> list:
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = []
+        for rule_id in set(counts) | set(last_match) | set(latencies):
+            evaluations, matches, failures = counts.get(rule_id, (0, 0, 0))
+            p50 = p95 = None
+            if latencies.get(rule_id):
+                values = sorted(latencies[rule_id])
+                p50 = round(percentile(values, 0.5) * 1000, 1)
+                p95 = round(percentile(values, 0.95) * 1000, 1)
+            rows.append((rule_id, evaluations, matches, failures, last_match.get(rule_id), p50, p95, now, rule_id))
+        return rows
+
+    async def flush(self):
+        counts, self.counts = self.counts, {}
+        last_match, self.last_match = self.last_match, {}
+        latencies, self.latencies = self.latencies, {}
+        if not counts and not last_match and not latencies:
+            return
+        try:
+            await self.adb.write(self.write, self.rows(counts, last_match, latencies))
+        except sqlite3.Error as e:
+            print(f"⚠️ 规则统计写入失败，下次重试：{e}")
+            # 合并回去，不丢计数；期间产生的新值优先
+            for rule_id, c in counts.items():
+                cur = self.counts.setdefault(rule_id, [0, 0, 0])
+                for i, n in enumerate(c):
+                    cur[i] += n
+            self.last_match = {**last_match, **self.last_match}
+            for rule_id, window in latencies.items():
+                self.latencies.setdefault(rule_id, window)
+
+    @staticmethod
+    def write(conn, rows: list):
+        conn.executemany(ADD_STATS_SQL, rows)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
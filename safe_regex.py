@@ -0,0 +1,336 @@
+import asyncio
+import multiprocessing
+import os
+import re
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+# 规则里的 merchant_regex 由后台录入：保存时校验（能编译、至少一个捕获组、没有嵌套的无界重复、
+# 没有相邻且能匹配相同字符的无界重复），加载规则时编译一次。静态分析认为可能回溯爆炸的正则（旧数据或漏网的写法）放到子进程里执行，
+# 超过 REGEX_TIMEOUT_SECONDS 直接杀掉子进程，不会卡住事件循环里的其它机器人
+REGEX_TIMEOUT_SECONDS = float(os.environ.get("REGEX_TIMEOUT_SECONDS", 0.5))
+REGEX_WORKERS = int(os.environ.get("REGEX_WORKERS", 2))
+# re2：线性时间引擎，不会回溯爆炸（pip install google-re2）；不支持的语法（反向引用、环视）仍用 re
+REGEX_ENGINE = os.environ.get("REGEX_ENGINE", "re").strip().lower()
+REGEX_MAX_LENGTH = 500
+
+re2 = None
+if REGEX_ENGINE == "re2":
+    try:
+        import re2
+    except ImportError:
+        print("⚠️ REGEX_ENGINE=re2 但未安装 google-re2（pip install google-re2），改用 re")
+
+UNBOUNDED = sre_parse.MAXREPEAT
+REPEAT_OPS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+if hasattr(sre_parse, "POSSESSIVE_REPEAT"):
+    REPEAT_OPS.add(sre_parse.POSSESSIVE_REPEAT)
+
+
+class RegexSandboxError(Exception):
+    # 正则子进程启动失败、中途退出等
+    pass
+
+
+class RegexTimeout(RegexSandboxError):
+    pass
+
+
+def _children(op, av):
+    # 返回某个节点下的子模式列表
+    if op in REPEAT_OPS:
+        return [av[2]]
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_parse.BRANCH:
+        return list(av[1])
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op == sre_parse.GROUPREF_EXISTS:
+        return [p for p in av[1:] if p is not None]
+    if op == getattr(sre_parse, "ATOMIC_GROUP", None):
+        return [av]
+    return []
+
+def _scan(pattern, in_repeat: bool, found: set):
+    # found 里记录发现的风险：nested（无界重复里套无界重复）、branch（无界重复里有分支）、backref（反向引用）
+    for op, av in pattern:
+        if op in REPEAT_OPS and av[1] == UNBOUNDED:
+            if in_repeat:
+                found.add("nested")
+            for child in _children(op, av):
+                _scan(child, True, found)
+            continue
+        if op == sre_parse.BRANCH and in_repeat:
+            found.add("branch")
+        if op in (sre_parse.GROUPREF, sre_parse.GROUPREF_EXISTS):
+            found.add("backref")
+        for child in _children(op, av):
+            _scan(child, in_repeat, found)
+
+# 判断两个字符集是否相交时用的样本字符：ASCII、常见的全角/中文/空白字符，再加上正则里出现的字面字符
+SAMPLE_CODES = frozenset(range(128)) | {0xA0, 0xE9, 0x2028, 0x3000, 0x4E2D, 0xFF1A}
+CATEGORY_RE = {
+    sre_parse.CATEGORY_DIGIT: re.compile(r"\d"),
+    sre_parse.CATEGORY_NOT_DIGIT: re.compile(r"\D"),
+    sre_parse.CATEGORY_SPACE: re.compile(r"\s"),
+    sre_parse.CATEGORY_NOT_SPACE: re.compile(r"\S"),
+    sre_parse.CATEGORY_WORD: re.compile(r"\w"),
+    sre_parse.CATEGORY_NOT_WORD: re.compile(r"\W"),
+}
+CHAR_OPS = {sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN}
+ZERO_WIDTH_OPS = {sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT}
+
+def _literal_codes(pattern, codes: set):
+    for op, av in pattern:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL):
+            codes.add(av)
+        elif op == sre_parse.IN:
+            for item_op, item_av in av:
+                if item_op == sre_parse.LITERAL:
+                    codes.add(item_av)
+                elif item_op == sre_parse.RANGE:
+                    codes.update(item_av)
+        for child in _children(op, av):
+            _literal_codes(child, codes)
+
+def _in_class(items, code: int) -> bool:
+    negate = hit = False
+    for op, av in items:
+        if op == sre_parse.NEGATE:
+            negate = True
+        elif op == sre_parse.LITERAL:
+            hit = hit or av == code
+        elif op == sre_parse.RANGE:
+            hit = hit or av[0] <= code <= av[1]
+        elif op == sre_parse.CATEGORY and av in CATEGORY_RE:
+            hit = hit or bool(CATEGORY_RE[av].match(chr(code)))
+        else:
+            hit = True
+    return hit != negate
+
+def _charset(op, av, sample: frozenset) -> frozenset:
+    # 单个字符项能匹配的样本字符；不认识的写法保守地当作能匹配任何字符
+    if op == sre_parse.LITERAL:
+        return frozenset([av])
+    if op == sre_parse.NOT_LITERAL:
+        return sample - {av}
+    if op == sre_parse.IN:
+        return frozenset(c for c in sample if _in_class(av, c))
+    return sample
+
+def _body_charset(pattern, sample: frozenset):
+    # 重复的循环体如果只匹配一个字符，返回它的字符集；否则返回 None
+    items = list(pattern)
+    while len(items) == 1 and items[0][0] == sre_parse.SUBPATTERN:
+        items = list(items[0][1][-1])
+    if len(items) == 1 and items[0][0] in CHAR_OPS:
+        return _charset(items[0][0], items[0][1], sample)
+    return None
+
+def _flatten(pattern):
+    # 分组本身不消耗字符，把组里的内容摊平到外层序列里
+    for op, av in pattern:
+        if op == sre_parse.SUBPATTERN:
+            yield from _flatten(av[-1])
+        else:
+            yield op, av
+
+def _scan_overlap(pattern, sample: frozenset, found: set):
+    # 同一序列里两个无界重复之间只隔着可选项或它们都能匹配的字符（如 .*.*=、\d+\s*\d+x、.*=.*=），
+    # 不匹配时要把文本在两者之间的每种切分都试一遍，耗时随文本长度多项式增长。
+    # live 里是前面还能和后面的无界重复抢字符的字符集（已经和中间的必需字符求过交集）
+    live = []
+    for op, av in _flatten(pattern):
+        for child in _children(op, av):
+            _scan_overlap(child, sample, found)
+        if op in REPEAT_OPS:
+            lo, hi, body = av
+            chars = _body_charset(body, sample)
+            if hi == UNBOUNDED:
+                chars = sample if chars is None else chars
+                if any(chars & prev for prev in live):
+                    found.add("overlap")
+                live = live + [chars] if lo == 0 else [chars]
+            elif lo == 0:
+                continue
+            elif chars is not None:
+                live = [prev & chars for prev in live if prev & chars]
+            else:
+                live = []
+        elif op in ZERO_WIDTH_OPS:
+            continue
+        elif op in CHAR_OPS:
+            chars = _charset(op, av, sample)
+            live = [prev & chars for prev in live if prev & chars]
+        else:
+            live = []
+
+def risks(pattern: str) -> set:
+    found = set()
+    parsed = sre_parse.parse(pattern)
+    _scan(parsed, False, found)
+    codes = set(SAMPLE_CODES)
+    _literal_codes(parsed, codes)
+    _scan_overlap(parsed, frozenset(codes), found)
+    return found
+
+def validate(pattern: str) -> str:
+    # 后台保存规则时调用；返回错误信息，空字符串表示可以保存
+    if len(pattern) > REGEX_MAX_LENGTH:
+        return f"商户订单号正则不能超过 {REGEX_MAX_LENGTH} 个字符"
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        return f"商户订单号正则无效：{e}"
+    if compiled.groups < 1:
+        return "商户订单号正则需要至少一个捕获组 ( )，第 1 组作为商户订单号"
+    if "nested" in risks(pattern):
+        return "商户订单号正则包含嵌套的重复（如 (a+)+、(.*)*），可能导致匹配卡死，请改写"
+    if "overlap" in risks(pattern):
+        return "商户订单号正则里有相邻、能匹配相同字符的无界重复（如 .*.*、\\d+\\s*\\d+），可能导致匹配很慢，请改写（例如去掉开头的 .*，或用 [^x]* 限定范围）"
+    return ""
+
+
+def _worker_main(conn):
+    # 子进程：按 (正则, 操作, 参数) 执行并返回可序列化的结果
+    cache = {}
+    conn.send(("ready", None))
+    while True:
+        try:
+            pattern, op, text, repl, count = conn.recv()
+        except EOFError:
+            return
+        try:
+            regex = cache.get(pattern)
+            if regex is None:
+                if len(cache) >= 256:
+                    cache.clear()
+                regex = cache[pattern] = re.compile(pattern)
+            if op == "search":
+                m = regex.search(text)
+                conn.send(("ok", m.groups() if m else None))
+            else:
+                conn.send(("ok", regex.sub(repl, text, count=count)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class RegexSandbox:
+    # 常驻的正则子进程；每个子进程同一时间只执行一个任务，超时的子进程被杀掉，下次按需重新启动
+    def __init__(self, size: int = REGEX_WORKERS, timeout: float = REGEX_TIMEOUT_SECONDS):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ctx = multiprocessing.get_context("spawn")
+        self.idle = []
+        self.slots = None
+
+        self.runs = 0
+        self.timeouts = 0
+        self.started = 0
+
+    def spawn(self):
+        parent, child = self.ctx.Pipe()
+        process = self.ctx.Process(target=_worker_main, args=(child,), name="regex-sandbox", daemon=True)
+        try:
+            process.start()
+        except OSError as e:
+            parent.close()
+            child.close()
+            raise RegexSandboxError(f"正则子进程启动失败：{e}")
+        child.close()
+        # 等子进程启动完成（spawn 要重新导入主模块）再开始计时，启动耗时不算进正则的时间预算
+        try:
+            parent.recv()
+        except (EOFError, OSError):
+            process.join(1)
+            parent.close()
+            raise RegexSandboxError("正则子进程启动失败")
+        self.started += 1
+        return process, parent
+
+    async def run(self, pattern: str, op: str, text: str, repl=None, count: int = 0):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        loop = asyncio.get_running_loop()
+        async with self.slots:
+            worker = self.idle.pop() if self.idle else await asyncio.to_thread(self.spawn)
+            process, conn = worker
+            fd = conn.fileno()
+            ready = loop.create_future()
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                conn.send((pattern, op, text, repl, count))
+                self.runs += 1
+                await asyncio.wait_for(ready, self.timeout)
+                status, result = conn.recv()
+            except asyncio.TimeoutError:
+                loop.remove_reader(fd)
+                self.timeouts += 1
+                self.discard(worker)
+                raise RegexTimeout(f"正则执行超过 {self.timeout}s，已中止：{pattern[:100]}")
+            except (EOFError, OSError) as e:
+                # 子进程中途退出、管道断开
+                loop.remove_reader(fd)
+                self.discard(worker)
+                raise RegexSandboxError(f"正则子进程异常退出：{e!r}")
+            except BaseException:
+                # 被取消（例如进程退出）：子进程可能还在算，不再复用
+                loop.remove_reader(fd)
+                self.discard(worker)
+                raise
+            loop.remove_reader(fd)
+            self.idle.append(worker)
+        if status == "error":
+            raise re.error(result)
+        return result
+
+    def discard(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join(1)
+        conn.close()
+
+    def close(self):
+        while self.idle:
+            process, conn = self.idle.pop()
+            conn.close()
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "timeouts": self.timeouts, "started": self.started}
+
+
+sandbox = RegexSandbox()
+
+
+class SafeRegex:
+    # 规则加载时编译一次。没有风险的正则直接在当前线程执行（和 re 一样快），有风险的交给 sandbox
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.risky = bool(risks(pattern))
+        if re2 is not None:
+            try:
+                self.regex = re2.compile(pattern)
+                self.risky = False
+            except Exception:
+                pass
+
+    async def search(self, text: str):
+        # 返回 match.groups()，没匹配到返回 None；超时抛 RegexTimeout，子进程出问题抛 RegexSandboxError，
+        # 正则执行出错抛 re.error
+        if not self.risky:
+            m = self.regex.search(text)
+            return m.groups() if m else None
+        return await sandbox.run(self.pattern, "search", text)
+
+    async def sub(self, repl: str, text: str, count: int = 0) -> str:
+        if not self.risky:
+            return self.regex.sub(repl, text, count=count)
+        return await sandbox.run(self.pattern, "sub", text, repl, count)
@@ -0,0 +1,138 @@
+import asyncio
+import os
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+# Telegram 限制：单个机器人全局约 30 条/秒，同一个群约 20 条/分钟，同一私聊约 1 条/秒
+SEND_GLOBAL_PER_SECOND = float(os.environ.get("SEND_GLOBAL_PER_SECOND", 30))
+SEND_GROUP_PER_MINUTE = float(os.environ.get("SEND_GROUP_PER_MINUTE", 20))
+SEND_PRIVATE_PER_SECOND = float(os.environ.get("SEND_PRIVATE_PER_SECOND", 1))
+SEND_CHAT_BURST = float(os.environ.get("SEND_CHAT_BURST", 3))
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", 5))
+
+# 空闲的群令牌桶超过这个数量时清理
+MAX_IDLE_BUCKETS = 1000
+
+# 只有发消息/改消息的接口受 Telegram 发送限制；getUpdates、getMe、deleteWebhook 等直接放行，
+# 发送排队时不会拖慢拉取消息
+LIMITED_ENDPOINT_PREFIXES = ("send", "edit", "copy", "forward")
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # asyncio.Lock 按先来后到唤醒，保证同一个桶内先到先发
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        return not self.lock.locked() and time.monotonic() >= self.blocked_until and \
+            self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class SendScheduler(BaseRateLimiter):
+    # 每个机器人一个：按目标会话令牌桶 + 机器人全局令牌桶排队发送；
+    # 遇到 RetryAfter 暂停该会话后重发，而不是直接失败
+    def __init__(self, bot_id: int):
+        self.bot_id = bot_id
+        self.global_bucket = TokenBucket(SEND_GLOBAL_PER_SECOND, SEND_GLOBAL_PER_SECOND)
+        self.chat_buckets = {}
+
+        self.waiting = 0
+        self.sent = 0
+        self.retry_after = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def bucket_for(self, chat_id):
+        key = str(chat_id)
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_IDLE_BUCKETS:
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.idle()}
+            if key.startswith("-"):
+                bucket = TokenBucket(SEND_GROUP_PER_MINUTE / 60, SEND_CHAT_BURST)
+            else:
+                bucket = TokenBucket(SEND_PRIVATE_PER_SECOND, SEND_CHAT_BURST)
+            self.chat_buckets[key] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(LIMITED_ENDPOINT_PREFIXES):
+            return await callback(*args, **kwargs)
+        chat_id = data.get("chat_id")
+        bucket = self.bucket_for(chat_id) if chat_id is not None else None
+
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            t0 = time.monotonic()
+            self.waiting += 1
+            try:
+                if bucket is not None:
+                    await bucket.acquire()
+                await self.global_bucket.acquire()
+            finally:
+                self.waiting -= 1
+            waited = time.monotonic() - t0
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            metrics.send_wait_seconds.observe(waited, self.bot_id)
+
+            t0 = time.perf_counter()
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after += 1
+                metrics.send_retry_after.inc(self.bot_id)
+                if attempt >= SEND_MAX_RETRIES:
+                    raise
+                print(f"⏳ bot_id={self.bot_id} {endpoint} chat={chat_id} 触发限流，{e.retry_after}s 后重发")
+                (bucket or self.global_bucket).block(float(e.retry_after))
+                continue
+            except Exception as e:
+                # 调用方（send_as_bot 等）可能吞掉异常改用别的方式重发，这里先记下来
+                metrics.send_errors.inc(self.bot_id, endpoint, type(e).__name__)
+                raise
+            finally:
+                metrics.send_seconds.observe(time.perf_counter() - t0, self.bot_id, endpoint)
+            self.sent += 1
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "waiting": self.waiting,
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "wait_avg": round(self.wait_total / self.sent, 3) if self.sent else 0.0,
+            "wait_max": round(self.wait_max, 3),
+            "chats": len(self.chat_buckets),
+        }
@@ -0,0 +1,163 @@
+import asyncio
+import bisect
+import hashlib
+import os
+import time
+
+from config_version import SCOPE_BOTS
+
+# RUNNER_SHARDS > 1 时 bot_runner 以多进程运行：协调进程按一致性哈希把机器人分给各个 worker 进程
+RUNNER_SHARDS = int(os.environ.get("RUNNER_SHARDS", 1))
+SHARD_HEARTBEAT_SECONDS = float(os.environ.get("SHARD_HEARTBEAT_SECONDS", 5))
+# 超过这个时间没收到心跳，认为 worker 卡死，杀掉重启
+SHARD_HEARTBEAT_TIMEOUT = float(os.environ.get("SHARD_HEARTBEAT_TIMEOUT", 60))
+SHARD_STOP_SECONDS = float(os.environ.get("SHARD_STOP_SECONDS", 30))
+
+# 每个分片在环上的虚拟节点数，越多分布越均匀
+RING_REPLICAS = 100
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    # 一致性哈希：分片数变化时只有少部分机器人换分片
+    def __init__(self, nodes, replicas: int = RING_REPLICAS):
+        points = sorted((ring_hash(f"shard-{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for h, _ in points]
+        self.nodes = [n for _, n in points]
+
+    def node_for(self, bot_id: int):
+        i = bisect.bisect(self.hashes, ring_hash(f"bot-{bot_id}")) % len(self.hashes)
+        return self.nodes[i]
+
+    def assign(self, bots) -> dict:
+        # bots: [(bot_id, token, name)] → {shard: [(bot_id, token, name)]}
+        out = {node: [] for node in set(self.nodes)}
+        for bot in bots:
+            out[self.node_for(bot[0])].append(bot)
+        return out
+
+
+class ShardWorker:
+    # 协调进程里对一个 worker 进程的封装：启动、通过管道下发分配、收心跳、停止
+    def __init__(self, index: int, target, ctx):
+        self.index = index
+        self.target = target
+        self.ctx = ctx
+        self.process = None
+        self.conn = None
+        self.starts = 0
+        self.last_heartbeat = 0.0
+        self.heartbeat = {}
+
+    def start(self):
+        parent, child = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=self.target, args=(self.index, child), name=f"bot-shard-{self.index}")
+        self.process.start()
+        child.close()
+        self.conn = parent
+        self.starts += 1
+        self.last_heartbeat = time.monotonic()
+        self.heartbeat = {}
+        print(f"🧩 分片 {self.index} 已启动 pid={self.process.pid}")
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def stale(self) -> bool:
+        return time.monotonic() - self.last_heartbeat > SHARD_HEARTBEAT_TIMEOUT
+
+    def send(self, kind: str, payload=None):
+        try:
+            self.conn.send((kind, payload))
+        except (BrokenPipeError, OSError):
+            pass
+
+    def receive(self):
+        while True:
+            try:
+                if not self.conn.poll():
+                    return
+                kind, payload = self.conn.recv()
+            except (EOFError, OSError):
+                return
+            if kind == "heartbeat":
+                self.last_heartbeat = time.monotonic()
+                self.heartbeat = payload
+
+    def kill(self):
+        if self.process is None:
+            return
+        self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+    def stop(self, timeout: float = SHARD_STOP_SECONDS):
+        # 先请求优雅退出（停止拉取、执行完排队动作），超时再强杀
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.process.join(timeout)
+        if self.process.is_alive():
+            print(f"⚠️ 分片 {self.index} 未在 {timeout:.0f}s 内退出，强制结束")
+            self.kill()
+        self.conn.close()
+
+
+class ShardLink:
+    # worker 进程一侧：接收协调进程下发的机器人列表，接口与 ConfigWatcher 一致（wakeup / wait_changes）
+    def __init__(self, index: int, conn):
+        self.index = index
+        self.conn = conn
+        self.bots = []
+        self.changed = set()
+        self.wakeup = asyncio.Event()
+        self.on_stop = None
+        self.last_sent = 0.0
+
+    def attach(self, on_stop):
+        self.on_stop = on_stop
+        asyncio.get_running_loop().add_reader(self.conn.fileno(), self.readable)
+
+    def readable(self):
+        while True:
+            try:
+                if not self.conn.poll():
+                    return
+                kind, payload = self.conn.recv()
+            except (EOFError, OSError):
+                # 协调进程已退出：跟着退出，避免同一个 token 被两个进程同时拉取
+                asyncio.get_running_loop().remove_reader(self.conn.fileno())
+                self.on_stop()
+                return
+            if kind == "assign":
+                self.bots = payload
+                self.changed.add(SCOPE_BOTS)
+            elif kind == "changed":
+                self.changed.update(payload)
+            elif kind == "stop":
+                self.on_stop()
+            self.wakeup.set()
+
+    async def wait_changes(self, timeout: float) -> set:
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def send_heartbeat(self, states: dict, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_sent < SHARD_HEARTBEAT_SECONDS:
+            return
+        self.last_sent = now
+        try:
+            self.conn.send(("heartbeat", {"pid": os.getpid(), "states": states}))
+        except (BrokenPipeError, OSError):
+            pass
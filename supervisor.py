@@ -0,0 +1,238 @@
+import asyncio
+import os
+import time
+
+from telegram.request import HTTPXRequest
+
+# 崩溃后按指数退避重启：2s、4s、8s ... 最长 SUPERVISOR_BACKOFF_MAX 秒；
+# 连续稳定运行 SUPERVISOR_STABLE_SECONDS 后退避清零
+SUPERVISOR_BACKOFF_BASE = float(os.environ.get("SUPERVISOR_BACKOFF_BASE", 2))
+SUPERVISOR_BACKOFF_MAX = float(os.environ.get("SUPERVISOR_BACKOFF_MAX", 300))
+SUPERVISOR_STABLE_SECONDS = float(os.environ.get("SUPERVISOR_STABLE_SECONDS", 60))
+# 运行中每隔多久检查一次拉取任务是否还活着
+SUPERVISOR_CHECK_SECONDS = float(os.environ.get("SUPERVISOR_CHECK_SECONDS", 5))
+# 超过这么久没有完成过一次 getUpdates 请求（成功或失败都算）视为拉取已中断；
+# 正常长轮询每 10s 左右一次，网络出错时 PTB 的重试间隔最长 30s
+SUPERVISOR_POLL_STALE_SECONDS = float(os.environ.get("SUPERVISOR_POLL_STALE_SECONDS", 120))
+# 所有机器人共用的 Bot API 连接池大小（getUpdates 长轮询另有各自的连接）
+TG_POOL_SIZE = int(os.environ.get("TG_POOL_SIZE", 32))
+
+STATE_STARTING = "starting"
+STATE_RUNNING = "running"
+STATE_STOPPING = "stopping"
+STATE_STOPPED = "stopped"
+STATE_CRASHED = "crashed"
+STATE_BACKOFF = "backoff"
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    # 多个 Application 共用；单个 Application.shutdown() 不关闭连接池，由 supervisor 统一关闭
+    async def shutdown(self):
+        pass
+
+    async def close(self):
+        await super().shutdown()
+
+
+class PollingRequest(HTTPXRequest):
+    # 每个机器人单独的 getUpdates 连接：每次请求结束时回调，supervisor 据此判断拉取是否还在进行
+    def __init__(self, on_done, **kwargs):
+        super().__init__(**kwargs)
+        self.on_done = on_done
+
+    async def do_request(self, *args, **kwargs):
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            self.on_done()
+
+
+class BotHandle:
+    def __init__(self, bot_id: int, token: str, name: str):
+        self.bot_id = bot_id
+        self.token = token
+        self.name = name
+        self.state = STATE_STOPPED
+        self.task = None
+        self.app = None
+        self.failures = 0
+        self.restarts = 0
+        self.last_error = ""
+        self.stop_event = asyncio.Event()
+        self.restart_event = asyncio.Event()
+        # 最近一次 getUpdates 请求结束的时间（time.monotonic()）
+        self.last_poll_at = 0.0
+
+    def backoff_delay(self) -> float:
+        return min(SUPERVISOR_BACKOFF_MAX, SUPERVISOR_BACKOFF_BASE * (2 ** max(0, self.failures - 1)))
+
+
+class BotSupervisor:
+    # 管理所有机器人的生命周期：starting → running → stopping → stopped，
+    # 出错进入 crashed → backoff 后自动重启。状态变化通过 on_state 回调上报
+    def __init__(self, build_app, on_state=None, on_stopped=None, ingress=None):
+        # build_app(bot_id, token, name, request, get_updates_request) -> Application
+        # on_stopped(bot_id, app)：app.stop() 之后、app.shutdown() 之前调用，用来收尾排队中的任务
+        # ingress：webhook 模式下的 WebhookIngress，为空则用 getUpdates 长轮询
+        self.build_app = build_app
+        self.on_state = on_state
+        self.on_stopped = on_stopped
+        self.ingress = ingress
+        self.closing = False
+        self.request = SharedHTTPXRequest(connection_pool_size=TG_POOL_SIZE)
+        self.handles = {}
+        self.warned_polling_task = False
+
+    def set_state(self, handle: BotHandle, state: str):
+        handle.state = state
+        if self.on_state is not None:
+            self.on_state(handle)
+
+    def reconcile(self, bots):
+        # bots: [(bot_id, token, name)]，使正在运行的机器人与之一致
+        wanted = {bot_id: (token, name) for bot_id, token, name in bots}
+        for bot_id, (token, name) in wanted.items():
+            handle = self.handles.get(bot_id)
+            if handle is None or handle.task is None or handle.task.done():
+                self.start_bot(bot_id, token, name)
+            elif handle.stop_event.is_set():
+                # 正在停止中又被重新启用：等旧实例完全停下再启动新实例
+                self.start_bot(bot_id, token, name, after=handle.task)
+            elif (handle.token, handle.name) != (token, name):
+                print(f"🔁 bot_id={bot_id} 配置已修改，重启")
+                handle.token, handle.name = token, name
+                handle.restart_event.set()
+        for bot_id in list(self.handles):
+            if bot_id not in wanted:
+                self.handles[bot_id].stop_event.set()
+
+    def start_bot(self, bot_id: int, token: str, name: str, after=None):
+        handle = BotHandle(bot_id, token, name)
+        self.handles[bot_id] = handle
+        handle.task = asyncio.create_task(self.run_bot(handle, after))
+
+    async def run_bot(self, handle: BotHandle, after=None):
+        if after is not None:
+            await asyncio.gather(after, return_exceptions=True)
+        try:
+            while not handle.stop_event.is_set():
+                handle.restart_event.clear()
+                started_at = None
+                try:
+                    self.set_state(handle, STATE_STARTING)
+                    poll_request = None
+                    if self.ingress is None:
+                        poll_request = PollingRequest(
+                            lambda h=handle: setattr(h, "last_poll_at", time.monotonic()), connection_pool_size=1
+                        )
+                    handle.app = await self.build_app(handle.bot_id, handle.token, handle.name, self.request,
+                                                      poll_request)
+                    await handle.app.initialize()
+                    await handle.app.start()
+                    if self.ingress is None:
+                        handle.last_poll_at = time.monotonic()
+                        await handle.app.updater.start_polling(
+                            error_callback=lambda e, h=handle: self.polling_error(h, e)
+                        )
+                    else:
+                        await self.ingress.attach(handle.bot_id, handle.app)
+                    started_at = time.monotonic()
+                    print(f"🤖 启动机器人 bot_id={handle.bot_id} name={handle.name}")
+                    self.set_state(handle, STATE_RUNNING)
+                    await self.wait_stop_or_restart(handle)
+                except Exception as e:
+                    handle.failures += 1
+                    handle.last_error = f"{type(e).__name__}: {e}"[:500]
+                    print(f"💥 bot_id={handle.bot_id} 运行失败（第 {handle.failures} 次）：{e!r}")
+                    self.set_state(handle, STATE_CRASHED)
+                finally:
+                    if handle.app is not None:
+                        if handle.state != STATE_CRASHED:
+                            self.set_state(handle, STATE_STOPPING)
+                        await self.stop_app(handle)
+
+                if started_at is not None and time.monotonic() - started_at >= SUPERVISOR_STABLE_SECONDS:
+                    handle.failures = 0
+                if handle.stop_event.is_set():
+                    break
+                handle.restarts += 1
+                if handle.state == STATE_CRASHED:
+                    delay = handle.backoff_delay()
+                    self.set_state(handle, STATE_BACKOFF)
+                    print(f"⏳ bot_id={handle.bot_id} {delay:.0f}s 后重启")
+                    try:
+                        await asyncio.wait_for(handle.stop_event.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.set_state(handle, STATE_STOPPED)
+            if self.handles.get(handle.bot_id) is handle:
+                del self.handles[handle.bot_id]
+            print(f"🛑 已停止 bot_id={handle.bot_id}")
+
+    async def wait_stop_or_restart(self, handle: BotHandle):
+        waiters = [asyncio.create_task(handle.stop_event.wait()), asyncio.create_task(handle.restart_event.wait())]
+        try:
+            while True:
+                done, _ = await asyncio.wait(waiters, timeout=SUPERVISOR_CHECK_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if done:
+                    return
+                self.check_polling(handle)
+        finally:
+            for w in waiters:
+                w.cancel()
+
+    def check_polling(self, handle: BotHandle):
+        updater = handle.app.updater
+        if not updater.running:
+            raise RuntimeError("拉取消息已停止")
+        # Token 被吊销（InvalidToken）时 PTB 直接结束拉取任务，不走 error_callback，updater.running 仍为 True。
+        # 拉取任务是 PTB 的私有属性，能拿到时直接看它是否结束；拿不到（PTB 升级改了名）时只靠下面的请求间隔判断
+        if hasattr(updater, "_Updater__polling_task"):
+            task = updater._Updater__polling_task
+            if task is not None and task.done():
+                error = None if task.cancelled() else task.exception()
+                raise RuntimeError(f"拉取消息已中断：{error!r}")
+        elif not self.warned_polling_task:
+            self.warned_polling_task = True
+            print("⚠️ 当前 PTB 版本没有 Updater.__polling_task，改为按 getUpdates 请求间隔判断拉取是否中断")
+        idle = time.monotonic() - handle.last_poll_at
+        if idle > SUPERVISOR_POLL_STALE_SECONDS:
+            raise RuntimeError(f"拉取消息已中断：{idle:.0f}s 没有完成 getUpdates 请求")
+
+    def polling_error(self, handle: BotHandle, error):
+        handle.last_error = f"{type(error).__name__}: {error}"[:500]
+        print(f"⚠️ bot_id={handle.bot_id} 拉取消息出错：{error!r}")
+
+    async def stop_app(self, handle: BotHandle):
+        # 依次停止拉取、停止处理、收尾排队任务、释放资源；任何一步失败都继续往下
+        app, handle.app = handle.app, None
+        if self.ingress is not None:
+            # 只有机器人被禁用/删除时才撤销 webhook；整体退出或重启时保留
+            delete = handle.stop_event.is_set() and not self.closing
+            await self.quietly(self.ingress.detach(handle.bot_id, app, delete=delete))
+        if app.updater is not None and app.updater.running:
+            await self.quietly(app.updater.stop())
+        if app.running:
+            await self.quietly(app.stop())
+        if self.on_stopped is not None:
+            await self.quietly(self.on_stopped(handle.bot_id, app))
+        await self.quietly(app.shutdown())
+
+    async def quietly(self, coro):
+        try:
+            await coro
+        except Exception as e:
+            print(f"⚠️ 停止机器人时出错：{e!r}")
+
+    async def close(self):
+        self.closing = True
+        for handle in self.handles.values():
+            handle.stop_event.set()
+        tasks = [h.task for h in self.handles.values() if h.task is not None]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.request.close()
+
+    def states(self) -> dict:
+        return {bot_id: h.state for bot_id, h in self.handles.items()}
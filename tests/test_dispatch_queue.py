@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+
+from dispatch_queue import DispatchQueue
+
+
+class DispatchQueueTest(unittest.TestCase):
+    def test_different_keys_proceed_independently(self):
+        # 按 hash(key) % 2 分队列时 0 和 2 会排在同一条里；现在 key 0 的慢任务不挡 key 2
+        async def run():
+            dq = DispatchQueue(1, workers=2)
+            dq.start()
+            release = asyncio.Event()
+            done = []
+
+            async def slow():
+                await release.wait()
+                done.append("slow")
+
+            async def fast():
+                done.append("fast")
+
+            await dq.submit(0, slow)
+            await dq.submit(2, fast)
+            await asyncio.sleep(0.05)
+            self.assertEqual(done, ["fast"])
+            release.set()
+            await dq.close(timeout=1)
+            self.assertEqual(done, ["fast", "slow"])
+
+        asyncio.run(run())
+
+    def test_same_key_runs_in_order_one_at_a_time(self):
+        async def run():
+            dq = DispatchQueue(1, workers=4)
+            dq.start()
+            running, order = [], []
+
+            def job(i):
+                async def fn():
+                    running.append(i)
+                    self.assertEqual(len(running), 1)
+                    await asyncio.sleep(0.001 * (5 - i))
+                    order.append(i)
+                    running.remove(i)
+                return fn
+
+            for i in range(5):
+                await dq.submit(("-100", "-200"), job(i))
+            await dq.close(timeout=1)
+            self.assertEqual(order, [0, 1, 2, 3, 4])
+            self.assertEqual(dq.stats()["completed"], 5)
+            self.assertEqual(dq.depth(), 0)
+
+        asyncio.run(run())
+
+    def test_submit_waits_when_full(self):
+        async def run():
+            dq = DispatchQueue(1, workers=1, max_queue=2)
+            release = asyncio.Event()
+
+            async def blocked():
+                await release.wait()
+
+            await dq.submit(1, blocked)
+            await dq.submit(2, blocked)
+            third = asyncio.create_task(dq.submit(3, blocked))
+            await asyncio.sleep(0.01)
+            self.assertFalse(third.done())
+            dq.start()
+            await asyncio.sleep(0.01)
+            self.assertTrue(third.done())
+            release.set()
+            await dq.close(timeout=1)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import pay_api
+
+# 运行：python -m unittest discover tests
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class TimestampReprobeTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(pay_api.time, "monotonic", self.clock.monotonic)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reprobe_fires_under_continuous_success(self):
+        # 接口只认秒级时间戳：学到 's' 之后每 0.1s 成功一次，0.3s 的探测周期到了仍要按默认顺序重新探测
+        pref = pay_api.TimestampPreference(reprobe_seconds=0.3)
+        tried = []
+
+        async def fake_call(base_api, params, timeout=None):
+            fmt = pay_api.TS_MS if len(params["timestamp"]) > 10 else pay_api.TS_S
+            tried.append(fmt)
+            if fmt == pay_api.TS_S:
+                return {"code": 0, "data": {"payOrderId": "P1"}}
+            return {"code": 1}
+
+        async def run():
+            orders = []
+            for _ in range(10):
+                orders.append(pref.order("http://pay"))
+                pay_order_id, _ = await pay_api.query_pay_order_by_mch_order_no("M1", "http://pay")
+                self.assertEqual(pay_order_id, "P1")
+                self.clock.now += 0.1
+            return orders
+
+        with mock.patch.object(pay_api, "ts_preference", pref), mock.patch.object(pay_api, "call_pay_api", fake_call):
+            orders = asyncio.run(run())
+
+        # 第 0、3、6、9 次是探测（毫秒优先），其余直接用学到的秒级格式
+        self.assertEqual([i for i, o in enumerate(orders) if o is None], [0, 3, 6, 9])
+        self.assertEqual(tried.count(pay_api.TS_MS), 4)
+
+    def test_format_change_restarts_timer(self):
+        pref = pay_api.TimestampPreference(reprobe_seconds=1)
+        pref.learn("http://pay", pay_api.TS_MS, probed=True)
+        self.clock.now += 0.9
+        pref.learn("http://pay", pay_api.TS_MS)
+        self.clock.now += 0.2
+        self.assertIsNone(pref.order("http://pay"))
+        pref.learn("http://pay", pay_api.TS_S)
+        self.assertEqual(pref.order("http://pay"), (pay_api.TS_S, pay_api.TS_MS))
+
+
+if __name__ == "__main__":
+    unittest.main()
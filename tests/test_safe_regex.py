@@ -0,0 +1,23 @@
+import unittest
+
+from safe_regex import SafeRegex, risks, validate
+
+
+class SafeRegexRiskTest(unittest.TestCase):
+    def test_overlapping_unbounded_repeats_are_risky(self):
+        # 这些写法在不匹配的长文本上会把每种切分都试一遍，要进子进程执行，保存时也要拒绝
+        for pattern in [r"(.*.*)=", r".*=.*=(x)", r"(\d+)\s*\d+x", r".*(\d+)x"]:
+            with self.subTest(pattern=pattern):
+                self.assertIn("overlap", risks(pattern))
+                self.assertTrue(SafeRegex(pattern).risky)
+                self.assertNotEqual(validate(pattern), "")
+
+    def test_common_patterns_run_inline(self):
+        for pattern in [r"商户订单号[:：]\s*([A-Za-z0-9_-]+)", r".*?订单号(\d+)", r"(\S+)\s+(\S+)", r"(\d+)x"]:
+            with self.subTest(pattern=pattern):
+                self.assertEqual(risks(pattern), set())
+                self.assertEqual(validate(pattern), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import hashlib
+import hmac
+import os
+import re
+
+from telegram import Update
+
+from mini_http import MiniHTTPServer, Response
+
+# RUNNER_MODE=webhook 时不再每个机器人一条 getUpdates 长轮询，而是由一个 HTTP 入口接收 Telegram 推送
+RUNNER_MODE = os.environ.get("RUNNER_MODE", "polling").strip().lower()
+# 对外可访问的 https 地址（不含路径），Telegram 会推送到 {WEBHOOK_BASE_URL}/webhook/<bot_id>
+WEBHOOK_BASE_URL = os.environ.get("WEBHOOK_BASE_URL", "").strip().rstrip("/")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8443))
+# 生成各机器人 secret_token 的密钥，默认复用 ROBOT_SECRET_KEY
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or os.environ.get("ROBOT_SECRET_KEY", "RobotSecret123456")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+PATH_RE = re.compile(r"^/webhook/(\d+)$")
+
+
+def webhook_secret(bot_id: int, token: str) -> str:
+    # 每个机器人不同，且随 token 变化；Telegram 要求 1-256 位 [A-Za-z0-9_-]
+    return hmac.new(WEBHOOK_SECRET.encode("utf-8"), f"{bot_id}:{token}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def webhook_url(base_url: str, bot_id: int) -> str:
+    return f"{base_url}/webhook/{bot_id}"
+
+
+class WebhookIngress:
+    # 所有机器人共用一个端口；按路径里的 bot_id 找到对应的 Application，校验 secret 后放进它的 update_queue
+    def __init__(self, base_url: str = WEBHOOK_BASE_URL):
+        self.base_url = base_url
+        self.apps = {}
+        self.server = MiniHTTPServer(self.handle)
+
+        self.received = 0
+        self.rejected = 0
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        await self.server.start(host, port)
+        print(f"🌐 Webhook 入口已监听 {host}:{self.server.port}，对外地址 {self.base_url}/webhook/<bot_id>")
+        return self
+
+    async def attach(self, bot_id: int, app):
+        # 先登记再 set_webhook，保证 Telegram 第一条推送过来时已能路由
+        secret = webhook_secret(bot_id, app.bot.token)
+        self.apps[bot_id] = (app, secret)
+        await app.bot.set_webhook(
+            url=webhook_url(self.base_url, bot_id),
+            secret_token=secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+
+    async def detach(self, bot_id: int, app, delete: bool = False):
+        # delete=True 时（机器人被禁用/删除）同时取消 Telegram 侧的 webhook；
+        # 进程重启时保留，停机期间的消息由 Telegram 暂存重推
+        if self.apps.get(bot_id, (None,))[0] is app:
+            del self.apps[bot_id]
+        if delete:
+            await app.bot.delete_webhook()
+
+    async def handle(self, req):
+        m = PATH_RE.match(req.path)
+        if req.method != "POST" or not m:
+            return Response("not found", 404)
+        entry = self.apps.get(int(m.group(1)))
+        if entry is None:
+            # 非 2xx 时 Telegram 会稍后重推，机器人重启期间不丢消息
+            self.rejected += 1
+            return Response("bot not running", 503)
+        app, secret = entry
+        # mini_http 按 latin-1 解码请求头；按字节比较，伪造请求里的非 ASCII 字符不会让 compare_digest 抛 TypeError
+        if not hmac.compare_digest(req.headers.get(SECRET_HEADER, "").encode("latin-1"), secret.encode()):
+            self.rejected += 1
+            return Response("forbidden", 403)
+        try:
+            data = req.json()
+            # 合法 JSON 但不是对象（[]、"x"）时 de_json 会抛 AttributeError，统一按坏请求处理
+            if not isinstance(data, dict):
+                raise ValueError("update is not a JSON object")
+            update = Update.de_json(data, app.bot)
+        except (ValueError, TypeError, KeyError):
+            self.rejected += 1
+            return Response("bad update", 400)
+        if update is None:
+            self.rejected += 1
+            return Response("bad update", 400)
+        self.received += 1
+        # 只入队就返回，处理由 Application 的 update fetcher 完成
+        await app.update_queue.put(update)
+        return Response("ok")
+
+    async def close(self):
+        await self.server.close()
+
+    def stats(self) -> dict:
+        return {"bots": len(self.apps), "received": self.received, "rejected": self.rejected}
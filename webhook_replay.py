@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from telegram.ext import Application
+
+import db
+from webhook import SECRET_HEADER, WEBHOOK_PORT, WebhookIngress, webhook_secret
+
+# 把录制的 Update（每行一个 JSON）按顺序推送到 webhook 入口，验证路由、secret 校验和吞吐
+# 用法：
+#   python webhook_replay.py updates.jsonl --bot-id 1                 推送到本机运行中的 bot_runner（RUNNER_MODE=webhook）
+#   python webhook_replay.py --bot-id 1 --count 500 --local           不连 Telegram，在本进程起入口自测
+# 不给文件时生成 --count 条文本消息；token 默认从数据库读取
+
+
+def load_updates(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def sample_updates(count: int, chat_id: int = -1001234567890):
+    now = int(time.time())
+    return [{
+        "update_id": 100000 + i,
+        "message": {
+            "message_id": i + 1,
+            "date": now,
+            "chat": {"id": chat_id, "type": "supergroup", "title": "replay"},
+            "from": {"id": 10000 + i % 50, "is_bot": False, "first_name": "u"},
+            "text": f"订单 M{i:08d} 已支付",
+        },
+    } for i in range(count)]
+
+def token_from_db(bot_id: int) -> str:
+    conn = db.connect()
+    row = conn.execute("SELECT token FROM bots WHERE id=?", (bot_id,)).fetchone()
+    conn.close()
+    if row is None:
+        raise SystemExit(f"❌ 数据库里没有 bot_id={bot_id}，请用 --token 指定")
+    return str(row[0]).strip()
+
+async def replay(url: str, secret: str, updates, concurrency: int):
+    sem = asyncio.Semaphore(concurrency)
+    codes = {}
+    latencies = []
+
+    async def post(client, update):
+        async with sem:
+            t0 = time.perf_counter()
+            r = await client.post(url, json=update, headers={SECRET_HEADER: secret})
+            latencies.append(time.perf_counter() - t0)
+            codes[r.status_code] = codes.get(r.status_code, 0) + 1
+
+    t0 = time.perf_counter()
+    async with httpx.AsyncClient(timeout=10) as client:
+        await asyncio.gather(*(post(client, u) for u in updates))
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 if latencies else 0.0
+    print(f"推送 {len(updates)} 条，用时 {elapsed:.2f}s（{len(updates) / elapsed:.0f} 条/秒）")
+    print(f"状态码：{codes}；延迟 p50={p(0.5):.1f}ms p95={p(0.95):.1f}ms p99={p(0.99):.1f}ms")
+    return codes
+
+async def local_selftest(bot_id: int, token: str, updates, concurrency: int):
+    # 不调用 set_webhook：直接把 Application 登记到入口，确认推送都进了 update_queue，错误 secret 被拒绝
+    app = Application.builder().token(token).build()
+    ingress = WebhookIngress("http://127.0.0.1")
+    await ingress.server.start("127.0.0.1", 0)
+    ingress.apps[bot_id] = (app, webhook_secret(bot_id, token))
+    url = f"http://127.0.0.1:{ingress.server.port}/webhook/{bot_id}"
+    try:
+        codes = await replay(url, webhook_secret(bot_id, token), updates, concurrency)
+        assert codes == {200: len(updates)}, f"有推送失败：{codes}"
+        assert app.update_queue.qsize() == len(updates), "update_queue 数量不一致"
+
+        async with httpx.AsyncClient() as client:
+            bad = await client.post(url, json=updates[0], headers={SECRET_HEADER: "wrong"})
+            missing = await client.post(f"http://127.0.0.1:{ingress.server.port}/webhook/{bot_id + 1}", json=updates[0])
+        assert bad.status_code == 403, f"错误 secret 未被拒绝：{bad.status_code}"
+        assert missing.status_code == 503, f"未运行的机器人应返回 503：{missing.status_code}"
+        print(f"✅ 自测通过：{ingress.stats()}")
+    finally:
+        await ingress.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="向 webhook 入口重放 Telegram Update")
+    parser.add_argument("file", nargs="?", help="Update JSONL 文件，每行一个 Update")
+    parser.add_argument("--bot-id", type=int, required=True)
+    parser.add_argument("--token", help="机器人 token，默认从数据库读取")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}", help="入口地址（不含 /webhook/<bot_id>）")
+    parser.add_argument("--count", type=int, default=200, help="不给文件时生成的消息条数")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--local", action="store_true", help="在本进程启动入口自测，不连接 Telegram")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else sample_updates(args.count)
+    if not updates:
+        raise SystemExit("❌ 没有可推送的 Update")
+
+    if args.local:
+        token = args.token or "123456:replay-selftest"
+        asyncio.run(local_selftest(args.bot_id, token, updates, args.concurrency))
+        return
+
+    token = args.token or token_from_db(args.bot_id)
+    url = f"{args.url.rstrip('/')}/webhook/{args.bot_id}"
+    asyncio.run(replay(url, webhook_secret(args.bot_id, token), updates, args.concurrency))
+
+if __name__ == "__main__":
+    main()